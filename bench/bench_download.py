@@ -0,0 +1,168 @@
+"""Speicherbedarf paralleler Dokument-Downloads (downloads.py).
+
+--users Nutzer schicken gleichzeitig je einen Scan von --mb MB. Verglichen
+wird der bisherige Weg (get_file + download_to_memory in ein BytesIO,
+getvalue(), Übergabe der Bytes an den Prozess-Pool) mit downloads.fetch
+(Typ/Größe vorab, blockweise in einen Spool, an den Pool geht nur der
+Pfad). Die Übergabe wird wie im ProcessPoolExecutor mit pickle
+serialisiert. Alle Downloads bleiben bis zum Schluss offen, wie beim
+Warten in der OCR-Warteschlange.
+
+Jede Variante läuft in einem eigenen Prozess; gemessen wird der Zuwachs des
+Spitzen-RSS gegenüber dem Stand nach den Imports. FakeTelegram läuft in
+einem weiteren Prozess, damit dessen Puffer nicht mitzählen. Stimmt ein
+SHA-256 nicht oder braucht downloads.fetch mehr als --budget-mb, endet das
+Skript mit Code 1.
+
+    python bench/bench_download.py --users 16 --mb 20
+"""
+import os
+import io
+import sys
+import json
+import time
+import pickle
+import random
+import socket
+import asyncio
+import hashlib
+import logging
+import argparse
+import resource
+import subprocess
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "bot"))
+
+MODES = ("download_to_memory", "downloads.fetch")
+
+
+def scan(n, mb):
+    return random.Random(n).randbytes(mb * 1024 * 1024)
+
+
+def serve(port, users, mb):
+    from fakes import FakeTelegram, start_server
+    logging.disable(logging.WARNING)
+    telegram = FakeTelegram()
+    for n in range(users):
+        telegram.add_file(f"scan-{n}", scan(n, mb))
+
+    async def run():
+        await start_server(telegram.app(), port)
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+def wait_port(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), 1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(port)
+
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+async def run_mode(mode, args):
+    from telegram.ext import ExtBot
+    from telegram.request import HTTPXRequest
+
+    import downloads
+
+    bot = ExtBot("123:bench",
+                 base_url=f"http://127.0.0.1:{args.port}/bot",
+                 base_file_url=f"http://127.0.0.1:{args.port}/file/bot",
+                 request=HTTPXRequest(connection_pool_size=256))
+
+    async def old(file_id):
+        file = await bot.get_file(file_id)
+        out = io.BytesIO()
+        await file.download_to_memory(out)
+        data = out.getvalue()
+        return hashlib.sha256(data).hexdigest(), (data, pickle.dumps(data))
+
+    async def new(file_id):
+        spool = await downloads.fetch(bot, file_id)
+        return spool.sha256, (spool, pickle.dumps(spool.source()))
+
+    fetch = old if mode == MODES[0] else new
+    async with bot:
+        base = rss_mb()
+        start = time.perf_counter()
+        results = await asyncio.gather(*(fetch(f"scan-{n}")
+                                         for n in range(args.users)))
+        took = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    for _, (held, _) in results:
+        if hasattr(held, "close"):
+            held.close()
+    return {
+        "seconds": took,
+        "peak_mb": peak - base,
+        "hashes": [h for h, _ in results]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=16)
+    parser.add_argument("--mb", type=int, default=20)
+    parser.add_argument("--port", type=int, default=8760)
+    parser.add_argument("--budget-mb", type=float, default=64,
+                        help="max. RSS-Zuwachs mit downloads.fetch")
+    parser.add_argument("--run", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    if args.run:
+        print(json.dumps(asyncio.run(run_mode(args.run, args))))
+        return
+
+    os.environ["DOWNLOAD_MAX_BYTES"] = str((args.mb + 1) * 1024 * 1024)
+    server = multiprocessing.get_context("spawn").Process(
+        target=serve, args=(args.port, args.users, args.mb), daemon=True)
+    server.start()
+    failed = False
+    try:
+        wait_port(args.port)
+        expected = [
+            hashlib.sha256(scan(n, args.mb)).hexdigest()
+            for n in range(args.users)
+        ]
+        for mode in MODES:
+            out = subprocess.run([
+                sys.executable, __file__, "--run", mode, "--users",
+                str(args.users), "--mb",
+                str(args.mb), "--port",
+                str(args.port)
+            ],
+                                 capture_output=True,
+                                 text=True,
+                                 check=True).stdout
+            r = json.loads(out.splitlines()[-1])
+            ok = r["hashes"] == expected
+            print(f"{mode:20} {args.users} × {args.mb} MB in "
+                  f"{r['seconds']:6.2f}s   RSS +{r['peak_mb']:7.1f} MB   "
+                  f"{'ok' if ok else 'SHA-256 FALSCH'}")
+            failed |= not ok
+            if mode == "downloads.fetch" and r["peak_mb"] > args.budget_mb:
+                print(f"FEHLER: mehr als {args.budget_mb:.0f} MB")
+                failed = True
+    finally:
+        server.terminate()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Benchmark der Bildvorverarbeitung vor dem Claude-Aufruf.
+
+Vergleicht für jede Datei des Korpus gesendete Bytes, Pixel (≈ Bild-Tokens)
+und Vorverarbeitungszeit. Mit ANTHROPIC_API_KEY wird zusätzlich die
+End-to-End-Latenz der Extraktion mit Original und vorverarbeitetem Bild
+gemessen.
+
+    python bench/bench_imageprep.py [BILD ...] [--runs 3]
+"""
+import os
+import io
+import sys
+import time
+import base64
+import asyncio
+import argparse
+import statistics
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, os.path.join(ROOT, "src", "bot"))
+
+from PIL import Image  # noqa: E402
+
+import imageprep  # noqa: E402
+
+DEFAULT_CORPUS = [
+    os.path.join(ROOT, "photo_2026-01-30_19-53-41.jpg"),
+    os.path.join(ROOT, "rechnung-schreiben-beispiel-muster.webp")
+]
+
+
+def pixels(data):
+    w, h = Image.open(io.BytesIO(data)).size
+    return w * h
+
+
+def media_type(data):
+    return Image.MIME[Image.open(io.BytesIO(data)).format]
+
+
+async def extraction_latency(data, mime, runs):
+    import ocr
+    content = [{
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": mime,
+            "data": base64.b64encode(data).decode()
+        }
+    }, {
+        "type": "text",
+        "text": ocr.SENDER_PROMPT
+    }]
+    durations = []
+    for i in range(runs):
+        start = time.perf_counter()
+        # Eigener Schlüssel pro Lauf, damit nichts zusammengelegt wird
+        await ocr.extract_sender(content, f"bench-{time.time_ns()}-{i}")
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+async def run(args, online):
+    print(f"{'Datei':<42} {'Bytes vorher':>12} {'nachher':>9} "
+          f"{'Pixel vorher':>13} {'nachher':>9} {'Prep':>8}" +
+          (f" {'E2E vorher':>11} {'nachher':>9}" if online else ""))
+    for path in args.files:
+        data = open(path, "rb").read()
+        times = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            out, mime = imageprep.preprocess(data)
+            times.append(time.perf_counter() - start)
+        line = (f"{os.path.basename(path)[:42]:<42} {len(data):>12} "
+                f"{len(out):>9} {pixels(data):>13} {pixels(out):>9} "
+                f"{statistics.median(times) * 1000:>6.1f}ms")
+        if online:
+            before = await extraction_latency(data, media_type(data),
+                                              args.runs)
+            after = await extraction_latency(out, mime, args.runs)
+            line += f" {before:>10.2f}s {after:>8.2f}s"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs="*", default=DEFAULT_CORPUS)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+    online = bool(os.getenv("ANTHROPIC_API_KEY"))
+
+    asyncio.run(run(args, online))
+    if not online:
+        print("(ANTHROPIC_API_KEY nicht gesetzt – keine End-to-End-Messung)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Benchmark für mailer.py gegen einen lokalen SMTP-Server (aiosmtpd).
+
+Verschickt --count Rechnungs-E-Mails mit PDF-Anhang an Empfänger auf
+--domains Domains, einmal mit neuer Verbindung pro Nachricht
+(aiosmtplib.send, gleiche Parallelität) und einmal über den Mailer mit
+SMTP_POOL_SIZE dauerhaften Verbindungen. Mit --fail lehnt der Server
+einen Anteil der Nachrichten vorübergehend ab (451), der Mailer muss sie
+wiederholen. --handshake verzögert EHLO und steht für die Roundtrips von
+STARTTLS und Login bei einem echten Server. Am Ende muss jede Nachricht
+genau einmal angekommen sein.
+
+    python bench/bench_mail.py --count 1000 --pool 4 --fail 0.05
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "bot"))
+
+import aiosmtplib  # noqa: E402
+from aiosmtpd.controller import Controller  # noqa: E402
+
+import mailer  # noqa: E402
+
+PROFILE = {"company_name": "Muster GmbH", "email": "info@muster.de"}
+
+
+class Handler:
+    """Zählt angenommene Nachrichten; lehnt auf Wunsch vorübergehend ab"""
+
+    def __init__(self, fail, delay, handshake):
+        self.fail = fail
+        self.delay = delay
+        self.handshake = handshake
+        self.received = []
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    async def handle_EHLO(self, server, session, envelope, hostname,
+                          responses):
+        if self.handshake:
+            await asyncio.sleep(self.handshake)
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if random.random() < self.fail:
+            with self._lock:
+                self.rejected += 1
+            return "451 4.3.0 Bitte später erneut versuchen"
+        subject = envelope.content.split(b"Subject: ", 1)[1].split(b"\r\n")[0]
+        with self._lock:
+            self.received.append(subject)
+        return "250 OK"
+
+
+def make_messages(count, domains, pdf):
+    messages = []
+    for i in range(count):
+        inv = {
+            "invoice_number": f"RE-2026-{i + 1:05d}",
+            "client_email": f"kunde{i}@firma{i % domains}.de",
+            "date": "2026-10-01"
+        }
+        messages.append(
+            mailer.invoice_message(PROFILE, inv, pdf,
+                                   f"Rechnung_{inv['invoice_number']}.pdf",
+                                   "1.190,00 €"))
+    return messages
+
+
+async def per_message(messages, port, concurrency):
+    """Vergleich: neue Verbindung für jede Nachricht"""
+    queue = iter(messages)
+    failed = 0
+
+    async def worker():
+        nonlocal failed
+        for msg in queue:
+            try:
+                await aiosmtplib.send(msg, hostname="127.0.0.1", port=port)
+            except aiosmtplib.SMTPException:
+                failed += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return failed
+
+
+async def pooled(messages, port, args):
+    m = mailer.Mailer("127.0.0.1", port,
+                      pool_size=args.pool,
+                      domain_rate=args.domain_rate,
+                      domain_burst=args.domain_burst,
+                      retries=args.retries,
+                      backoff_base=0.01,
+                      backoff_cap=0.2)
+    await m.start()
+    results = await asyncio.gather(*(m.submit(msg) for msg in messages))
+    await m.stop()
+    return results.count(False), m.connections
+
+
+def run_mode(name, fn, handler, count):
+    handler.received.clear()
+    handler.rejected = 0
+    start = time.perf_counter()
+    failed, connections = fn()
+    took = time.perf_counter() - start
+    duplicates = len(handler.received) - len(set(handler.received))
+    print(f"{name:18} {count:6} in {took:6.2f}s = {count / took:7.1f}/s   "
+          f"Verbindungen {connections:5}   abgelehnt (451) "
+          f"{handler.rejected:4}   fehlgeschlagen {failed:4}   "
+          f"doppelt {duplicates}")
+    return failed, duplicates
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--domains", type=int, default=20)
+    parser.add_argument("--pool", type=int, default=4)
+    parser.add_argument("--fail", type=float, default=0.0,
+                        help="Anteil vorübergehend abgelehnter Nachrichten")
+    parser.add_argument("--delay", type=float, default=0.0,
+                        help="Verarbeitungszeit des Servers pro Nachricht")
+    parser.add_argument("--handshake", type=float, default=0.05,
+                        help="Dauer des Verbindungsaufbaus (s)")
+    parser.add_argument("--domain-rate", type=float, default=1e6,
+                        help="Nachrichten pro Minute und Domain")
+    parser.add_argument("--domain-burst", type=int, default=1000)
+    parser.add_argument("--retries", type=int, default=10)
+    parser.add_argument("--pdf-kb", type=int, default=40)
+    parser.add_argument("--port", type=int, default=8825)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    os.environ.setdefault("SMTP_EMAIL", "rechnung@muster.de")
+
+    handler = Handler(args.fail, args.delay, args.handshake)
+    controller = Controller(handler, hostname="127.0.0.1", port=args.port)
+    controller.start()
+    try:
+        pdf = os.urandom(args.pdf_kb * 1024)
+        messages = make_messages(args.count, args.domains, pdf)
+        if not args.fail:
+            run_mode(
+                "neu je Nachricht", lambda: (asyncio.run(
+                    per_message(messages, args.port, args.pool)),
+                                             args.count), handler,
+                args.count)
+        failed, duplicates = run_mode(
+            f"Pool ({args.pool})",
+            lambda: asyncio.run(pooled(messages, args.port, args)), handler,
+            args.count)
+        delivered = len(set(handler.received))
+        if failed or duplicates or delivered != args.count:
+            print(f"FEHLER: {delivered}/{args.count} zugestellt")
+            sys.exit(1)
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Belastungstest für die Rechnungsnummern (numbering.py, sql/003).
+
+Viele Rechnungen weniger Nutzer werden gleichzeitig angelegt, ein Teil
+davon doppelt (erneut gesendetes Formular). FakePostgREST hält die
+Zählerzeile wie Postgres für die Dauer des Aufrufs gesperrt und verliert
+auf Wunsch einen Teil der Antworten nach dem Commit. Abgelehnte Anfragen
+werden wie vom Nutzer erneut gesendet. Danach muss je Nutzer gelten:
+Nummern 1..n ohne Lücke und ohne Doppelte, gleiche Rechnung = gleiche
+Nummer. Verglichen wird mit einem Aufruf pro Rechnung ohne Bündelung.
+
+    python bench/bench_numbering.py --invoices 500 --users 5 --lost 0.05
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "bot"))
+
+from fakes import FakePostgREST, start_server, stop_server  # noqa: E402
+
+
+async def create_all(assign, jobs, resend):
+    """Vergibt Nummern für alle (nutzer, schlüssel); liefert Ergebnisse"""
+    results = defaultdict(list)
+
+    async def create(user_id, key):
+        for _ in range(resend):
+            try:
+                results[(user_id, key)].append(await assign(
+                    user_id, 2026, key))
+                return
+            except Exception:
+                await asyncio.sleep(0.01)
+        raise RuntimeError(f"{key}: keine Nummer nach {resend} Versuchen")
+
+    await asyncio.gather(*(create(u, k) for u, k in jobs))
+    return results
+
+
+def check(results):
+    """Prüft Lückenlosigkeit und Eindeutigkeit je Nutzer"""
+    by_user = defaultdict(dict)
+    for (user_id, key), numbers in results.items():
+        if len(set(numbers)) != 1:
+            raise AssertionError(f"{key}: unterschiedliche Nummern {numbers}")
+        by_user[user_id][key] = numbers[0]
+    for user_id, numbers in by_user.items():
+        seqs = sorted(numbers.values())
+        if seqs != list(range(1, len(seqs) + 1)):
+            raise AssertionError(f"Nutzer {user_id}: Lücke oder Doppelte")
+    return {u: len(n) for u, n in by_user.items()}
+
+
+async def run(args):
+    rnd = random.Random(args.seed)
+    users = [700000 + i for i in range(args.users)]
+    jobs = []
+    for i in range(args.invoices):
+        user_id = rnd.choice(users)
+        jobs.append((user_id, f"{user_id}-{i}"))
+        if rnd.random() < args.duplicates:
+            jobs.append((user_id, f"{user_id}-{i}"))
+    rnd.shuffle(jobs)
+
+    for mode in ("einzeln", "gebündelt"):
+        postgrest = FakePostgREST(latency=args.db_latency,
+                                  lost_responses=args.lost)
+        server = await start_server(postgrest.app(), args.port)
+        os.environ.update(SUPABASE_URL=f"http://127.0.0.1:{args.port}",
+                          SUPABASE_KEY="bench",
+                          DB_POOL_SIZE="100",
+                          DB_BACKOFF_BASE="0.01",
+                          DB_DEADLINE="120",
+                          RETRY_BUDGET_RATIO="1",
+                          BREAKER_FAILURES="1000000")
+        import db
+        import numbering
+        import resilience
+        resilience._breakers.clear()
+        resilience._budget = None
+        if mode == "einzeln":
+
+            async def assign(user_id, year, key):
+                numbers = await db.assign_invoice_numbers(user_id, year, [key])
+                return numbers[key]
+        else:
+            assign = numbering.NumberAllocator().assign
+        start = time.perf_counter()
+        results = await create_all(assign, jobs, args.resend)
+        took = time.perf_counter() - start
+        counts = check(results)
+        calls = postgrest.calls["rpc assign_invoice_numbers"]
+        print(f"{mode:10} {len(jobs):6} Anfragen in {took:6.2f}s = "
+              f"{len(jobs) / took:8.1f}/s   {calls:6} DB-Aufrufe   "
+              f"Nummern je Nutzer: {min(counts.values())}-"
+              f"{max(counts.values())}, lückenlos")
+        await db.close()
+        await stop_server(*server)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--invoices", type=int, default=500)
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--duplicates", type=float, default=0.1,
+                        help="Anteil doppelt gesendeter Rechnungen")
+    parser.add_argument("--lost", type=float, default=0.05,
+                        help="Anteil verlorener DB-Antworten")
+    parser.add_argument("--resend", type=int, default=20)
+    parser.add_argument("--db-latency", type=float, default=0.005,
+                        help="Sperrdauer der Zählerzeile pro Aufruf (s)")
+    parser.add_argument("--port", type=int, default=8795)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    # Wiederholungen nach verlorenen Antworten sind hier gewollt
+    logging.disable(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Benchmark für invoice_pdf.render_invoice.
+
+Misst Rechnungen/Sekunde und p50/p95 der Renderzeit, einmal seriell in
+einem Prozess und einmal über den Prozess-Pool aus workers.py.
+
+    python bench/bench_pdf.py --count 500 --items 40
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "bot"))
+
+import invoice_pdf  # noqa: E402
+
+PROFILE = {
+    "company_name": "Muster Handwerk GmbH",
+    "street": "Hauptstraße 12",
+    "zip": "10115",
+    "city": "Berlin",
+    "email": "info@muster-handwerk.de",
+    "phone": "+49 30 1234567",
+    "tax_id": "DE123456789",
+    "iban": "DE89370400440532013000"
+}
+
+
+def make_invoice(n, items):
+    inv = {
+        "client_name": f"Kunde {n} AG",
+        "client_address": "Beispielweg 5\n20095 Hamburg",
+        "date": "2026-10-01",
+        "payment_terms": 14,
+        "notes": "Vielen Dank für Ihren Auftrag!"
+    }
+    if items <= 1:
+        inv.update(description="Beratung", amount=850, vat_rate=19)
+    else:
+        inv["items"] = [{
+            "description": f"Position {i}: Montage und Material laut Angebot",
+            "quantity": i % 4 + 1,
+            "unit_price": "49.90",
+            "vat_rate": 19 if i % 3 else 7
+        } for i in range(items)]
+    return inv
+
+
+def timed_render(args):
+    profile, inv = args
+    t = time.perf_counter()
+    invoice_pdf.render_invoice(profile, inv)
+    return time.perf_counter() - t
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def report(name, durations, wall):
+    print(f"{name:<22} {len(durations) / wall:8.1f} Rechnungen/s   "
+          f"p50 {statistics.median(durations) * 1000:6.2f} ms   "
+          f"p95 {percentile(durations, 95) * 1000:6.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=300)
+    parser.add_argument("--items", type=int, default=40)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    jobs = [(PROFILE, make_invoice(i, args.items)) for i in range(args.count)]
+
+    invoice_pdf._static_layer.cache_clear()
+    start = time.perf_counter()
+    cold = [timed_render(jobs[0])]
+    report("seriell (kalt)", cold, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    durations = [timed_render(job) for job in jobs]
+    report("seriell (warm)", durations, time.perf_counter() - start)
+
+    with ProcessPoolExecutor(args.workers) as pool:
+        list(pool.map(timed_render, jobs[:args.workers]))  # Aufwärmen
+        start = time.perf_counter()
+        durations = list(pool.map(timed_render, jobs, chunksize=4))
+        report(f"Pool ({args.workers} Prozesse)", durations,
+               time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""Wiederkehrende Rechnungen am Monatsersten (recurring.py, sql/004).
+
+--templates Vorlagen von --users Nutzern sind gleichzeitig fällig.
+Verglichen wird ein Timer je Vorlage (jede Vorlage einzeln: Nummer,
+Insert, Profil, PDF im Prozess-Pool, Versand, neuer Termin; die Vorlagen
+liegen dafür schon im Speicher) mit recurring.run_due (blockweise Abfrage
+der fälligen Vorlagen, Bulk-Insert, Rendern in Blöcken, ein Aufruf für die
+neuen Termine je Block). FakePostgREST und FakeTelegram laufen im selben
+Prozess; der Bot schickt ohne SendLimiter, gemessen wird also nicht das
+Telegram-Limit (bei 25 Nachrichten/s allein gut 33 Minuten für 50.000
+Dokumente), sondern alles davor.
+
+Danach muss gelten: je Vorlage genau eine Rechnung und ein Dokument,
+Nummern je Nutzer lückenlos, jede Vorlage auf den nächsten Monat
+weitergeschaltet, ein zweiter Durchlauf erzeugt nichts. Sonst, oder wenn
+die Hochrechnung auf 50.000 Vorlagen über --budget-min liegt, endet das
+Skript mit Code 1. Fehler des Vergleichswegs (ab einigen tausend Timern
+laufen die Anfragen in die Frist des Verbindungspools) werden nur
+angezeigt.
+
+    python bench/bench_recurring.py --templates 2000 --users 1600
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+import datetime
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "bot"))
+
+from fakes import FakePostgREST, FakeTelegram, start_server, stop_server  # noqa: E402
+from harness import profile_payload  # noqa: E402
+
+TARGET = 50000
+MODES = ("Timer je Vorlage", "recurring.run_due")
+
+
+def seed(postgrest, args, now):
+    rnd = random.Random(args.seed)
+    users = [800000 + i for i in range(args.users)]
+    for user_id in users:
+        postgrest.profiles[user_id] = {
+            "id": user_id,
+            **{
+                k: v
+                for k, v in profile_payload(user_id).items() if k != "type"
+            }, "zip": "10115"
+        }
+    due = now - datetime.timedelta(minutes=1)
+    for i in range(args.templates):
+        user_id = users[i] if i < len(users) else rnd.choice(users)
+        postgrest._upsert("recurring_invoices", {
+            "user_id": user_id,
+            "invoice_data": {
+                "client_name": f"Kunde {i}",
+                "client_address": "Musterstraße 1\n10115 Berlin",
+                "client_email": None,
+                "description": "Monatliche Betreuung (Retainer)",
+                "amount": 1000 + i % 500,
+                "vat_rate": 19,
+                "payment_terms": 14
+            },
+            "schedule": "monthly",
+            "cron": None,
+            "anchor_day": 1,
+            "next_run_at": due.isoformat(),
+            "idempotency_key": f"template-{i}"
+        })
+
+
+async def per_template(bot, template):
+    """Wie ein eigener Timer je Vorlage: alles einzeln"""
+    import db
+    import numbering
+    import recurring
+    import totals
+    import workers
+    from invoice_pdf import render_invoice
+    from invoice_writer import idempotency_key, invoice_row
+    from telegram import InputFile
+
+    run_at = datetime.datetime.fromisoformat(template["next_run_at"])
+    inv = {**template["invoice_data"], "date": run_at.date().isoformat()}
+    result = totals.compute_invoice(inv)
+    key = idempotency_key(template["user_id"], {
+        "recurring_id": template["id"],
+        "run_at": run_at.isoformat()
+    })
+    inv["invoice_number"] = await numbering.get_allocator().number_for(
+        template["user_id"], inv, key)
+    await db.upsert_invoices([{
+        **invoice_row(template["user_id"], inv, result, key), "recurring_id":
+        template["id"]
+    }])
+    profile = await db.get_profile(template["user_id"])
+    pdf = await workers.run_in_process(render_invoice, profile, inv)
+    await bot.send_document(chat_id=template["user_id"],
+                            document=InputFile(
+                                pdf,
+                                filename=f"Rechnung_{inv['invoice_number']}.pdf"))
+    await db.advance_recurring([{
+        "id": template["id"],
+        "next_run_at": recurring.next_run("monthly", run_at,
+                                          anchor_day=1).isoformat(),
+        "last_run_at": run_at.isoformat(),
+        "active": True
+    }])
+
+
+def check(postgrest, telegram, args, now):
+    """Prüft das Ergebnis; liefert eine Liste von Fehlern"""
+    errors = []
+    by_template = defaultdict(int)
+    by_user = defaultdict(list)
+    for row in postgrest.invoices:
+        by_template[row["recurring_id"]] += 1
+        by_user[row["user_id"]].append(int(row["invoice_number"][-5:]))
+    if len(by_template) != args.templates or set(by_template.values()) != {1}:
+        errors.append(f"{len(postgrest.invoices)} Rechnungen für "
+                      f"{len(by_template)}/{args.templates} Vorlagen")
+    for user_id, seqs in by_user.items():
+        if sorted(seqs) != list(range(1, len(seqs) + 1)):
+            errors.append(f"Nutzer {user_id}: Lücke oder Doppelte")
+            break
+    if telegram.calls["sendDocument"] != args.templates:
+        errors.append(f"{telegram.calls['sendDocument']} Dokumente")
+    late = [
+        r for r in postgrest.recurring.values()
+        if datetime.datetime.fromisoformat(r["next_run_at"]) <= now
+        or r["locked_until"] is not None
+    ]
+    if late:
+        errors.append(f"{len(late)} Vorlagen nicht weitergeschaltet")
+    return errors
+
+
+async def run_mode(mode, args, port):
+    from telegram.ext import ExtBot
+    from telegram.request import HTTPXRequest
+
+    import cache
+    import db
+    import numbering
+    import recurring
+    import resilience
+    import workers
+
+    telegram = FakeTelegram(latency=args.telegram_latency)
+    postgrest = FakePostgREST(latency=args.db_latency)
+    servers = [
+        await start_server(telegram.app(), port),
+        await start_server(postgrest.app(), port + 1)
+    ]
+    os.environ["SUPABASE_URL"] = f"http://127.0.0.1:{port + 1}"
+    resilience._breakers.clear()
+    resilience._budget = None
+    cache._profile_cache = None
+    numbering._allocator = None
+    now = datetime.datetime.now(datetime.timezone.utc)
+    seed(postgrest, args, now)
+    bot = ExtBot("123:bench",
+                 base_url=f"http://127.0.0.1:{port}/bot",
+                 request=HTTPXRequest(connection_pool_size=64))
+    await workers.warm_up(("reportlab.pdfgen.canvas", ))
+    try:
+        async with bot:
+            start = time.perf_counter()
+            if mode == MODES[0]:
+                templates = list(postgrest.recurring.values())
+                results = await asyncio.gather(*(per_template(bot, t)
+                                                 for t in templates),
+                                               return_exceptions=True)
+                count = sum(r is None for r in results)
+            else:
+                count = await recurring.run_due(bot)
+            took = time.perf_counter() - start
+            again = 0 if mode == MODES[0] else await recurring.run_due(bot)
+        errors = check(postgrest, telegram, args, now)
+        if count < args.templates:
+            errors.insert(0, f"{args.templates - count} fehlgeschlagen")
+        if again:
+            errors.append(f"zweiter Durchlauf: {again} Rechnungen")
+        db_calls = sum(postgrest.calls.values())
+    finally:
+        await db.close()
+        for server in reversed(servers):
+            await stop_server(*server)
+    return count, took, db_calls, errors
+
+
+async def run(args):
+    import workers
+
+    failed = False
+    for n, mode in enumerate(MODES):
+        count, took, db_calls, errors = await run_mode(mode, args,
+                                                       args.port + 2 * n)
+        projected = TARGET / (max(count, 1) / took) / 60
+        print(f"{mode:18} {count:6} Rechnungen in {took:7.2f}s = "
+              f"{count / took:7.1f}/s   {db_calls / max(count, 1):5.2f} "
+              f"DB-Aufrufe/Rechnung   50.000: {projected:6.1f} min   "
+              f"{'; '.join(errors) or 'ok'}")
+        if mode != MODES[1]:
+            continue
+        failed |= bool(errors)
+        if projected > args.budget_min:
+            print(f"FEHLER: mehr als {args.budget_min:.0f} min für "
+                  f"{TARGET} Vorlagen")
+            failed = True
+    workers.shutdown()
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--templates", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=1600)
+    parser.add_argument("--db-latency", type=float, default=0.005)
+    parser.add_argument("--telegram-latency", type=float, default=0.02)
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Worker-Prozesse (0 = Anzahl CPUs)")
+    parser.add_argument("--budget-min", type=float, default=15,
+                        help="max. Minuten für 50.000 Vorlagen (run_due)")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    os.environ.update(SUPABASE_KEY="bench",
+                      REDIS_URL="",
+                      MAIL_ENABLED="0",
+                      DB_POOL_SIZE="20",
+                      DB_DEADLINE="120",
+                      RETRY_BUDGET_RATIO="1",
+                      BREAKER_FAILURES="1000000",
+                      WORKER_PROCESSES=str(args.workers))
+    logging.disable(logging.WARNING)
+    sys.exit(1 if asyncio.run(run(args)) else 0)
+
+
+if __name__ == "__main__":
+    main()
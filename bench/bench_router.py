@@ -0,0 +1,110 @@
+"""Routing von Textnachrichten: Regex-Kette gegen router.ButtonHandler.
+
+Baut das Hauptmenü einmal wie früher (ein MessageHandler mit
+filters.Regex je Taste, der Reihe nach geprüft) und einmal als
+ButtonHandler, jeweils mit --extra zusätzlichen Menüpunkten, und misst die
+Zeit pro Nachricht bis zum passenden Handler (oder keinem) für eine
+Mischung aus Tastendrücken und freiem Text. Anschließend wird geprüft, ob
+freier Text mit einem Tastentext darin (z.B. ein Kundenname) fälschlich
+geroutet wird; tut der ButtonHandler das, endet das Skript mit Code 1.
+
+    python bench/bench_router.py --messages 100000 --extra 40
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "bot"))
+
+from telegram import Chat, Message, Update, User  # noqa: E402
+from telegram.ext import MessageHandler, filters  # noqa: E402
+
+import router  # noqa: E402
+
+LABELS = [
+    "📝 Rechnung erstellen", "⚙️ Einstellungen", "📋 Meine Rechnungen",
+    "📧 Entwickler kontaktieren", "🔙 Zurück"
+]
+FREE_TEXT = [
+    "Kunde: Rechnung erstellen GmbH", "Meine Rechnungen für März bitte",
+    "Hallo, wie geht das?", "Musterstraße 12, 10115 Berlin"
+]
+
+
+async def noop(update, context):
+    return None
+
+
+def update(text, n):
+    user = User(n, "Bench", False)
+    return Update(n,
+                  message=Message(n,
+                                  datetime.datetime.now(),
+                                  Chat(n, "private"),
+                                  from_user=user,
+                                  text=text))
+
+
+def regex_chain(labels):
+    """Wie bisher: unverankerte Regex je Taste, ohne Emoji"""
+    return [
+        MessageHandler(filters.Regex(label.split(" ", 1)[1]), noop)
+        for label in labels
+    ]
+
+
+def route_chain(handlers, upd):
+    for handler in handlers:
+        if handler.check_update(upd):
+            return handler
+    return None
+
+
+def measure(name, handlers, updates):
+    start = time.perf_counter()
+    for upd in updates:
+        route_chain(handlers, upd)
+    took = time.perf_counter() - start
+    print(f"{name:22} {len(handlers):3} Handler   "
+          f"{took / len(updates) * 1e6:7.2f} µs/Nachricht")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--extra", type=int, default=40,
+                        help="zusätzliche Menüpunkte")
+    parser.add_argument("--free", type=float, default=0.2,
+                        help="Anteil freier Text")
+    args = parser.parse_args()
+
+    labels = LABELS + [f"🔹 Menüpunkt {i}" for i in range(args.extra)]
+    random.seed(1)
+    texts = [
+        random.choice(FREE_TEXT)
+        if random.random() < args.free else random.choice(labels)
+        for _ in range(args.messages)
+    ]
+    updates = [update(t, i + 1) for i, t in enumerate(texts)]
+
+    chain = regex_chain(labels)
+    button = router.ButtonHandler({label: noop for label in labels},
+                                  fallbacks=[(r"(haupt)?men[üu]|start", noop)])
+    measure("Regex-Kette", chain, updates)
+    measure("ButtonHandler", [button], updates)
+
+    misrouted = 0
+    for text in FREE_TEXT:
+        old = route_chain(chain, update(text, 1)) is not None
+        new = button.check_update(update(text, 1)) is not None
+        misrouted += new
+        print(f"  {text!r:36} Regex-Kette: {'geroutet' if old else '-':9} "
+              f"ButtonHandler: {'geroutet' if new else '-'}")
+    sys.exit(1 if misrouted else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Durchsatztest für send_limiter.py gegen die Fake-Bot-API mit 429.
+
+FakeTelegram lehnt wie Telegram mit 429 (retry_after) ab, sobald ein Chat
+mehr als --chat-limit oder der Bot mehr als --global-limit Nachrichten pro
+Sekunde schickt. Gleichzeitig laufen:
+
+    interaktiv  – Antworten an --users Nutzer (je 3 kurz hintereinander)
+    rundruf     – eine Benachrichtigung an --broadcast Chats (BULK)
+    fortschritt – --progress Nachrichten mit je --edits schnellen
+                  editMessageText (BULK)
+
+Einmal ohne Limiter (PTB reicht RetryAfter an den Aufrufer durch), mit
+SendLimiter, aber alles im interaktiven Kanal, und mit SendLimiter samt
+Prioritäten. Ausgegeben werden 429-Antworten, fehlgeschlagene Aufrufe,
+p95 der interaktiven Antworten und wie viele Bearbeitungen beim Server
+ankamen.
+
+    python bench/bench_send.py --users 30 --broadcast 150
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "bot"))
+
+from telegram.error import RetryAfter  # noqa: E402
+from telegram.ext import ExtBot  # noqa: E402
+from telegram.request import HTTPXRequest  # noqa: E402
+
+import send_limiter  # noqa: E402
+from fakes import FakeTelegram, start_server, stop_server  # noqa: E402
+from harness import percentile  # noqa: E402
+
+
+async def workload(bot, args, lane):
+    latencies = []
+    failed = 0
+
+    async def call(coro_fn, timed=False):
+        nonlocal failed
+        start = time.perf_counter()
+        try:
+            result = await coro_fn()
+        except RetryAfter:
+            failed += 1
+            return None
+        if timed:
+            latencies.append(time.perf_counter() - start)
+        return result
+
+    async def interactive(chat_id):
+        for i in range(3):
+            await call(lambda: bot.send_message(chat_id, f"Antwort {i}"),
+                       timed=True)
+            await asyncio.sleep(0.05)
+
+    async def broadcast(chat_id):
+        await call(lambda: bot.send_message(
+            chat_id,
+            "Neue Funktion: Jahresexport",
+            rate_limit_args=lane(send_limiter.BULK)))
+
+    async def progress(chat_id):
+        msg = await call(lambda: bot.send_message(chat_id, "⏳ 0"))
+        message_id = msg.message_id if msg else 1
+        tasks = []
+        for i in range(1, args.edits + 1):
+            tasks.append(
+                asyncio.create_task(
+                    call(lambda i=i: bot.edit_message_text(
+                        f"⏳ {i}",
+                        chat_id=chat_id,
+                        message_id=message_id,
+                        rate_limit_args=lane(send_limiter.BULK)))))
+            await asyncio.sleep(0.01)
+        await asyncio.gather(*tasks)
+        return chat_id, message_id
+
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(broadcast(900000 + i) for i in range(args.broadcast)),
+        *(progress(800000 + i) for i in range(args.progress)),
+        *(interactive(700000 + i) for i in range(args.users)))
+    wall = time.perf_counter() - start
+    edited = [r for r in results if isinstance(r, tuple)]
+    return latencies, failed, wall, edited
+
+
+async def run_mode(name, limiter, args, lanes=True):
+    telegram = FakeTelegram(chat_limit=args.chat_limit,
+                            global_limit=args.global_limit,
+                            retry_after=args.retry_after)
+    server = await start_server(telegram.app(), args.port)
+    bot = ExtBot("123:bench",
+                 base_url=f"http://127.0.0.1:{args.port}/bot",
+                 request=HTTPXRequest(connection_pool_size=256),
+                 rate_limiter=limiter)
+
+    def lane(priority):
+        return send_limiter.lane(bot, priority) if lanes else None
+
+    async with bot:
+        latencies, failed, wall, edited = await workload(bot, args, lane)
+    final = sum(
+        telegram.texts.get((str(c), str(m))) == f"⏳ {args.edits}"
+        for c, m in edited)
+    print(f"{name:16} {wall:6.2f}s   429: {telegram.calls['429']:5}   "
+          f"fehlgeschlagen: {failed:5}   interaktiv p50 "
+          f"{statistics.median(latencies) * 1000:7.1f} ms  p95 "
+          f"{percentile(latencies, 95) * 1000:7.1f} ms   Bearbeitungen "
+          f"{telegram.calls['editMessageText']}/"
+          f"{args.progress * args.edits}, Endstand {final}/{args.progress}")
+    await stop_server(*server)
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=30)
+    parser.add_argument("--broadcast", type=int, default=150)
+    parser.add_argument("--progress", type=int, default=5)
+    parser.add_argument("--edits", type=int, default=40)
+    parser.add_argument("--chat-limit", type=int, default=3,
+                        help="Nachrichten pro Sekunde und Chat (Fake)")
+    parser.add_argument("--global-limit", type=int, default=30,
+                        help="Nachrichten pro Sekunde insgesamt (Fake)")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8796)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    def limiter():
+        # Rate + Kapazität je Sekunde unter den Limits des Fakes
+        return send_limiter.SendLimiter(global_rate=args.global_limit - 5,
+                                        global_burst=5,
+                                        chat_rate=1,
+                                        chat_burst=args.chat_limit - 1)
+
+    asyncio.run(run_mode("ohne Limiter", None, args))
+    failed = asyncio.run(
+        run_mode("ohne Prioritäten", limiter(), args, lanes=False))
+    failed += asyncio.run(run_mode("SendLimiter", limiter(), args))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""Kaltstart des Bots: Importzeit je Modul und Zeit bis zur ersten Antwort.
+
+1. `python -X importtime -c "import main"` (--runs Mal, Median): kumulierte
+   Importzeit von main und den Modulen aus dem Budget; außerdem dürfen die
+   Module unter "deferred" beim Import noch nicht geladen sein.
+2. src/bot/main.py startet als eigener Prozess im Polling-Betrieb gegen
+   FakeTelegram/FakePostgREST. Gemessen ab Prozessstart: erster getUpdates,
+   Antwort auf /start, Antwort mit Supabase-Zugriff ("Rechnung erstellen").
+   Nach --settle Sekunden folgt eine Rechnung; gemessen wird bis zum
+   PDF-Versand (Worker-Prozess, reportlab). Einmal mit WARM_UP=0 zum
+   Vergleich, einmal mit Vorwärmen.
+
+Überschreitet ein Wert bench/startup_budget.json, endet das Skript mit
+Code 1.
+
+    python bench/bench_startup.py --runs 5
+"""
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import subprocess
+import logging
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "bot"))
+
+from fakes import FakePostgREST, FakeTelegram, start_server, stop_server  # noqa: E402
+from harness import invoice_payload, message, profile_payload, web_app_data  # noqa: E402
+
+BOT_DIR = os.path.join(os.path.dirname(__file__), "..", "src", "bot")
+BUDGET = os.path.join(os.path.dirname(__file__), "startup_budget.json")
+USER_ID = 600001
+
+
+def import_times(runs):
+    """Median der kumulierten Importzeit (ms) je Modul und alle geladenen
+    Module aus `runs` Durchläufen von `import main`"""
+    samples = {}
+    loaded = set()
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                              "import main"],
+                             cwd=BOT_DIR,
+                             capture_output=True,
+                             text=True,
+                             check=True).stderr
+        seen = set()
+        for line in out.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative, name = line.split("|")
+            name = name.strip()
+            if not cumulative.strip().isdigit() or name in seen:
+                continue
+            seen.add(name)
+            samples.setdefault(name, []).append(int(cumulative) / 1000)
+        loaded |= seen
+    return {k: statistics.median(v) for k, v in samples.items()}, loaded
+
+
+def command(user_id, text):
+    return message(user_id,
+                   text=text,
+                   entities=[{
+                       "type": "bot_command",
+                       "offset": 0,
+                       "length": len(text)
+                   }])
+
+
+async def wait_line(lines, needle, timeout):
+    deadline = time.monotonic() + timeout
+    while not any(needle in line for line in lines):
+        if time.monotonic() > deadline:
+            raise TimeoutError(needle)
+        await asyncio.sleep(0.01)
+
+
+async def cold_start(args, warm):
+    telegram = FakeTelegram(latency=args.telegram_latency)
+    postgrest = FakePostgREST(latency=args.db_latency)
+    servers = [
+        await start_server(telegram.app(), args.port),
+        await start_server(postgrest.app(), args.port + 1)
+    ]
+    postgrest.profiles[USER_ID] = {
+        "id": USER_ID,
+        **{
+            k: v
+            for k, v in profile_payload(USER_ID).items() if k != "type"
+        }, "zip": "10115"
+    }
+    telegram.updates += [
+        command(USER_ID, "/start"),
+        message(USER_ID + 1, text="📝 Rechnung erstellen")
+    ]
+    postgrest.profiles[USER_ID + 1] = {
+        **postgrest.profiles[USER_ID], "id": USER_ID + 1
+    }
+    env = dict(
+        os.environ,
+        BOT_MODE="polling",
+        TELEGRAM_BOT_TOKEN="123:bench",
+        TELEGRAM_BASE_URL=f"http://127.0.0.1:{args.port}/bot",
+        TELEGRAM_BASE_FILE_URL=f"http://127.0.0.1:{args.port}/file/bot",
+        SUPABASE_URL=f"http://127.0.0.1:{args.port + 1}",
+        SUPABASE_KEY="bench",
+        ANTHROPIC_API_KEY="bench",
+        DATA_DIR=tempfile.mkdtemp(prefix="bench-"),
+        PERSISTENCE="none",
+        PREFILL_BASE_URL="",
+        REDIS_URL="",
+        METRICS_ENABLED="1",
+        HOST="127.0.0.1",
+        PORT=str(args.port + 2),
+        WORKER_PROCESSES=str(args.workers),
+        WARM_UP="1" if warm else "0")
+    start = time.perf_counter()
+    proc = await asyncio.create_subprocess_exec(sys.executable,
+                                                os.path.join(
+                                                    BOT_DIR, "main.py"),
+                                                env=env,
+                                                stdout=asyncio.subprocess.DEVNULL,
+                                                stderr=asyncio.subprocess.PIPE)
+    lines = []
+
+    async def read_stderr():
+        async for line in proc.stderr:
+            lines.append(line.decode(errors="replace"))
+
+    reader = asyncio.create_task(read_stderr())
+    result = {}
+    try:
+        await telegram.wait_for("getUpdates", 1, timeout=args.timeout)
+        result["ready_ms"] = (time.perf_counter() - start) * 1000
+        await telegram.wait_for("sendMessage", 1, timeout=args.timeout)
+        result["first_update_ms"] = (time.perf_counter() - start) * 1000
+        await telegram.wait_for("sendMessage", 2, timeout=args.timeout)
+        result["first_db_update_ms"] = (time.perf_counter() - start) * 1000
+        await asyncio.sleep(args.settle)
+        if warm:
+            await wait_line(lines, "Vorgewärmt", args.timeout)
+        sent = time.perf_counter()
+        telegram.updates.append(web_app_data(USER_ID, invoice_payload(1)))
+        await telegram.wait_for("sendDocument", 1, timeout=args.timeout)
+        result["first_pdf_ms"] = (time.perf_counter() - sent) * 1000
+    finally:
+        if proc.returncode is None:
+            proc.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(proc.wait(), 20)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+        await reader
+        for server in reversed(servers):
+            await stop_server(*server)
+    if not result.get("first_pdf_ms"):
+        sys.stderr.write("".join(lines[-30:]))
+    return result
+
+
+def check(name, value, limit, failures):
+    ok = limit is None or value <= limit
+    budget = f"(Budget {limit:.0f} ms)" if limit is not None else ""
+    print(f"  {name:28} {value:8.1f} ms {budget}{'' if ok else '  ZU LANGSAM'}")
+    if not ok:
+        failures.append(name)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8770)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--settle", type=float, default=3.0,
+                        help="Pause zwischen Start und erster Rechnung (s)")
+    parser.add_argument("--telegram-latency", type=float, default=0.02)
+    parser.add_argument("--db-latency", type=float, default=0.01)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--budget", default=BUDGET)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    with open(args.budget) as f:
+        budget = json.load(f)
+    failures = []
+
+    times, loaded = import_times(args.runs)
+    print(f"Import (Median aus {args.runs}, kumuliert):")
+    for name, limit in budget["import_ms"].items():
+        check(name, times.get(name, 0.0), limit, failures)
+    for name in budget["deferred"]:
+        early = sorted(m for m in loaded
+                       if m == name or m.startswith(name + "."))
+        if early:
+            print(f"  {name} schon beim Import geladen: {', '.join(early)}")
+            failures.append(name)
+
+    for warm in (False, True):
+        result = asyncio.run(cold_start(args, warm))
+        print(f"Kaltstart {'mit' if warm else 'ohne'} Vorwärmen:")
+        for name in ("ready_ms", "first_update_ms", "first_db_update_ms",
+                     "first_pdf_ms"):
+            check(name, result.get(name, float("inf")),
+                  budget["startup_ms"].get(name) if warm else None, failures)
+
+    if failures:
+        print(f"FEHLER: Budget überschritten: {', '.join(failures)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
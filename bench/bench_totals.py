@@ -0,0 +1,102 @@
+"""Benchmark für totals.py.
+
+Misst die Prüfung einer Rechnung (totals.verify) für verschiedene Anzahlen
+von Positionen: kalt (alle Caches geleert), mit warmem Zahlen-Cache (neue
+Rechnung aus bekannten Preisen) und als Treffer im Ergebnis-Cache. Zum
+Vergleich die frühere Berechnung mit Decimal.quantize pro Position.
+
+    python bench/bench_totals.py --items 1 10 100 500
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from decimal import Decimal, ROUND_HALF_UP
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "bot"))
+
+import totals  # noqa: E402
+
+CENT = Decimal("0.01")
+PRICES = [f"{p / 100:.2f}" for p in range(99, 250000, 1237)]
+
+
+def make_invoice(n_items, seed):
+    rnd = random.Random(seed)
+    items = [{
+        "description": f"Position {i}",
+        "quantity": rnd.choice(["1", "2", "0.5", "12", "3.25"]),
+        "unit_price": rnd.choice(PRICES),
+        "vat_rate": rnd.choice([19, 19, 7, 0])
+    } for i in range(n_items)]
+    inv = {"items": items}
+    result = totals.compute_invoice(inv)
+    inv["amount"] = float(totals.to_euro(result.net))
+    inv["total"] = float(totals.to_euro(result.gross))
+    return inv
+
+
+def decimal_reference(inv):
+    """Bisherige Berechnung aus invoice_pdf (Decimal je Position)"""
+    net_by_rate = {}
+    for it in inv["items"]:
+        rate = Decimal(str(it["vat_rate"]))
+        net = (Decimal(str(it["quantity"])) *
+               Decimal(str(it["unit_price"]))).quantize(CENT, ROUND_HALF_UP)
+        net_by_rate[rate] = net_by_rate.get(rate, Decimal(0)) + net
+    net = sum(net_by_rate.values(), Decimal(0))
+    vat = sum(((n * r / 100).quantize(CENT, ROUND_HALF_UP)
+               for r, n in net_by_rate.items()), Decimal(0))
+    return net, net + vat
+
+
+def clear_caches():
+    totals.compute.cache_clear()
+    totals._scaled.cache_clear()
+    totals._line_net.cache_clear()
+    totals._rate.cache_clear()
+
+
+def measure(fn, invoices, before=None):
+    times = []
+    for inv in invoices:
+        if before:
+            before()
+        start = time.perf_counter()
+        fn(inv)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2] * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, nargs="+",
+                        default=[1, 10, 100, 500])
+    parser.add_argument("--count", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'Positionen':>10} {'Decimal':>10} {'kalt':>10} "
+          f"{'Zahlen-Cache':>13} {'Treffer':>10}   (Median, µs)")
+    for n in args.items:
+        invoices = [make_invoice(n, seed) for seed in range(args.count)]
+        for inv in invoices:
+            net, gross = decimal_reference(inv)
+            result = totals.verify(inv)
+            assert totals.to_euro(result.net) == net
+            assert totals.to_euro(result.gross) == gross
+        reference = measure(decimal_reference, invoices)
+        cold = measure(totals.verify, invoices, clear_caches)
+        totals.compute.cache_clear()
+        warm_numbers = measure(totals.verify, invoices,
+                               totals.compute.cache_clear)
+        for inv in invoices:
+            totals.verify(inv)
+        hit = measure(totals.verify, invoices)
+        print(f"{n:>10} {reference:>10.1f} {cold:>10.1f} {warm_numbers:>13.1f} "
+              f"{hit:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+"""Lokale Ersatz-Server für Benchmarks (kein Zugriff auf echte Dienste).
+
+FakeTelegram beantwortet die Bot-API-Methoden, die der Bot benutzt, mit
+plausiblen Objekten und zählt die Aufrufe pro Methode. FakePostgREST hält
+Profile, Rechnungen, Rechnungsnummern und Vorlagen wiederkehrender
+Rechnungen im Speicher und versteht genau
+die Abfragen aus db.py, FakeAnthropic antwortet auf /v1/messages mit festen Absenderdaten.
+Alle drei haben eine einstellbare Latenz.
+"""
+import re
+import json
+import time
+import random
+import asyncio
+import datetime
+import itertools
+from collections import Counter
+from email.parser import BytesParser
+from urllib.parse import parse_qsl
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+
+async def start_server(app, port, host="127.0.0.1"):
+    """Startet eine ASGI-App im laufenden Event-Loop; gibt (server, task) zurück"""
+    server = uvicorn.Server(
+        uvicorn.Config(app, host=host, port=port, log_level="warning",
+                       lifespan="off"))
+    server.install_signal_handlers = lambda: None
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    return server, task
+
+
+async def stop_server(server, task):
+    server.should_exit = True
+    await task
+
+
+async def _params(request):
+    content_type = request.headers.get("content-type", "")
+    body = await request.body()
+    if content_type.startswith("application/json"):
+        return await request.json()
+    if content_type.startswith("multipart/form-data"):
+        msg = BytesParser().parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+        params = {}
+        for part in msg.get_payload():
+            name = part.get_param("name", header="content-disposition")
+            payload = part.get_payload(decode=True)
+            if part.get_filename():
+                params[name] = payload
+            else:
+                params[name] = payload.decode()
+        return params
+    return dict(parse_qsl(body.decode()))
+
+
+class FakeTelegram:
+    """Ersatz für die Telegram Bot API (https://api.telegram.org).
+
+    Mit chat_limit/global_limit antwortet der Fake wie Telegram mit 429
+    (retry_after), sobald ein Chat bzw. der Bot insgesamt mehr Nachrichten
+    pro Sekunde schickt."""
+
+    FLOOD_METHODS = ("sendMessage", "editMessageText", "sendDocument")
+
+    def __init__(self, latency=0.0, chat_limit=None, global_limit=None,
+                 retry_after=1):
+        self.latency = latency
+        self.chat_limit = chat_limit
+        self.global_limit = global_limit
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.files = {}
+        self.texts = {}
+        # Updates für getUpdates (Polling-Betrieb)
+        self.updates = []
+        self._ids = itertools.count(1)
+        self._waiters = []
+        self._sent = {}
+
+    def _flooded(self, method, params):
+        """True, wenn die Nachricht ein Limit pro Sekunde überschreitet"""
+        if method not in self.FLOOD_METHODS or not (self.chat_limit
+                                                    or self.global_limit):
+            return False
+        now = time.monotonic()
+        chat = params.get("chat_id")
+        for key, limit in ((chat, self.chat_limit), (None,
+                                                     self.global_limit)):
+            if limit:
+                window = self._sent.setdefault(key, [])
+                window[:] = [t for t in window if now - t < 1]
+                if len(window) >= limit:
+                    return True
+        for key in (chat, None):
+            self._sent.setdefault(key, []).append(now)
+        return False
+
+    def add_file(self, file_id, data):
+        self.files[file_id] = data
+
+    def _message(self, params):
+        chat_id = int(params.get("chat_id") or 0)
+        return {
+            "message_id": int(params.get("message_id") or next(self._ids)),
+            "date": int(time.time()),
+            "chat": {
+                "id": chat_id,
+                "type": "private"
+            },
+            "text": params.get("text", "")
+        }
+
+    def _pending(self, params):
+        offset = int(params.get("offset") or 0)
+        return [u for u in self.updates if u["update_id"] >= offset]
+
+    def _result(self, method, params):
+        if method == "getMe":
+            return {
+                "id": 1,
+                "is_bot": True,
+                "first_name": "Bench",
+                "username": "bench_bot"
+            }
+        if method in ("sendMessage", "editMessageText", "sendDocument"):
+            return self._message(params)
+        if method == "getUpdates":
+            return self._pending(params)
+        if method == "getFile":
+            file_id = params.get("file_id")
+            return {
+                "file_id": file_id,
+                "file_unique_id": f"u-{file_id}",
+                "file_size": len(self.files.get(file_id, b"")),
+                "file_path": file_id
+            }
+        return True
+
+    async def wait_for(self, method, count, timeout=60):
+        """Wartet, bis `method` mindestens `count`-mal aufgerufen wurde"""
+        deadline = time.monotonic() + timeout
+        while self.calls[method] < count:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{method}: {self.calls[method]}/{count}")
+            await asyncio.sleep(0.005)
+
+    async def api(self, request: Request):
+        method = request.path_params["method"]
+        params = await _params(request)
+        if method == "getUpdates" and not self._pending(params):
+            # Long Polling, verkürzt
+            await asyncio.sleep(0.05)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self._flooded(method, params):
+            self.calls["429"] += 1
+            return JSONResponse(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": "Too Many Requests: retry after "
+                    f"{self.retry_after}",
+                    "parameters": {
+                        "retry_after": self.retry_after
+                    }
+                },
+                status_code=429)
+        self.calls[method] += 1
+        if method == "editMessageText":
+            self.texts[(str(params.get("chat_id")),
+                        str(params.get("message_id")))] = params.get("text")
+        return JSONResponse({"ok": True, "result": self._result(method, params)})
+
+    async def file(self, request: Request):
+        data = self.files.get(request.path_params["path"])
+        if data is None:
+            return Response(status_code=404)
+        return Response(data)
+
+    def app(self):
+        return Starlette(routes=[
+            Route("/bot{token}/{method}", self.api, methods=["GET", "POST"]),
+            Route("/file/bot{token}/{path:path}", self.file, methods=["GET"])
+        ])
+
+
+_RANGE = re.compile(r"\(invoice_date\.gte\.([^,]+),invoice_date\.lt\.([^)]+)\)")
+_KEYSET = re.compile(r'\(invoice_date\.(lt|gt)\."([^"]+)",'
+                     r'and\(invoice_date\.eq\."[^"]+",id\.(?:lt|gt)\.(\d+)\)'
+                     r'(?:,invoice_date\.is\.null)?\)')
+
+
+class FakePostgREST:
+    """Ersatz für Supabase/PostgREST unter /rest/v1 (profiles, invoices,
+    recurring_invoices)"""
+
+    def __init__(self, latency=0.0, lost_responses=0.0):
+        self.latency = latency
+        # Anteil der RPC-Aufrufe, die ausgeführt werden, deren Antwort aber
+        # verloren geht (503) – wie ein Verbindungsabbruch nach dem Commit
+        self.lost_responses = lost_responses
+        self.calls = Counter()
+        self.profiles = {}
+        self.invoices = []
+        self.counters = {}
+        self.numbers = {}
+        self.recurring = {}
+        self._invoice_keys = set()
+        self._recurring_keys = set()
+        self._ids = itertools.count(1)
+        self._locks = {}
+
+    def _select(self, table, params):
+        if table == "profiles":
+            if "id" not in params:
+                # db.warm_up: limit=0
+                return []
+            if params["id"].startswith("in."):
+                ids = params["id"][4:-1].split(",")
+                return [self.profiles[int(i)] for i in ids
+                        if int(i) in self.profiles]
+            user_id = int(params["id"].removeprefix("eq."))
+            row = self.profiles.get(user_id)
+            return [row] if row else []
+        user_id = int(params["user_id"].removeprefix("eq."))
+        rows = [r for r in self.invoices if r["user_id"] == user_id]
+        match = _RANGE.fullmatch(params.get("and", ""))
+        if match:
+            rows = [r for r in rows
+                    if match.group(1) <= r["invoice_date"] < match.group(2)]
+        match = _KEYSET.fullmatch(params.get("or", ""))
+        if match:
+            op, date, inv_id = match.group(1), match.group(2), int(
+                match.group(3))
+            if op == "lt":
+                rows = [r for r in rows
+                        if (r["invoice_date"], r["id"]) < (date, inv_id)]
+            else:
+                rows = [r for r in rows
+                        if (r["invoice_date"], r["id"]) > (date, inv_id)]
+        descending = params.get("order", "").endswith("desc")
+        rows.sort(key=lambda r: (r["invoice_date"], r["id"]),
+                  reverse=descending)
+        return rows[:int(params.get("limit", len(rows)))]
+
+    def _upsert(self, table, body):
+        rows = body if isinstance(body, list) else [body]
+        stored = []
+        for row in rows:
+            if table == "profiles":
+                merged = {**self.profiles.get(row["id"], {}), **row}
+                self.profiles[row["id"]] = merged
+                stored.append(merged)
+            elif table == "recurring_invoices":
+                if row.get("idempotency_key") in self._recurring_keys:
+                    continue
+                self._recurring_keys.add(row.get("idempotency_key"))
+                row = {"active": True, "last_run_at": None,
+                       "locked_until": None, **row,
+                       "id": len(self.recurring) + 1}
+                self.recurring[row["id"]] = row
+                stored.append(row)
+            elif row.get("idempotency_key") not in self._invoice_keys:
+                self._invoice_keys.add(row.get("idempotency_key"))
+                row = {**row, "id": next(self._ids)}
+                self.invoices.append(row)
+                stored.append(row)
+        return stored
+
+    async def rest(self, request: Request):
+        table = request.path_params["table"]
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.calls[f"{request.method} {table}"] += 1
+        if request.method == "GET":
+            return JSONResponse(self._select(table,
+                                             dict(request.query_params)))
+        if request.method == "PATCH":
+            key = request.query_params["idempotency_key"].removeprefix("eq.")
+            changes = await request.json()
+            for row in self.invoices:
+                if row.get("idempotency_key") == key:
+                    row.update(changes)
+            return Response(status_code=204)
+        stored = self._upsert(table, await request.json())
+        if "return=representation" in request.headers.get("prefer", ""):
+            return JSONResponse(stored, status_code=201)
+        return Response(status_code=201)
+
+    def _assign_numbers(self, body):
+        """Wie assign_invoice_numbers in sql/003"""
+        slot = (body["p_user_id"], body["p_year"])
+        for key in body["p_keys"]:
+            if key not in self.numbers:
+                self.counters[slot] = self.counters.get(slot, 0) + 1
+                self.numbers[key] = (slot, self.counters[slot])
+        return [{
+            "idempotency_key": key,
+            "seq": self.numbers[key][1]
+        } for key in dict.fromkeys(body["p_keys"])]
+
+    def _claim_recurring(self, body):
+        """Wie claim_recurring_invoices in sql/004"""
+        now = datetime.datetime.fromisoformat(body["p_now"])
+        lease = datetime.timedelta(seconds=int(body["p_lease"].split()[0]))
+        due = sorted((r for r in self.recurring.values()
+                      if r["active"] and datetime.datetime.fromisoformat(
+                          r["next_run_at"]) <= now and
+                      (r["locked_until"] is None or r["locked_until"] < now)),
+                     key=lambda r: r["next_run_at"])[:body["p_limit"]]
+        for row in due:
+            row["locked_until"] = now + lease
+        return [{**r, "locked_until": r["locked_until"].isoformat()}
+                for r in due]
+
+    def _advance_recurring(self, body):
+        """Wie advance_recurring_invoices in sql/004"""
+        for run in body["p_runs"]:
+            self.recurring[run["id"]].update(run, locked_until=None)
+        return None
+
+    async def rpc(self, request: Request):
+        function = request.path_params["function"]
+        body = await request.json()
+        self.calls[f"rpc {function}"] += 1
+        if function != "assign_invoice_numbers":
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            handler = {
+                "claim_recurring_invoices": self._claim_recurring,
+                "advance_recurring_invoices": self._advance_recurring
+            }[function]
+            return JSONResponse(handler(body))
+        slot = (body["p_user_id"], body["p_year"])
+        # Die Zählerzeile bleibt für die Dauer der Transaktion gesperrt
+        async with self._locks.setdefault(slot, asyncio.Lock()):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            result = self._assign_numbers(body)
+        if random.random() < self.lost_responses:
+            return Response(status_code=503)
+        return JSONResponse(result)
+
+    def app(self):
+        return Starlette(routes=[
+            Route("/rest/v1/rpc/{function}", self.rpc, methods=["POST"]),
+            Route("/rest/v1/{table}",
+                  self.rest,
+                  methods=["GET", "POST", "PATCH"])
+        ])
+
+
+class FakeAnthropic:
+    """Ersatz für die Anthropic Messages API (ANTHROPIC_BASE_URL)"""
+
+    SENDER = {
+        "company_name": "Muster GmbH",
+        "street": "Hauptstraße 1",
+        "postal_code": "10115",
+        "city": "Berlin",
+        "email": "info@muster.de",
+        "phone": "+49 30 123456",
+        "tax_id": "DE123456789",
+        "iban": "DE89370400440532013000"
+    }
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+
+    async def messages(self, request: Request):
+        body = await request.json()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.calls["messages"] += 1
+        return JSONResponse({
+            "id": f"msg_{self.calls['messages']}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model"),
+            "content": [{
+                "type": "text",
+                "text": json.dumps(self.SENDER)
+            }],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {
+                "input_tokens": 1000,
+                "output_tokens": 100
+            }
+        })
+
+    def app(self):
+        return Starlette(
+            routes=[Route("/v1/messages", self.messages, methods=["POST"])])
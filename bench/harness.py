@@ -0,0 +1,321 @@
+"""Benchmark der echten Application aus main.py gegen lokale Ersatz-Server.
+
+Telegram, Supabase (PostgREST) und Claude laufen als Fakes aus fakes.py in
+diesem Prozess; synthetische Updates gehen direkt an
+Application.process_update. Gemessen wird pro Ablauf die Zeit bis zum Ende
+aller Handler:
+
+    profile   – Profil aus settings.html speichern (WEB_APP_DATA)
+    invoice   – Rechnung aus create_invoice.html anlegen inkl. PDF-Versand
+    ocr       – Foto im Einstellungsdialog analysieren (Bildvorverarbeitung
+                im Prozess-Pool + Claude)
+
+Ergebnis (Durchsatz, p50/p95/p99) wird mit bench/baseline.json verglichen;
+bei einer Verschlechterung über --tolerance endet das Skript mit Code 1.
+
+    python bench/harness.py --count 200 --concurrency 20
+    python bench/harness.py --save-baseline
+"""
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "bot"))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from fakes import (FakeAnthropic, FakePostgREST, FakeTelegram,  # noqa: E402
+                   start_server, stop_server)
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+FLOWS = ("profile", "invoice", "ocr")
+
+_update_ids = iter(range(1, 10**9))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def message(user_id, **fields):
+    n = next(_update_ids)
+    return {
+        "update_id": n,
+        "message": {
+            "message_id": n,
+            "date": int(time.time()),
+            "chat": {
+                "id": user_id,
+                "type": "private"
+            },
+            "from": {
+                "id": user_id,
+                "is_bot": False,
+                "first_name": "Bench"
+            },
+            **fields
+        }
+    }
+
+
+def web_app_data(user_id, payload):
+    return message(user_id,
+                   web_app_data={
+                       "data": json.dumps(payload),
+                       "button_text": "Bench"
+                   })
+
+
+def profile_payload(n):
+    return {
+        "type": "profile_update",
+        "company_name": f"Firma {n} GmbH",
+        "street": "Hauptstraße 1",
+        "city": "Berlin",
+        "postal_code": "10115",
+        "email": f"firma{n}@example.de",
+        "phone": "+49 30 123456",
+        "tax_id": "12/345/67890",
+        "iban": "DE89370400440532013000"
+    }
+
+
+def invoice_payload(n):
+    return {
+        "invoice_data": {
+            "client_name": f"Kunde {n}",
+            "client_address": "Musterweg 2\n20095 Hamburg",
+            "client_email": "kunde@example.de",
+            "description": f"Beratung, Auftrag {n}",
+            "amount": 1000.0,
+            "vat_rate": 19,
+            "total": 1190.0,
+            "date": "2025-03-01"
+        },
+        "nonce": f"bench-{n}"
+    }
+
+
+def sample_photo(n):
+    """Eigenes Bild pro Update, damit der Extraktions-Cache nicht greift"""
+    img = Image.new("RGB", (1240, 1754), "white")
+    draw = ImageDraw.Draw(img)
+    draw.text((80, 80), f"Muster GmbH · Hauptstraße 1 · 10115 Berlin · {n}",
+              fill="black")
+    for y in range(300, 1500, 40):
+        draw.line((80, y, 1160, y), fill="gray")
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=85)
+    return out.getvalue()
+
+
+async def drive(application, updates, concurrency):
+    """Verarbeitet die Updates mit begrenzter Parallelität; liefert Latenzen"""
+    from telegram import Update
+    latencies = []
+    queue = iter(updates)
+
+    async def worker():
+        for raw in queue:
+            update = Update.de_json(raw, application.bot)
+            start = time.perf_counter()
+            await application.process_update(update)
+            # Handler mit block=False (Dokumentanalyse) laufen als eigener
+            # Task weiter; gemessen wird bis zu ihrem Ende
+            tag = f"ConversationHandler:{update.update_id}:"
+            await asyncio.gather(*(t for t in asyncio.all_tasks()
+                                   if t.get_name().startswith(tag)),
+                                 return_exceptions=True)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - start
+
+
+async def run_flow(flow, application, fakes, args):
+    telegram, postgrest = fakes
+    users = [500000 + i for i in range(args.users)]
+    for user_id in users:
+        postgrest.profiles[user_id] = {
+            "id": user_id,
+            **{
+                k: v
+                for k, v in profile_payload(user_id).items() if k != "type"
+            }, "zip": "10115"
+        }
+    if flow == "profile":
+        updates = [
+            web_app_data(users[i % len(users)], profile_payload(i))
+            for i in range(args.count)
+        ]
+    elif flow == "invoice":
+        updates = [
+            web_app_data(users[i % len(users)], invoice_payload(i))
+            for i in range(args.count)
+        ]
+    else:
+        # Jeder Nutzer steht im Dialog bei "Dokument senden"
+        for user_id in users:
+            for text in ("⚙️ Einstellungen", "📄 Aus Dokument laden"):
+                await drive(application, [message(user_id, text=text)], 1)
+        updates = []
+        for i in range(args.count):
+            file_id = f"photo-{i}"
+            telegram.add_file(file_id, sample_photo(i))
+            updates.append(
+                message(users[i % len(users)],
+                        photo=[{
+                            "file_id": file_id,
+                            "file_unique_id": f"u-{file_id}",
+                            "width": 1240,
+                            "height": 1754
+                        }]))
+        # Nach der Analyse verlässt der Dialog WAITING_FOR_DOC; pro Nutzer
+        # daher nur ein Foto gleichzeitig im Flug
+        return await drive_ocr(application, updates, users, args)
+    return await drive(application, updates, args.concurrency)
+
+
+async def drive_ocr(application, updates, users, args):
+    """OCR-Ablauf: pro Runde ein Foto je Nutzer, danach zurück in den Dialog"""
+    latencies = []
+    wall = 0.0
+    per_round = len(users)
+    for i in range(0, len(updates), per_round):
+        lat, took = await drive(application, updates[i:i + per_round],
+                                args.concurrency)
+        latencies += lat
+        wall += took
+        for user_id in users:
+            await drive(application,
+                        [message(user_id, text="📄 Aus Dokument laden")], 1)
+    return latencies, wall
+
+
+def summarize(latencies, wall):
+    return {
+        "count": len(latencies),
+        "throughput": round(len(latencies) / wall, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1)
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Liste der Verschlechterungen gegenüber der Baseline"""
+    regressions = []
+    for flow, res in results.items():
+        base = baseline.get(flow)
+        if not base:
+            continue
+        if res["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{flow}: Durchsatz {res['throughput']}/s "
+                               f"< {base['throughput']}/s")
+        for key in ("p95_ms", "p99_ms"):
+            if res[key] > base[key] * (1 + tolerance):
+                regressions.append(
+                    f"{flow}: {key} {res[key]} > {base[key]}")
+    return regressions
+
+
+async def run(args):
+    telegram = FakeTelegram(latency=args.telegram_latency)
+    postgrest = FakePostgREST(latency=args.db_latency)
+    claude = FakeAnthropic(latency=args.claude_latency)
+    servers = [
+        await start_server(telegram.app(), args.port),
+        await start_server(postgrest.app(), args.port + 1),
+        await start_server(claude.app(), args.port + 2)
+    ]
+    os.environ.update(
+        TELEGRAM_BOT_TOKEN="123:bench",
+        TELEGRAM_BASE_URL=f"http://127.0.0.1:{args.port}/bot",
+        TELEGRAM_BASE_FILE_URL=f"http://127.0.0.1:{args.port}/file/bot",
+        SUPABASE_URL=f"http://127.0.0.1:{args.port + 1}",
+        SUPABASE_KEY="bench",
+        ANTHROPIC_BASE_URL=f"http://127.0.0.1:{args.port + 2}",
+        ANTHROPIC_API_KEY="bench",
+        DATA_DIR=tempfile.mkdtemp(prefix="bench-"),
+        PERSISTENCE="none",
+        PREFILL_BASE_URL="",
+        REDIS_URL="",
+        OCR_RATE_PER_MINUTE=os.getenv("OCR_RATE_PER_MINUTE", "100000"),
+        # Der Fake kennt keine Flood-Limits; Limiter aktiv, aber ohne Bremse
+        TELEGRAM_GLOBAL_RATE="100000",
+        TELEGRAM_GLOBAL_BURST="100000",
+        TELEGRAM_CHAT_RATE="100000",
+        TELEGRAM_CHAT_BURST="100000",
+        WARM_UP_DELAY="0")
+    import main
+    logging.getLogger().setLevel(logging.WARNING)
+    application = main.build_application(webhook=True)
+    results = {}
+    async with application:
+        await application.post_init(application)
+        # Gemessen wird der warme Zustand (bench_startup.py misst den Start)
+        await main._warm_task
+        await application.start()
+        for flow in args.flows:
+            latencies, wall = await run_flow(flow, application,
+                                             (telegram, postgrest), args)
+            results[flow] = summarize(latencies, wall)
+            r = results[flow]
+            print(f"{flow:8} {r['count']:5} in {wall:6.2f}s = "
+                  f"{r['throughput']:7.1f}/s   p50 {r['p50_ms']:7.1f} ms   "
+                  f"p95 {r['p95_ms']:7.1f} ms   p99 {r['p99_ms']:7.1f} ms")
+        await application.stop()
+    await application.post_shutdown(application)
+    for server in reversed(servers):
+        await stop_server(*server)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--flows", nargs="+", choices=FLOWS, default=FLOWS)
+    parser.add_argument("--count", type=int, default=200,
+                        help="Updates pro Ablauf")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--port", type=int, default=8790,
+                        help="erster von drei Ports für die Fakes")
+    parser.add_argument("--telegram-latency", type=float, default=0.02)
+    parser.add_argument("--db-latency", type=float, default=0.01)
+    parser.add_argument("--claude-latency", type=float, default=0.8)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="erlaubte Verschlechterung (0.25 = 25 %%)")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"Baseline gespeichert: {args.baseline}")
+        return
+    try:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print("Keine Baseline vorhanden (--save-baseline)")
+        return
+    regressions = compare(results, baseline, args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
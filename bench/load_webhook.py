@@ -0,0 +1,138 @@
+"""Lastgenerator für den Webhook-Betrieb.
+
+Schickt synthetische Telegram-Updates (/start) per HTTP an den Webhook und
+misst Durchsatz und Latenz. Ohne --url läuft alles in diesem Prozess: der
+Bot (build_application(webhook=True)) hinter dem ASGI-Server aus
+server.py und ein FakeTelegram als Bot API – es wird also nichts an die
+echte Telegram-API geschickt. Gemessen wird dann bis zur letzten Antwort.
+
+    python bench/load_webhook.py --updates 5000 --concurrency 100
+    python bench/load_webhook.py --url http://127.0.0.1:8080/telegram --secret s
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "bot"))
+
+import httpx  # noqa: E402
+
+from fakes import FakeTelegram, start_server, stop_server  # noqa: E402
+
+
+def make_update(n):
+    user_id = 100000 + n % 5000
+    return {
+        "update_id": n,
+        "message": {
+            "message_id": n,
+            "date": int(time.time()),
+            "chat": {
+                "id": user_id,
+                "type": "private"
+            },
+            "from": {
+                "id": user_id,
+                "is_bot": False,
+                "first_name": "Last"
+            },
+            "text": "/start",
+            "entities": [{
+                "type": "bot_command",
+                "offset": 0,
+                "length": 6
+            }]
+        }
+    }
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def post_updates(url, secret, count, concurrency):
+    latencies = []
+    counter = iter(range(1, count + 1))
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+
+        async def worker():
+            for n in counter:
+                start = time.perf_counter()
+                res = await client.post(url, json=make_update(n),
+                                        headers=headers)
+                res.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies
+
+
+def report(name, count, wall, latencies):
+    print(f"{name}: {count} Updates in {wall:.2f}s = {count / wall:.0f}/s   "
+          f"p50 {statistics.median(latencies) * 1000:.1f} ms   "
+          f"p95 {percentile(latencies, 95) * 1000:.1f} ms   "
+          f"p99 {percentile(latencies, 99) * 1000:.1f} ms")
+
+
+async def run_inprocess(args):
+    fake = FakeTelegram(latency=args.api_latency)
+    api = await start_server(fake.app(), args.api_port)
+    os.environ.update(
+        TELEGRAM_BOT_TOKEN="123:bench",
+        TELEGRAM_BASE_URL=f"http://127.0.0.1:{args.api_port}/bot",
+        TELEGRAM_BASE_FILE_URL=f"http://127.0.0.1:{args.api_port}/file/bot",
+        WEBHOOK_SECRET="bench")
+    import main
+    import server
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    application = main.build_application(webhook=True)
+    async with application:
+        await application.start()
+        web = await start_server(server.build_asgi_app(application),
+                                 args.port)
+        start = time.perf_counter()
+        latencies = await post_updates(
+            f"http://127.0.0.1:{args.port}/telegram", "bench", args.updates,
+            args.concurrency)
+        report("angenommen", args.updates, time.perf_counter() - start,
+               latencies)
+        await fake.wait_for("sendMessage", args.updates)
+        wall = time.perf_counter() - start
+        print(f"beantwortet: {args.updates} Updates in {wall:.2f}s = "
+              f"{args.updates / wall:.0f}/s")
+        await stop_server(*web)
+        await application.stop()
+    await stop_server(*api)
+
+
+async def run_remote(args):
+    start = time.perf_counter()
+    latencies = await post_updates(args.url, args.secret, args.updates,
+                                   args.concurrency)
+    report("angenommen", args.updates, time.perf_counter() - start,
+           latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", help="Webhook eines laufenden Bots")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET"))
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--port", type=int, default=8780)
+    parser.add_argument("--api-port", type=int, default=8781)
+    parser.add_argument("--api-latency", type=float, default=0.0,
+                        help="simulierte Latenz der Bot API in Sekunden")
+    args = parser.parse_args()
+    asyncio.run(run_remote(args) if args.url else run_inprocess(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+-- Index für "📋 Meine Rechnungen": Keyset-Pagination über
+-- (invoice_date, id) je Nutzer, neueste zuerst. Damit liest jede Seite
+-- nur die angezeigten Zeilen statt eines OFFSET-Scans.
+-- Rechnungen ohne Datum sortiert db.list_invoices ans Ende (nullslast);
+-- der Index folgt derselben Reihenfolge. Ein älterer
+-- invoices_user_date_id_idx (ohne "nulls last") kann danach mit
+-- "drop index concurrently invoices_user_date_id_idx;" entfernt werden.
+-- Im Supabase SQL-Editor ausführen. CONCURRENTLY sperrt die Tabelle nicht,
+-- darf aber nicht innerhalb einer Transaktion laufen.
+
+create index concurrently if not exists invoices_user_date_id_nl_idx
+    on public.invoices (user_id, invoice_date desc nulls last, id desc);
@@ -0,0 +1,9 @@
+-- Idempotenz-Schlüssel für Rechnungen: der Bot schreibt Rechnungen
+-- gebündelt per Upsert mit on_conflict=idempotency_key. Wiederholte
+-- Schreibversuche (Verbindungsabbruch, Spool-Nachreichung) erzeugen so
+-- keine Duplikate.
+-- Im Supabase SQL-Editor ausführen, danach
+-- 002_invoices_idempotency_key_index.sql als eigenes Skript.
+
+alter table public.invoices
+    add column if not exists idempotency_key text;
@@ -0,0 +1,8 @@
+-- Eindeutiger Index für on_conflict=idempotency_key (nach
+-- 002_invoices_idempotency_key.sql). Als eigenes Skript ausführen, ohne
+-- weitere Anweisungen: CONCURRENTLY sperrt die Tabelle nicht, darf aber
+-- nicht innerhalb einer Transaktion laufen, und der Supabase SQL-Editor
+-- führt ein Skript mit mehreren Anweisungen als eine Transaktion aus.
+
+create unique index concurrently if not exists invoices_idempotency_key_idx
+    on public.invoices (idempotency_key);
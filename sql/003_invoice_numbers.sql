@@ -0,0 +1,81 @@
+-- Fortlaufende Rechnungsnummern je Nutzer und Jahr (§ 14 Abs. 4 UStG).
+--
+-- invoice_counters hält die zuletzt vergebene Nummer, invoice_numbers die
+-- Zuordnung Idempotenz-Schlüssel -> Nummer. assign_invoice_numbers vergibt
+-- in einem Aufruf Nummern für mehrere Rechnungen eines Nutzers: bereits
+-- bekannte Schlüssel (Wiederholung nach Verbindungsabbruch) erhalten ihre
+-- alte Nummer zurück, neue Schlüssel einen lückenlosen Block. Die
+-- Zählerzeile ist nur für die Dauer dieses einen Aufrufs gesperrt; der
+-- Bot bündelt parallele Anfragen desselben Nutzers zu einem Aufruf.
+--
+-- Lückenlos ist die Vergabe, nicht zwingend die Tabelle invoices: Die
+-- Nummer wird vergeben, bevor der Bot die Rechnung gebündelt schreibt
+-- (invoice_writer.py). Eine Rechnung im Spool bekommt ihre Zeile später,
+-- eine erneut gesendete (gleicher Schlüssel) dieselbe Nummer. Lehnt die
+-- Datenbank die Zeile endgültig ab (Dead-Letter-Datei) oder sendet der
+-- Nutzer nach einem Fehler nie erneut, bleibt die Nummer in
+-- invoice_numbers ohne Rechnung; solche Lücken findet
+--     select n.* from public.invoice_numbers n
+--      where not exists (select 1 from public.invoices i
+--                         where i.idempotency_key = n.idempotency_key);
+-- und sie sind zu dokumentieren (z.B. als stornierte Nummer).
+-- Im Supabase SQL-Editor ausführen, danach
+-- 003_invoice_numbers_index.sql als eigenes Skript.
+
+create table if not exists public.invoice_counters (
+    user_id bigint not null,
+    year integer not null,
+    last_seq bigint not null default 0,
+    primary key (user_id, year)
+);
+
+create table if not exists public.invoice_numbers (
+    idempotency_key text primary key,
+    user_id bigint not null,
+    year integer not null,
+    seq bigint not null,
+    created_at timestamptz not null default now(),
+    unique (user_id, year, seq)
+);
+
+alter table public.invoices
+    add column if not exists invoice_number text;
+
+create or replace function public.assign_invoice_numbers(
+    p_user_id bigint, p_year integer, p_keys text[])
+returns table (idempotency_key text, seq bigint)
+language plpgsql
+as $$
+#variable_conflict use_column
+declare
+    v_last bigint;
+    v_added bigint;
+begin
+    -- Zählerzeile anlegen bzw. sperren; parallele Aufrufe für denselben
+    -- Nutzer und dasselbe Jahr warten hier bis zum Ende der Transaktion
+    insert into public.invoice_counters as c (user_id, year, last_seq)
+    values (p_user_id, p_year, 0)
+    on conflict (user_id, year) do update set last_seq = c.last_seq
+    returning c.last_seq into v_last;
+
+    insert into public.invoice_numbers (idempotency_key, user_id, year, seq)
+    select u.k, p_user_id, p_year, v_last + row_number() over (order by u.o)
+      from (select distinct on (k) k, o
+              from unnest(p_keys) with ordinality as t(k, o)
+             order by k, o) as u
+     where not exists (select 1 from public.invoice_numbers n
+                        where n.idempotency_key = u.k);
+    get diagnostics v_added = row_count;
+
+    if v_added > 0 then
+        update public.invoice_counters
+           set last_seq = v_last + v_added
+         where user_id = p_user_id and year = p_year;
+    end if;
+
+    return query
+        select n.idempotency_key, n.seq
+          from public.invoice_numbers n
+         where n.idempotency_key = any(p_keys);
+end;
+$$;
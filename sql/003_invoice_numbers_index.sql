@@ -0,0 +1,6 @@
+-- Eindeutige Rechnungsnummer je Nutzer (nach 003_invoice_numbers.sql).
+-- Als eigenes Skript ausführen, ohne weitere Anweisungen: CONCURRENTLY
+-- darf nicht innerhalb einer Transaktion laufen.
+
+create unique index concurrently if not exists invoices_user_number_idx
+    on public.invoices (user_id, invoice_number);
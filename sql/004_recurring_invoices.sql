@@ -0,0 +1,65 @@
+-- Wiederkehrende Rechnungen (recurring.py): Vorlagen mit Zeitplan
+-- (monthly, quarterly oder cron) neben der Tabelle invoices. Der Bot holt
+-- pro Durchlauf mit claim_recurring_invoices einen Block fälliger
+-- Vorlagen über den Teilindex auf next_run_at, statt für jede Vorlage
+-- einen eigenen Timer zu halten. FOR UPDATE SKIP LOCKED und locked_until
+-- verhindern, dass mehrere Repliken dieselbe Vorlage bearbeiten; nach dem
+-- Bulk-Insert der Rechnungen setzt advance_recurring_invoices next_run_at
+-- für den ganzen Block auf den nächsten Termin.
+-- Im Supabase SQL-Editor ausführen, danach
+-- 004_recurring_invoices_index.sql als eigenes Skript.
+
+create table if not exists public.recurring_invoices (
+    id bigint generated always as identity primary key,
+    user_id bigint not null,
+    -- WebApp-Daten der ersten Rechnung (ohne Nummer)
+    invoice_data jsonb not null,
+    schedule text not null check (schedule in ('monthly', 'quarterly', 'cron')),
+    cron text,
+    -- Tag im Monat für monthly/quarterly (31 = immer der Monatsletzte)
+    anchor_day smallint,
+    next_run_at timestamptz not null,
+    last_run_at timestamptz,
+    locked_until timestamptz,
+    active boolean not null default true,
+    -- Schlüssel des Formulars: doppelt gesendet = eine Vorlage
+    idempotency_key text unique,
+    created_at timestamptz not null default now()
+);
+
+alter table public.invoices
+    add column if not exists recurring_id bigint
+        references public.recurring_invoices (id) on delete set null;
+
+create or replace function public.claim_recurring_invoices(
+    p_now timestamptz, p_limit integer, p_lease interval)
+returns setof public.recurring_invoices
+language sql
+as $$
+    update public.recurring_invoices r
+       set locked_until = p_now + p_lease
+     where r.id in (select d.id
+                      from public.recurring_invoices d
+                     where d.active
+                       and d.next_run_at <= p_now
+                       and (d.locked_until is null or d.locked_until < p_now)
+                     order by d.next_run_at
+                     limit p_limit
+                       for update skip locked)
+    returning r.*;
+$$;
+
+create or replace function public.advance_recurring_invoices(p_runs jsonb)
+returns void
+language sql
+as $$
+    update public.recurring_invoices r
+       set next_run_at = u.next_run_at,
+           last_run_at = u.last_run_at,
+           active = u.active,
+           locked_until = null
+      from jsonb_to_recordset(p_runs)
+           as u(id bigint, next_run_at timestamptz, last_run_at timestamptz,
+                active boolean)
+     where r.id = u.id;
+$$;
@@ -0,0 +1,7 @@
+-- Teilindex für claim_recurring_invoices: fällige aktive Vorlagen nach
+-- next_run_at (nach 004_recurring_invoices.sql). Als eigenes Skript
+-- ausführen, ohne weitere Anweisungen: CONCURRENTLY darf nicht innerhalb
+-- einer Transaktion laufen.
+
+create index concurrently if not exists recurring_invoices_due_idx
+    on public.recurring_invoices (next_run_at) where active;
@@ -0,0 +1,10 @@
+-- Inhalt der Rechnung, wie sie verschickt wurde: invoice_data sind die
+-- Formulardaten samt Positionen (items), profile_snapshot das Profil des
+-- Absenders (Adresse, Bankverbindung) zum Zeitpunkt der Rechnung. Der
+-- Jahresexport rendert die PDFs aus diesen Spalten statt aus den
+-- Einzelspalten und dem aktuellen Profil; Zeilen ohne Snapshot (ältere
+-- Rechnungen, Importe) erscheinen dort nur in der Buchungsliste.
+
+alter table public.invoices
+    add column if not exists invoice_data jsonb,
+    add column if not exists profile_snapshot jsonb;
@@ -0,0 +1,319 @@
+import os
+import csv
+import time
+import asyncio
+import hashlib
+import logging
+import datetime
+import itertools
+from functools import lru_cache
+from decimal import Decimal, InvalidOperation
+
+import totals
+import resilience
+from invoice_writer import idempotency_key, upsert_rows
+
+# Massenimport alter Rechnungen aus CSV oder XLSX. Die Datei liegt auf der
+# Platte und wird zeilenweise gelesen (csv-Modul bzw. openpyxl im
+# read_only-Modus), blockweise in einem Thread geparst und geprüft und in
+# Blöcken per Bulk-Upsert geschrieben, während der nächste Block schon
+# gelesen wird. Der Speicherbedarf hängt so nur von der Blockgröße ab,
+# nicht von der Dateigröße. Der Idempotenz-Schlüssel enthält Hash der Datei
+# und Zeilennummer: Ein erneuter Import derselben Datei ist ungefährlich,
+# gleiche Zeilen innerhalb einer Datei (wiederkehrende Leistungen) bleiben
+# trotzdem getrennte Rechnungen. Lehnt die Datenbank einzelne Zeilen ab,
+# erscheinen sie mit Zeilennummer in der Fehlerliste.
+
+logger = logging.getLogger(__name__)
+
+# Spaltenköpfe (klein, ohne Leerzeichen) -> Feld wie im web_app_data_handler
+HEADER_ALIASES = {
+    "client_name": "client_name",
+    "kunde": "client_name",
+    "kundenname": "client_name",
+    "name": "client_name",
+    "client_address": "client_address",
+    "adresse": "client_address",
+    "anschrift": "client_address",
+    "client_email": "client_email",
+    "email": "client_email",
+    "e-mail": "client_email",
+    "description": "description",
+    "beschreibung": "description",
+    "leistung": "description",
+    "amount": "amount",
+    "netto": "amount",
+    "betrag": "amount",
+    "nettobetrag": "amount",
+    "vat_rate": "vat_rate",
+    "mwst": "vat_rate",
+    "ust": "vat_rate",
+    "steuersatz": "vat_rate",
+    "total": "total",
+    "brutto": "total",
+    "gesamt": "total",
+    "bruttobetrag": "total",
+    "date": "date",
+    "invoice_date": "date",
+    "datum": "date",
+    "rechnungsdatum": "date"
+}
+REQUIRED = ("client_name", "amount", "vat_rate", "total", "date")
+MAX_ERRORS = 20
+
+_active = set()
+
+
+class InvalidFile(Exception):
+    """Datei nicht lesbar oder Pflichtspalten fehlen"""
+
+
+class ImportBusy(Exception):
+    """Für diesen Nutzer läuft bereits ein Import"""
+
+
+# --- LESEN ---
+
+
+def _sniff_encoding(path):
+    with open(path, "rb") as f:
+        head = f.read(65536)
+    try:
+        head.decode("utf-8")
+        return "utf-8-sig"
+    except UnicodeDecodeError as e:
+        # Abgeschnittenes Mehrbyte-Zeichen am Ende des Ausschnitts
+        return "utf-8-sig" if e.start >= len(head) - 3 else "cp1252"
+
+
+def iter_csv(path):
+    encoding = _sniff_encoding(path)
+    with open(path, newline="", encoding=encoding) as f:
+        sample = f.read(8192)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=";,\t")
+        except csv.Error:
+            dialect = csv.excel
+        yield from csv.reader(f, dialect)
+
+
+def iter_xlsx(path):
+    try:
+        import openpyxl
+    except ImportError:
+        raise InvalidFile("XLSX-Import ist nicht installiert (openpyxl)")
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from wb.worksheets[0].iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def iter_rows(path):
+    if path.lower().endswith(".xlsx"):
+        return iter_xlsx(path)
+    return iter_csv(path)
+
+
+# --- PRÜFEN ---
+
+
+def parse_decimal(value):
+    if isinstance(value, (int, float, Decimal)):
+        value = str(value)
+    text = str(value or "").strip().replace("€", "").replace(" ", "")
+    if "," in text:
+        # Deutsches Format: 1.234,56
+        text = text.replace(".", "").replace(",", ".")
+    try:
+        number = Decimal(text)
+    except InvalidOperation:
+        raise ValueError(f"keine Zahl: {value!r}")
+    if not number.is_finite():
+        raise ValueError(f"keine Zahl: {value!r}")
+    return number
+
+
+def parse_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date().isoformat()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return _parse_date_text(str(value or "").strip())
+
+
+@lru_cache(maxsize=4096)
+def _parse_date_text(text):
+    # Exporte wiederholen dieselben Daten sehr oft; strptime ist teuer
+    for fmt in ("%Y-%m-%d", "%d.%m.%Y", "%d.%m.%y"):
+        try:
+            return datetime.datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            pass
+    raise ValueError(f"kein Datum: {text!r}")
+
+
+def map_header(header):
+    columns = {}
+    for i, name in enumerate(header):
+        field = HEADER_ALIASES.get(str(name or "").strip().lower().replace(
+            " ", ""))
+        if field and field not in columns:
+            columns[field] = i
+    missing = [f for f in REQUIRED if f not in columns]
+    if missing:
+        raise InvalidFile(f"Spalten fehlen: {', '.join(missing)}")
+    return columns
+
+
+def to_invoice(user_id, columns, values, nonce=None):
+    """Zeile -> Datensatz für invoices; wirft ValueError bei ungültigen Daten.
+    `nonce` (Datei-Hash und Zeilennummer) geht in den Idempotenz-Schlüssel."""
+    get = {
+        field: values[i] if i < len(values) else None
+        for field, i in columns.items()
+    }
+    client_name = str(get["client_name"] or "").strip()
+    if not client_name:
+        raise ValueError("client_name fehlt")
+    amount = parse_decimal(get["amount"])
+    total = parse_decimal(get["total"])
+    rate = parse_decimal(str(get["vat_rate"] or "").replace("%", ""))
+    if amount < 0 or total < 0:
+        raise ValueError("negativer Betrag")
+    # Steuersatz und Brutto gegen die Serverberechnung prüfen
+    totals.verify({"amount": amount, "vat_rate": rate, "total": total})
+    inv = {
+        "client_name": client_name,
+        "client_address": str(get.get("client_address") or "") or None,
+        "client_email": str(get.get("client_email") or "") or None,
+        "description": str(get.get("description") or "") or None,
+        "amount": float(amount),
+        "vat_rate": int(rate),
+        "total": float(total),
+        "date": parse_date(get["date"])
+    }
+    return {
+        "user_id": user_id,
+        "client_name": inv["client_name"],
+        "client_address": inv["client_address"],
+        "client_email": inv["client_email"],
+        "description": inv["description"],
+        "amount": inv["amount"],
+        "vat_rate": inv["vat_rate"],
+        "total": inv["total"],
+        "invoice_date": inv["date"],
+        "status": "created",
+        "idempotency_key": idempotency_key(user_id, inv, nonce)
+    }
+
+
+class ImportStats:
+
+    def __init__(self):
+        self.read = 0
+        self.saved = 0
+        self.errors = []
+        self.error_count = 0
+
+    def error(self, line, reason):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append(f"Zeile {line}: {reason}")
+
+
+def file_digest(path):
+    """Kurzer SHA-256 des Dateiinhalts (im Thread aufrufen)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def _parse_chunk(rows, user_id, columns, stats, size, file_id):
+    """Liest bis zu `size` Zeilen (im Thread); liefert (gültige Datensätze
+    als (zeile, datensatz), Dateiende erreicht)"""
+    chunk = []
+    consumed = 0
+    for line, values in itertools.islice(rows, size):
+        consumed += 1
+        if not values or not any(v not in (None, "") for v in values):
+            continue
+        stats.read += 1
+        try:
+            chunk.append((line,
+                          to_invoice(user_id, columns, values,
+                                     f"{file_id}:{line}")))
+        except ValueError as e:
+            stats.error(line, e)
+    return chunk, consumed < size
+
+
+async def import_file(path, user_id, on_progress=None):
+    """Importiert die Datei; on_progress(stats) wird höchstens alle
+    IMPORT_PROGRESS_INTERVAL Sekunden aufgerufen"""
+    if user_id in _active:
+        raise ImportBusy()
+    _active.add(user_id)
+    try:
+        chunk_size = int(os.getenv("IMPORT_CHUNK_SIZE", "500"))
+        interval = float(os.getenv("IMPORT_PROGRESS_INTERVAL", "2"))
+        file_id = await asyncio.to_thread(file_digest, path)
+        source = iter_rows(path)
+        rows = enumerate(source, start=1)
+        try:
+            first = await asyncio.to_thread(next, rows, None)
+            if first is None:
+                raise InvalidFile("Die Datei ist leer")
+            columns = map_header(first[1])
+            return await _import_rows(rows, user_id, columns, file_id,
+                                      chunk_size, interval, on_progress)
+        finally:
+            source.close()
+    finally:
+        _active.discard(user_id)
+
+
+async def _write_chunk(chunk, stats):
+    """Bulk-Upsert eines Blocks; abgelehnte Zeilen kommen mit Zeilennummer
+    in die Fehlerliste. Wirft resilience.Unavailable, wenn Supabase nicht
+    erreichbar ist (bereits geschriebene Zeilen sind gezählt)."""
+    lines = {row["idempotency_key"]: line for line, row in chunk}
+    transient, rejected = await upsert_rows([row for _, row in chunk])
+    stats.saved += len(chunk) - len(transient) - len(rejected)
+    for row in rejected:
+        stats.error(lines[row["idempotency_key"]],
+                    "von der Datenbank abgelehnt")
+    if transient:
+        raise resilience.Unavailable(
+            f"{len(transient)} Zeile(n) nicht gespeichert")
+
+
+async def _import_rows(rows, user_id, columns, file_id, chunk_size, interval,
+                       on_progress):
+    stats = ImportStats()
+    last_report = time.monotonic()
+
+    def parse():
+        return asyncio.to_thread(_parse_chunk, rows, user_id, columns, stats,
+                                 chunk_size, file_id)
+
+    chunk, done = await parse()
+    while True:
+        # Nächsten Block lesen, während der aktuelle geschrieben wird
+        upcoming = None if done else asyncio.create_task(parse())
+        try:
+            if chunk:
+                await _write_chunk(chunk, stats)
+        except BaseException:
+            if upcoming is not None:
+                await asyncio.gather(upcoming, return_exceptions=True)
+            raise
+        if upcoming is None:
+            return stats
+        chunk, done = await upcoming
+        if on_progress and time.monotonic() - last_report >= interval:
+            last_report = time.monotonic()
+            await on_progress(stats)
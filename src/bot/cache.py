@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import logging
+from collections import OrderedDict
+
+# Profil-Cache pro Telegram-User-ID: lokal (TTL + LRU) und optional
+# zusätzlich in Redis, damit mehrere Bot-Prozesse denselben Stand sehen.
+# Schreibt ein anderer Prozess ein Profil, erfährt die lokale Schicht davon
+# nichts; mit Redis hält sie Profile daher nur local_ttl Sekunden (Standard
+# 5), damit geänderte Bankdaten oder Adressen schnell überall ankommen.
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class TTLCache:
+    """In-Process-Cache mit Ablaufzeit und LRU-Verdrängung"""
+
+    def __init__(self, maxsize=10000, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING:
+            return default
+        expires, value = item
+        if expires < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ProfileCache:
+    """Profil-Cache mit Treffer-/Fehlzählern und optionalem Redis-Backend"""
+
+    def __init__(self, maxsize=10000, ttl=300.0, redis_url=None,
+                 prefix="profile", local_ttl=5.0):
+        self.prefix = prefix
+        # Ohne Redis ist die lokale Schicht der einzige Stand
+        self.local = TTLCache(maxsize, local_ttl if redis_url else ttl)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._redis = None
+        if redis_url:
+            import redis.asyncio as redis
+            self._redis = redis.from_url(redis_url)
+
+    def _key(self, user_id):
+        return f"{self.prefix}:{user_id}"
+
+    async def get(self, user_id):
+        profile = self.local.get(user_id)
+        if profile is None and self._redis is not None:
+            try:
+                raw = await self._redis.get(self._key(user_id))
+                if raw:
+                    profile = json.loads(raw)
+                    self.local.set(user_id, profile)
+            except Exception as e:
+                logger.warning(f"Redis nicht erreichbar (Profil lesen): {e}")
+        if profile is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return profile
+
+    async def set(self, user_id, profile):
+        self.local.set(user_id, profile)
+        if self._redis is not None:
+            try:
+                await self._redis.set(self._key(user_id),
+                                      json.dumps(profile, default=str),
+                                      ex=int(self.ttl))
+            except Exception as e:
+                logger.warning(f"Redis nicht erreichbar (Profil schreiben): {e}")
+
+    async def invalidate(self, user_id):
+        self.local.delete(user_id)
+        if self._redis is not None:
+            try:
+                await self._redis.delete(self._key(user_id))
+            except Exception as e:
+                logger.warning(f"Redis nicht erreichbar (Profil löschen): {e}")
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self.local)
+        }
+
+    async def close(self):
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+
+_profile_cache = None
+
+
+def get_profile_cache():
+    global _profile_cache
+    if _profile_cache is None:
+        _profile_cache = ProfileCache(
+            maxsize=int(os.getenv("PROFILE_CACHE_SIZE", "10000")),
+            ttl=float(os.getenv("PROFILE_CACHE_TTL", "300")),
+            redis_url=os.getenv("REDIS_URL") or None,
+            local_ttl=float(os.getenv("PROFILE_CACHE_LOCAL_TTL", "5")))
+    return _profile_cache
@@ -0,0 +1,251 @@
+import os
+import asyncio
+import logging
+import httpx
+
+import metrics
+import resilience
+from cache import get_profile_cache
+
+# Asynchroner Datenzugriff auf Supabase (PostgREST) für Profile und Rechnungen.
+# Alle Handler gehen über dieses Modul, damit kein synchroner Roundtrip
+# den Event-Loop blockiert. Jeder Aufruf läuft über resilience.call
+# (Backoff, Circuit Breaker pro Endpunkt, Retry-Budget, Frist); nach
+# erschöpften Versuchen kommt resilience.Unavailable.
+
+logger = logging.getLogger(__name__)
+
+_client = None
+
+
+def _get_client():
+    """Erzeugt beim ersten Aufruf den gepoolten HTTP-Client für PostgREST"""
+    global _client
+    if _client is None:
+        url = os.getenv("SUPABASE_URL", "").rstrip("/")
+        key = os.getenv("SUPABASE_KEY", "")
+        pool_size = int(os.getenv("DB_POOL_SIZE", "20"))
+        timeout = float(os.getenv("DB_TIMEOUT", "10"))
+        _client = httpx.AsyncClient(
+            base_url=f"{url}/rest/v1",
+            headers={
+                "apikey": key,
+                "Authorization": f"Bearer {key}"
+            },
+            limits=httpx.Limits(max_connections=pool_size,
+                                max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(timeout,
+                                  connect=float(
+                                      os.getenv("DB_CONNECT_TIMEOUT", "5"))))
+    return _client
+
+
+async def warm_up():
+    """Legt den Client an (TLS-Kontext im Thread) und öffnet vorab eine
+    Verbindung, damit die erste echte Anfrage den Handshake spart"""
+    client = await asyncio.to_thread(_get_client)
+    try:
+        await client.get("/profiles", params={"select": "id", "limit": "0"})
+    except httpx.HTTPError as e:
+        logger.info(f"Supabase beim Vorwärmen nicht erreichbar: {e}")
+
+
+async def _request(method, table, params=None, json=None, prefer=None):
+    headers = {"Prefer": prefer} if prefer else None
+
+    async def attempt():
+        async with metrics.timed("supabase", f"{method} {table}"):
+            res = await _get_client().request(method,
+                                              f"/{table}",
+                                              params=params,
+                                              json=json,
+                                              headers=headers)
+            res.raise_for_status()
+        return res.json() if res.content else []
+
+    # Alle Schreibzugriffe sind Upserts, Wiederholungen also unkritisch
+    return await resilience.call(f"{method} {table}", attempt)
+
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+    await get_profile_cache().close()
+
+
+# --- PROFILE ---
+
+
+async def get_profile(user_id):
+    """Liefert die Profilzeile des Nutzers oder None (zuerst aus dem Cache)"""
+    cache = get_profile_cache()
+    profile = await cache.get(user_id)
+    if profile is not None:
+        return profile
+    rows = await _request("GET",
+                          "profiles",
+                          params={
+                              "select": "*",
+                              "id": f"eq.{user_id}"
+                          })
+    if not rows:
+        return None
+    await cache.set(user_id, rows[0])
+    return rows[0]
+
+
+async def get_profiles(user_ids, chunk_size=200):
+    """Profile vieler Nutzer: {user_id: profil}; was nicht im Cache ist,
+    kommt mit einer Abfrage je `chunk_size` Nutzer (id=in.(...))"""
+    cache = get_profile_cache()
+    cached = await asyncio.gather(*(cache.get(u) for u in user_ids))
+    profiles = {u: p for u, p in zip(user_ids, cached) if p is not None}
+    missing = [u for u in user_ids if u not in profiles]
+    for i in range(0, len(missing), chunk_size):
+        ids = ",".join(str(u) for u in missing[i:i + chunk_size])
+        rows = await _request("GET",
+                              "profiles",
+                              params={
+                                  "select": "*",
+                                  "id": f"in.({ids})"
+                              })
+        for row in rows:
+            profiles[row["id"]] = row
+            await cache.set(row["id"], row)
+    return profiles
+
+
+async def upsert_profile(profile_data):
+    """Speichert das Profil und aktualisiert den Cache (Write-Through)"""
+    rows = await _request(
+        "POST",
+        "profiles",
+        json=profile_data,
+        prefer="resolution=merge-duplicates,return=representation")
+    cache = get_profile_cache()
+    if rows:
+        await cache.set(profile_data["id"], rows[0])
+    else:
+        await cache.invalidate(profile_data["id"])
+
+
+# --- RECHNUNGEN ---
+
+
+async def upsert_invoices(rows):
+    """Bulk-Insert; Zeilen mit bekanntem idempotency_key werden ignoriert"""
+    await _request("POST",
+                   "invoices",
+                   params={"on_conflict": "idempotency_key"},
+                   json=rows,
+                   prefer="resolution=ignore-duplicates,return=minimal")
+
+
+async def set_invoice_status(idempotency_key, status):
+    """Status einer Rechnung setzen (z.B. nach dem E-Mail-Versand)"""
+    await _request("PATCH",
+                   "invoices",
+                   params={"idempotency_key": f"eq.{idempotency_key}"},
+                   json={"status": status},
+                   prefer="return=minimal")
+
+
+HISTORY_COLUMNS = "id,invoice_date,invoice_number,client_name,total,status"
+
+
+async def list_invoices(user_id, limit=10, after=None, before=None):
+    """Eine Seite der Rechnungen, neueste zuerst (Keyset-Pagination).
+
+    after/before sind (invoice_date, id) der letzten bzw. ersten Zeile der
+    aktuellen Seite. Rechnungen ohne Datum stehen am Ende (nullslast), ihr
+    Cursor trägt invoice_date None. Liefert (zeilen, weitere_vorhanden)."""
+    params = {"select": HISTORY_COLUMNS, "user_id": f"eq.{user_id}",
+              "limit": limit + 1}
+    if before:
+        date, inv_id = before
+        if date is None:
+            params["or"] = ("(invoice_date.not.is.null,"
+                            f"and(invoice_date.is.null,id.gt.{inv_id}))")
+        else:
+            params["or"] = (f'(invoice_date.gt."{date}",'
+                            f'and(invoice_date.eq."{date}",id.gt.{inv_id}))')
+        params["order"] = "invoice_date.asc.nullsfirst,id.asc"
+    else:
+        if after:
+            date, inv_id = after
+            if date is None:
+                params["and"] = f"(invoice_date.is.null,id.lt.{inv_id})"
+            else:
+                params["or"] = (f'(invoice_date.lt."{date}",'
+                                f'and(invoice_date.eq."{date}",'
+                                f'id.lt.{inv_id}),invoice_date.is.null)')
+        params["order"] = "invoice_date.desc.nullslast,id.desc"
+    rows = await _request("GET", "invoices", params=params)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if before:
+        rows.reverse()
+    return rows, has_more
+
+
+async def scan_invoices(user_id, date_from, date_to, limit=500, after=None):
+    """Rechnungen im Zeitraum [date_from, date_to), älteste zuerst, alle
+    Spalten; after = (invoice_date, id) der letzten Zeile der Vorseite"""
+    params = {"select": "*", "user_id": f"eq.{user_id}",
+              "and": f"(invoice_date.gte.{date_from},"
+                     f"invoice_date.lt.{date_to})",
+              "order": "invoice_date.asc,id.asc", "limit": limit}
+    if after:
+        date, inv_id = after
+        params["or"] = (f'(invoice_date.gt."{date}",'
+                        f'and(invoice_date.eq."{date}",id.gt.{inv_id}))')
+    return await _request("GET", "invoices", params=params)
+
+
+async def assign_invoice_numbers(user_id, year, keys):
+    """Fortlaufende Nummern für die Idempotenz-Schlüssel (sql/003);
+    liefert {schlüssel: laufende_nummer}. Bekannte Schlüssel behalten ihre
+    Nummer, Wiederholungen sind daher unkritisch."""
+    rows = await _request("POST",
+                          "rpc/assign_invoice_numbers",
+                          json={
+                              "p_user_id": user_id,
+                              "p_year": year,
+                              "p_keys": list(keys)
+                          })
+    return {row["idempotency_key"]: row["seq"] for row in rows}
+
+
+# --- WIEDERKEHRENDE RECHNUNGEN (sql/004) ---
+
+
+async def insert_recurring(row):
+    """Legt eine Vorlage an; ein doppelt gesendetes Formular (gleicher
+    idempotency_key) erzeugt keine zweite"""
+    await _request("POST",
+                   "recurring_invoices",
+                   params={"on_conflict": "idempotency_key"},
+                   json=row,
+                   prefer="resolution=ignore-duplicates,return=minimal")
+
+
+async def claim_recurring(now, limit, lease_seconds):
+    """Bis zu `limit` fällige Vorlagen, älteste zuerst; sie sind für
+    `lease_seconds` für andere Repliken gesperrt"""
+    return await _request("POST",
+                          "rpc/claim_recurring_invoices",
+                          json={
+                              "p_now": now.isoformat(),
+                              "p_limit": limit,
+                              "p_lease": f"{int(lease_seconds)} seconds"
+                          })
+
+
+async def advance_recurring(runs):
+    """Nächste Termine für einen Block von Vorlagen in einem Aufruf;
+    runs: [{id, next_run_at, last_run_at, active}]"""
+    await _request("POST",
+                   "rpc/advance_recurring_invoices",
+                   json={"p_runs": runs})
@@ -0,0 +1,161 @@
+import io
+import os
+import asyncio
+import hashlib
+import tempfile
+
+import httpx
+
+import metrics
+
+# Downloads von Nutzerdateien aus Telegram (Fotos/PDFs für die Extraktion,
+# CSV/XLSX für den Import). Typ und Größe werden vor dem Abruf geprüft, die
+# Datei wird blockweise gestreamt und dabei gehasht. Bis
+# DOWNLOAD_SPOOL_BYTES bleibt sie im Speicher, größere Dateien landen in
+# einer benannten temporären Datei, die die Worker-Prozesse über den Pfad
+# öffnen (PDFs per mmap). tempfile.SpooledTemporaryFile wechselt in eine
+# namenlose Datei, die ein anderer Prozess nicht öffnen kann – daher Spool.
+# DOWNLOAD_CONCURRENCY begrenzt parallele Downloads; so bleibt der
+# Speicher pro Upload und insgesamt beschränkt.
+
+MAX_BYTES = int(os.getenv("DOWNLOAD_MAX_BYTES",
+                          str(20 * 1024 * 1024)))  # Grenze der Bot API
+SPOOL_BYTES = int(os.getenv("DOWNLOAD_SPOOL_BYTES", str(1024 * 1024)))
+CHUNK_SIZE = 64 * 1024
+
+PDF_TYPES = {"application/pdf"}
+IMAGE_TYPES = {"image/jpeg", "image/png", "image/webp"}
+
+_client = None
+_semaphore = None
+
+
+class Rejected(Exception):
+    """Datei wird nicht geladen (Typ oder Größe); der Text geht an den Nutzer"""
+
+
+def too_large(max_bytes):
+    return Rejected(f"Die Datei ist zu groß (max. {max_bytes // 2**20} MB).")
+
+
+class Spool:
+    """Inhalt eines Downloads: bis `max_memory` Bytes im Speicher, darüber
+    in einer benannten temporären Datei; max_memory=0 schreibt sofort auf
+    die Platte (z.B. für den Import, der einen Pfad braucht)"""
+
+    def __init__(self, max_memory=SPOOL_BYTES, suffix=""):
+        self.max_memory = max_memory
+        self.suffix = suffix
+        self.size = 0
+        self.path = None
+        self._buf = io.BytesIO()
+        self._file = None
+        self._hash = hashlib.sha256()
+        if max_memory <= 0:
+            self._rollover()
+
+    def _rollover(self):
+        fd, self.path = tempfile.mkstemp(prefix="download-",
+                                         suffix=self.suffix)
+        self._file = os.fdopen(fd, "wb")
+        self._file.write(self._buf.getbuffer())
+        self._buf = None
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        self._hash.update(chunk)
+        if self._file is None and self.size > self.max_memory:
+            self._rollover()
+        (self._file or self._buf).write(chunk)
+
+    def finish(self):
+        if self._file is not None:
+            self._file.close()
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def source(self):
+        """Für Worker-Prozesse: die Bytes (kleine Dateien) oder der Pfad"""
+        return self.path if self.path is not None else self._buf.getvalue()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+        self._buf = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def check(doc, accepted=PDF_TYPES | IMAGE_TYPES, max_bytes=MAX_BYTES):
+    """Prüft Typ und Größe vor dem Download und liefert "pdf", "image" oder
+    None (beliebiger Typ bei accepted=None); wirft Rejected"""
+    if doc.file_size and doc.file_size > max_bytes:
+        raise too_large(max_bytes)
+    # PhotoSize hat keinen mime_type, Telegram speichert Fotos als JPEG
+    mime_type = getattr(doc, "mime_type", "image/jpeg")
+    if accepted is not None and mime_type not in accepted:
+        raise Rejected("Datei nicht erkannt. Bitte senden Sie ein Foto oder PDF.")
+    if mime_type in PDF_TYPES:
+        return "pdf"
+    if mime_type in IMAGE_TYPES:
+        return "image"
+    return None
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=httpx.Timeout(
+            float(os.getenv("DOWNLOAD_TIMEOUT", "60")), connect=10))
+    return _client
+
+
+def _get_semaphore():
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(
+            int(os.getenv("DOWNLOAD_CONCURRENCY", "4")))
+    return _semaphore
+
+
+async def fetch(bot, file_id, max_bytes=MAX_BYTES, max_memory=SPOOL_BYTES,
+                suffix=""):
+    """Lädt die Datei blockweise in einen Spool; wirft Rejected, sobald sie
+    größer als max_bytes ist"""
+    async with _get_semaphore():
+        spool = Spool(max_memory, suffix)
+        try:
+            async with metrics.timed("telegram", "download"):
+                file = await bot.get_file(file_id)
+                if file.file_size and file.file_size > max_bytes:
+                    raise too_large(max_bytes)
+                async with _get_client().stream("GET",
+                                                file.file_path) as res:
+                    res.raise_for_status()
+                    async for chunk in res.aiter_bytes(CHUNK_SIZE):
+                        if spool.size + len(chunk) > max_bytes:
+                            raise too_large(max_bytes)
+                        spool.write(chunk)
+            spool.finish()
+        except BaseException:
+            spool.close()
+            raise
+    return spool
+
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,225 @@
+import os
+import csv
+import time
+import asyncio
+import logging
+import zipfile
+from decimal import Decimal
+
+import db
+import totals
+import workers
+from invoice_pdf import render_batch
+
+# Jahresexport: alle Rechnungen eines Jahres als PDFs in einer ZIP-Datei
+# plus Buchungsliste (CSV, DATEV-ähnlich). Die Zeilen kommen seitenweise
+# per Keyset-Pagination aus Supabase, die PDFs werden blockweise im
+# Prozess-Pool gerendert und sofort in die ZIP-Datei auf der Platte
+# geschrieben. Im Speicher liegt so höchstens eine Seite samt PDFs.
+# Überschreitet die ZIP-Datei das Upload-Limit, beginnt ein neuer Teil.
+# Gerendert wird aus dem Snapshot der Rechnung (invoice_data und
+# profile_snapshot, sql/005), also mit allen Positionen und dem Profil vom
+# Tag der Rechnung. Zeilen ohne Snapshot kommen nur in die Buchungsliste.
+# Rechnungen mit mehreren Steuersätzen ergeben dort eine Buchungszeile je
+# Steuersatz, damit jeder Anteil auf sein Erlöskonto geht.
+
+logger = logging.getLogger(__name__)
+
+# Erlöskonten (SKR03) je Steuersatz für die Buchungsliste
+REVENUE_ACCOUNTS = {19: "8400", 7: "8300", 0: "8100"}
+LEDGER_HEADER = [
+    "Umsatz", "Soll/Haben-Kennzeichen", "Konto", "Gegenkonto", "Belegdatum",
+    "Belegfeld 1", "Buchungstext", "Netto", "USt-Satz", "USt", "Status"
+]
+
+_active = set()
+
+
+class ExportBusy(Exception):
+    """Für diesen Nutzer läuft bereits ein Export"""
+
+
+def _de(value):
+    return f"{Decimal(str(value or 0)):.2f}".replace(".", ",")
+
+
+def _by_rate(row):
+    """(steuersatz, netto, brutto) je Steuersatz der Rechnung; aus dem
+    Snapshot nachgerechnet, sonst aus amount/vat_rate/total der Zeile"""
+    if row.get("invoice_data"):
+        try:
+            result = totals.compute_invoice(row["invoice_data"])
+            return [(rate, totals.to_euro(net), totals.to_euro(net + vat))
+                    for rate, net, vat in result.by_rate]
+        except ValueError as e:
+            logger.warning(f"Snapshot von Rechnung {row.get('id')} nicht "
+                           f"nachrechenbar: {e}")
+    return [(int(row.get("vat_rate") or 0),
+             Decimal(str(row.get("amount") or 0)),
+             Decimal(str(row.get("total") or 0)))]
+
+
+def ledger_rows(row, debitor_account):
+    """Buchungszeilen der Rechnung, eine je Steuersatz (Erlöskonto)"""
+    date = row.get("invoice_date") or ""
+    return [[
+        _de(total), "S", debitor_account,
+        REVENUE_ACCOUNTS.get(rate, ""),
+        f"{date[8:10]}{date[5:7]}" if len(date) >= 10 else "",
+        row.get("invoice_number") or str(row.get("id")),
+        (row.get("client_name") or "")[:60],
+        _de(amount), str(rate),
+        _de(total - amount),
+        row.get("status") or ""
+    ] for rate, amount, total in _by_rate(row)]
+
+
+def pdf_name(row):
+    number = row.get("invoice_number") or f"{row.get('id')}"
+    client = " ".join("".join(ch for ch in (row.get("client_name") or "")
+                              if ch.isalnum() or ch in " -_").split())[:40]
+    return f"{row.get('invoice_date')}_{number}_{client or 'Rechnung'}.pdf"
+
+
+def has_snapshot(row):
+    return bool(row.get("invoice_data") and row.get("profile_snapshot"))
+
+
+def as_invoice(row):
+    """Gespeicherte Formulardaten der Rechnung, wie render_invoice sie aus
+    der WebApp kennt; Nummer und Datum aus der Zeile"""
+    return {
+        **row["invoice_data"], "invoice_number": row.get("invoice_number"),
+        "date": row.get("invoice_date")
+    }
+
+
+class ZipParts:
+    """Schreibt PDFs in nummerierte ZIP-Dateien mit Größenlimit"""
+
+    def __init__(self, directory, basename, max_bytes):
+        self.directory = directory
+        self.basename = basename
+        self.max_bytes = max_bytes
+        self.paths = []
+        self._zip = None
+        self._directory_bytes = 0
+
+    def _open(self):
+        path = os.path.join(self.directory,
+                            f"{self.basename}_{len(self.paths) + 1}.zip")
+        self.paths.append(path)
+        # PDFs sind bereits komprimiert
+        self._zip = zipfile.ZipFile(path, "w", zipfile.ZIP_STORED)
+        self._directory_bytes = 22
+
+    def write(self, name, data):
+        # Lokaler Header + Eintrag im zentralen Verzeichnis am Dateiende
+        overhead = 2 * len(name.encode()) + 76
+        if self._zip is None:
+            self._open()
+        elif (self._zip.fp.tell() + self._directory_bytes + overhead +
+              len(data) > self.max_bytes):
+            self._zip.close()
+            self._open()
+        self._zip.writestr(name, data)
+        self._directory_bytes += len(name.encode()) + 46
+
+    def write_file(self, path, name):
+        if self._zip is None:
+            self._open()
+        self._zip.write(path, name, compress_type=zipfile.ZIP_DEFLATED)
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+
+
+async def _render_page(rows, batch_size):
+    """Rendert eine Seite in Blöcken parallel im Prozess-Pool; liefert je
+    Zeile ein PDF oder None (kein Snapshot)"""
+    jobs = [(r["profile_snapshot"], as_invoice(r)) for r in rows
+            if has_snapshot(r)]
+    batches = [
+        jobs[i:i + batch_size] for i in range(0, len(jobs), batch_size)
+    ]
+    results = await asyncio.gather(*(workers.run_in_process(
+        render_batch, batch) for batch in batches))
+    pdfs = iter([pdf for batch in results for pdf in batch])
+    return [next(pdfs) if has_snapshot(r) else None for r in rows]
+
+
+async def export_year(user_id, year, directory, on_progress=None):
+    """Exportiert alle Rechnungen des Jahres nach `directory`.
+
+    Liefert (liste der ZIP-Pfade, anzahl rechnungen, davon ohne PDF); bei
+    0 Rechnungen wird nichts geschrieben."""
+    if user_id in _active:
+        raise ExportBusy()
+    _active.add(user_id)
+    try:
+        page_size = int(os.getenv("EXPORT_PAGE_SIZE", "200"))
+        interval = float(os.getenv("EXPORT_PROGRESS_INTERVAL", "2"))
+        debitor = os.getenv("EXPORT_DEBITOR_ACCOUNT", "10000")
+        # Mindestens ein Block pro Worker-Prozess und Seite
+        batch_size = max(1, page_size // workers.pool_size())
+        parts = ZipParts(directory, f"Rechnungen_{year}",
+                         int(os.getenv("EXPORT_PART_BYTES",
+                                       str(45 * 1024 * 1024))))
+        ledger_path = os.path.join(directory, f"Buchungsliste_{year}.csv")
+        try:
+            count, without_pdf = await _write_all(user_id, year, parts,
+                                                  ledger_path, page_size,
+                                                  batch_size, debitor,
+                                                  interval, on_progress)
+            if count:
+                await asyncio.to_thread(parts.write_file, ledger_path,
+                                        os.path.basename(ledger_path))
+        finally:
+            await asyncio.to_thread(parts.close)
+        return parts.paths, count, without_pdf
+    finally:
+        _active.discard(user_id)
+
+
+async def _write_all(user_id, year, parts, ledger_path, page_size,
+                     batch_size, debitor, interval, on_progress):
+    count = without_pdf = 0
+    last_report = time.monotonic()
+    with open(ledger_path, "w", newline="", encoding="utf-8-sig") as f:
+        ledger = csv.writer(f, delimiter=";")
+        ledger.writerow(LEDGER_HEADER)
+        rows = await db.scan_invoices(user_id, f"{year}-01-01",
+                                      f"{year + 1}-01-01", page_size)
+        while rows:
+            last = rows[-1]
+            after = (last["invoice_date"], last["id"])
+            # Nächste Seite laden, während diese gerendert wird
+            upcoming = None
+            if len(rows) == page_size:
+                upcoming = asyncio.create_task(
+                    db.scan_invoices(user_id, f"{year}-01-01",
+                                     f"{year + 1}-01-01", page_size,
+                                     after))
+            try:
+                pdfs = await _render_page(rows, batch_size)
+            except BaseException:
+                if upcoming is not None:
+                    upcoming.cancel()
+                raise
+
+            def write_page(rows=rows, pdfs=pdfs):
+                for row, pdf in zip(rows, pdfs):
+                    if pdf is not None:
+                        parts.write(pdf_name(row), pdf)
+                    ledger.writerows(ledger_rows(row, debitor))
+
+            await asyncio.to_thread(write_page)
+            count += len(rows)
+            without_pdf += pdfs.count(None)
+            rows = await upcoming if upcoming is not None else []
+            if on_progress and time.monotonic() - last_report >= interval:
+                last_report = time.monotonic()
+                await on_progress(count)
+    return count, without_pdf
@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import logging
+import threading
+
+# Persistenter Cache für Extraktionsergebnisse (SQLite unter DATA_DIR).
+# Schlüssel ist der SHA-256 der Datei, zusätzlich die file_unique_id von
+# Telegram, mit der sich sogar der Download sparen lässt. Beide Schlüssel
+# sind mit der Prompt-Version versehen: Ändert sich der Prompt (oder das
+# Modell), sind alte Einträge automatisch ungültig und werden entfernt.
+
+logger = logging.getLogger(__name__)
+
+
+def prompt_version(*parts):
+    return hashlib.sha256("\x00".join(parts).encode()).hexdigest()[:12]
+
+
+class ExtractionCache:
+    """Größenbegrenzter Cache (LRU nach letztem Zugriff) mit Trefferstatistik"""
+
+    def __init__(self, path, version, max_entries=5000):
+        self.version = version
+        self.max_entries = max_entries
+        self.hits_file_id = 0
+        self.hits_hash = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS extractions (
+                    key TEXT PRIMARY KEY, version TEXT NOT NULL,
+                    result TEXT NOT NULL, accessed REAL NOT NULL)""")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS file_ids (
+                    file_unique_id TEXT NOT NULL, version TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    PRIMARY KEY (file_unique_id, version))""")
+        self.purge_stale()
+
+    def _key(self, sha256):
+        return f"{self.version}:{sha256}"
+
+    def purge_stale(self):
+        """Entfernt Einträge älterer Prompt-Versionen"""
+        with self._lock, self._db:
+            n = self._db.execute("DELETE FROM extractions WHERE version != ?",
+                                 (self.version, )).rowcount
+            self._db.execute("DELETE FROM file_ids WHERE version != ?",
+                             (self.version, ))
+        if n:
+            logger.info(f"Extraktions-Cache: {n} veraltete Einträge entfernt")
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM extractions")
+            self._db.execute("DELETE FROM file_ids")
+
+    def _lookup(self, key):
+        row = self._db.execute("SELECT result FROM extractions WHERE key = ?",
+                               (key, )).fetchone()
+        if row:
+            self._db.execute(
+                "UPDATE extractions SET accessed = ? WHERE key = ?",
+                (time.time(), key))
+            return json.loads(row[0])
+        return None
+
+    def get_by_file_id_sync(self, file_unique_id):
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT key FROM file_ids WHERE file_unique_id = ? AND version = ?",
+                (file_unique_id, self.version)).fetchone()
+            result = self._lookup(row[0]) if row else None
+        if result is not None:
+            self.hits_file_id += 1
+        return result
+
+    def get_sync(self, sha256):
+        with self._lock, self._db:
+            result = self._lookup(self._key(sha256))
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits_hash += 1
+        return result
+
+    def put_sync(self, sha256, result, file_unique_id=None):
+        key = self._key(sha256)
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO extractions VALUES (?, ?, ?, ?)",
+                (key, self.version, json.dumps(result), time.time()))
+            if file_unique_id:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO file_ids VALUES (?, ?, ?)",
+                    (file_unique_id, self.version, key))
+            count = self._db.execute(
+                "SELECT COUNT(*) FROM extractions").fetchone()[0]
+            if count > self.max_entries:
+                # In Blöcken räumen, damit nicht jeder Insert verdrängt
+                evict = count - self.max_entries + self.max_entries // 10
+                self._db.execute(
+                    """DELETE FROM extractions WHERE key IN (
+                        SELECT key FROM extractions ORDER BY accessed LIMIT ?)""",
+                    (evict, ))
+                self._db.execute(
+                    "DELETE FROM file_ids WHERE key NOT IN (SELECT key FROM extractions)"
+                )
+
+    async def get_by_file_id(self, file_unique_id):
+        return await asyncio.to_thread(self.get_by_file_id_sync,
+                                       file_unique_id)
+
+    async def get(self, sha256):
+        return await asyncio.to_thread(self.get_sync, sha256)
+
+    async def put(self, sha256, result, file_unique_id=None):
+        await asyncio.to_thread(self.put_sync, sha256, result, file_unique_id)
+
+    def stats(self):
+        hits = self.hits_file_id + self.hits_hash
+        total = hits + self.misses
+        return {
+            "hits_file_id": self.hits_file_id,
+            "hits_hash": self.hits_hash,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
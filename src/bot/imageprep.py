@@ -0,0 +1,88 @@
+import io
+import os
+
+# Vorverarbeitung von Dokumentfotos vor dem Claude-Aufruf: auf das
+# Papier zuschneiden, Graustufen, Absenderbereiche (Briefkopf oben,
+# Fußzeile mit Bank-/Steuerdaten unten) zusammensetzen, auf die vom Modell
+# genutzte Auflösung verkleinern und kompakt als JPEG kodieren.
+# Läuft in den Worker-Prozessen (workers.py); PIL wird erst dort geladen.
+
+# Größere Bilder skaliert die API ohnehin auf diese Kantenlänge herunter
+MAX_EDGE = int(os.getenv("OCR_MAX_EDGE", "1568"))
+JPEG_QUALITY = int(os.getenv("OCR_JPEG_QUALITY", "70"))
+SENDER_REGIONS = os.getenv("OCR_SENDER_REGIONS", "1") == "1"
+
+# Anteile der Seite (DIN 5008): Briefkopf/Absender oben, Fußzeile unten
+HEADER_SHARE = 0.42
+FOOTER_SHARE = 0.16
+
+
+def _paper_box(gray):
+    """Begrenzungsrahmen des hellen Papiers vor dunklerem Hintergrund"""
+    small = gray.copy()
+    small.thumbnail((256, 256))
+    lo, hi = small.getextrema()
+    threshold = lo + (hi - lo) * 0.6
+    box = small.point(lambda p: 255 if p > threshold else 0).getbbox()
+    if not box:
+        return None
+    sx, sy = gray.width / small.width, gray.height / small.height
+    box = (int(box[0] * sx), int(box[1] * sy), int(box[2] * sx),
+           int(box[3] * sy))
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    # Nur zuschneiden, wenn der Rahmen plausibel ein Blatt ist
+    if area < 0.3 * gray.width * gray.height:
+        return None
+    return box
+
+
+def _ink_box(gray, margin=12):
+    """Bereich mit Text/Grafik innerhalb des Papiers (weiße Ränder entfernen)"""
+    from PIL import ImageOps
+    box = ImageOps.invert(gray).point(lambda p: 255 if p > 60 else 0).getbbox()
+    if not box:
+        return None
+    return (max(box[0] - margin, 0), max(box[1] - margin, 0),
+            min(box[2] + margin, gray.width), min(box[3] + margin, gray.height))
+
+
+def _sender_regions(gray):
+    """Setzt Briefkopf und Fußzeile einer ganzen Seite übereinander"""
+    from PIL import Image
+    w, h = gray.size
+    if h < 1.2 * w:
+        return gray
+    top = gray.crop((0, 0, w, int(h * HEADER_SHARE)))
+    bottom = gray.crop((0, int(h * (1 - FOOTER_SHARE)), w, h))
+    out = Image.new("L", (w, top.height + bottom.height + 8), 255)
+    out.paste(top, (0, 0))
+    out.paste(bottom, (0, top.height + 8))
+    return out
+
+
+def preprocess(data):
+    """Bildbytes oder Pfad (downloads.Spool) -> (JPEG-Bytes, Media-Type) für
+    den Claude-Aufruf"""
+    from PIL import Image, ImageOps
+    img = Image.open(data if isinstance(data, str) else io.BytesIO(data))
+    if img.format == "JPEG":
+        # Dekodiert große JPEGs direkt in reduzierter Auflösung
+        img.draft("L", (MAX_EDGE * 2, MAX_EDGE * 2))
+    img = ImageOps.exif_transpose(img)
+    gray = img.convert("L")
+
+    box = _paper_box(gray)
+    if box:
+        gray = gray.crop(box)
+    box = _ink_box(gray)
+    if box:
+        gray = gray.crop(box)
+    if SENDER_REGIONS:
+        gray = _sender_regions(gray)
+
+    gray.thumbnail((MAX_EDGE, MAX_EDGE), Image.LANCZOS)
+    gray = ImageOps.autocontrast(gray, cutoff=1)
+
+    out = io.BytesIO()
+    gray.save(out, "JPEG", quality=JPEG_QUALITY, optimize=True)
+    return out.getvalue(), "image/jpeg"
@@ -0,0 +1,254 @@
+import io
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+
+import totals
+
+# PDF-Rechnungen mit reportlab. Der statische Teil jeder Seite (Briefkopf,
+# Absender, Fußzeile mit Bankverbindung) wird pro Profil einmal vorbereitet
+# und pro Dokument nur einmal als Form-XObject gezeichnet; jede Seite
+# referenziert ihn nur noch. Läuft in den Worker-Prozessen (workers.py).
+# Beträge und Summen kommen aus totals.py, wie bei der Prüfung der Eingaben.
+# Canvas, Schriftmetriken und Textumbruch werden erst beim Rendern geladen:
+# der Bot-Prozess braucht von hier nur fmt_eur und die Funktionsnamen.
+
+PAGE_W, PAGE_H = A4
+MARGIN_L = 25 * mm
+MARGIN_R = 20 * mm
+BODY_TOP = PAGE_H - 105 * mm
+BODY_TOP_FOLLOW = PAGE_H - 45 * mm
+BODY_BOTTOM = 35 * mm
+
+FONT = "Helvetica"
+FONT_BOLD = "Helvetica-Bold"
+
+CENT = Decimal("0.01")
+
+# Tabellenspalten: (Titel, rechte bzw. linke Kante, Ausrichtung)
+COLUMNS = [("Pos.", MARGIN_L, "l"), ("Beschreibung", MARGIN_L + 12 * mm, "l"),
+           ("Menge", MARGIN_L + 112 * mm, "r"),
+           ("Einzelpreis", MARGIN_L + 135 * mm, "r"),
+           ("Betrag", PAGE_W - MARGIN_R, "r")]
+DESC_WIDTH = 85 * mm
+
+
+def fmt_eur(value):
+    """1234.5 -> '1.234,50 €'"""
+    s = f"{Decimal(value).quantize(CENT, ROUND_HALF_UP):,.2f}"
+    return s.replace(",", "X").replace(".", ",").replace("X", ".") + " €"
+
+
+def fmt_num(value):
+    d = Decimal(value).normalize()
+    s = f"{d:f}" if d == d.to_integral() else f"{d:,}"
+    return s.replace(",", "X").replace(".", ",").replace("X", ".")
+
+
+def _profile_key(p):
+    return tuple(
+        str(p.get(k) or "") for k in ("company_name", "street", "zip", "city",
+                                      "email", "phone", "tax_id", "iban"))
+
+
+class _StaticLayer:
+    """Vorberechnete Texte und Positionen des Briefkopfs eines Profils"""
+
+    def __init__(self, key):
+        from reportlab.pdfbase.pdfmetrics import stringWidth
+        company, street, zip_code, city, email, phone, tax_id, iban = key
+        self.company = company
+        self.header_lines = [
+            l for l in (street, f"{zip_code} {city}".strip(), email, phone)
+            if l
+        ]
+        self.return_line = " · ".join(
+            l for l in (company, street, f"{zip_code} {city}".strip()) if l)
+        self.footer = [
+            [company, street, f"{zip_code} {city}".strip()],
+            [
+                f"E-Mail: {email}" if email else "",
+                f"Tel.: {phone}" if phone else ""
+            ],
+            [
+                f"IBAN: {iban}" if iban else "",
+                f"Steuer-Nr./USt-IdNr.: {tax_id}" if tax_id else ""
+            ],
+        ]
+        # Breiten einmal messen statt bei jeder Seite
+        self.header_x = [
+            PAGE_W - MARGIN_R - stringWidth(l, FONT, 9)
+            for l in self.header_lines
+        ]
+        self.company_x = PAGE_W - MARGIN_R - stringWidth(
+            company, FONT_BOLD, 14)
+
+    def draw(self, c):
+        c.setFont(FONT_BOLD, 14)
+        c.drawString(self.company_x, PAGE_H - 20 * mm, self.company)
+        c.setFont(FONT, 9)
+        y = PAGE_H - 26 * mm
+        for x, line in zip(self.header_x, self.header_lines):
+            c.drawString(x, y, line)
+            y -= 4.2 * mm
+        c.setLineWidth(0.5)
+        c.line(MARGIN_L, BODY_BOTTOM - 5 * mm, PAGE_W - MARGIN_R,
+               BODY_BOTTOM - 5 * mm)
+        col_w = (PAGE_W - MARGIN_L - MARGIN_R) / len(self.footer)
+        c.setFont(FONT, 7.5)
+        for i, col in enumerate(self.footer):
+            y = BODY_BOTTOM - 10 * mm
+            for line in col:
+                if line:
+                    c.drawString(MARGIN_L + i * col_w, y, line)
+                    y -= 3.5 * mm
+
+
+@lru_cache(maxsize=256)
+def _static_layer(key):
+    return _StaticLayer(key)
+
+
+def invoice_items(inv):
+    """Positionen der Rechnung als (beschreibung, menge, preis, satz)"""
+    return [(desc, Decimal(qty), Decimal(price), Decimal(rate))
+            for desc, qty, price, rate in totals.line_items(inv)]
+
+
+class _Writer:
+
+    def __init__(self, c, layer):
+        self.c = c
+        self.layer = layer
+        self.page = 1
+        c.beginForm("static")
+        layer.draw(c)
+        c.endForm()
+        c.doForm("static")
+
+    def new_page(self):
+        c = self.c
+        c.setFont(FONT, 8)
+        c.drawRightString(PAGE_W - MARGIN_R, BODY_BOTTOM,
+                          f"Seite {self.page} – Fortsetzung folgt")
+        c.showPage()
+        self.page += 1
+        c.doForm("static")
+        self.table_header(BODY_TOP_FOLLOW)
+        return BODY_TOP_FOLLOW - 8 * mm
+
+    def table_header(self, y):
+        c = self.c
+        c.setFont(FONT_BOLD, 9)
+        for title, x, align in COLUMNS:
+            if align == "r":
+                c.drawRightString(x, y, title)
+            else:
+                c.drawString(x, y, title)
+        c.line(MARGIN_L, y - 2 * mm, PAGE_W - MARGIN_R, y - 2 * mm)
+
+
+def render_invoice(profile, inv):
+    """Erzeugt die Rechnung als PDF und gibt die Bytes zurück"""
+    from reportlab.lib.utils import simpleSplit
+    from reportlab.pdfgen import canvas
+    layer = _static_layer(_profile_key(profile or {}))
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=A4, pageCompression=1)
+    c.setTitle(f"Rechnung {inv.get('invoice_number') or ''}".strip())
+    c.setAuthor(layer.company)
+    w = _Writer(c, layer)
+
+    # Empfänger
+    c.setFont(FONT, 7)
+    c.drawString(MARGIN_L, PAGE_H - 50 * mm, layer.return_line)
+    c.setFont(FONT, 10)
+    y = PAGE_H - 56 * mm
+    for line in [inv.get("client_name") or ""] + (inv.get("client_address")
+                                                   or "").splitlines():
+        c.drawString(MARGIN_L, y, line.strip())
+        y -= 4.6 * mm
+
+    # Rechnungsangaben
+    info = [("Rechnungsdatum", inv.get("date") or "")]
+    if inv.get("invoice_number"):
+        info.insert(0, ("Rechnungsnummer", inv["invoice_number"]))
+    y = PAGE_H - 56 * mm
+    for label, value in info:
+        c.setFont(FONT, 9)
+        c.drawString(PAGE_W - MARGIN_R - 70 * mm, y, f"{label}:")
+        c.drawRightString(PAGE_W - MARGIN_R, y, str(value))
+        y -= 4.6 * mm
+
+    c.setFont(FONT_BOLD, 16)
+    c.drawString(MARGIN_L, BODY_TOP + 10 * mm, "Rechnung")
+
+    # Positionen
+    w.table_header(BODY_TOP)
+    y = BODY_TOP - 8 * mm
+    result = totals.compute_invoice(inv)
+    for pos, ((desc, qty, price, rate),
+              net) in enumerate(zip(invoice_items(inv), result.line_nets), 1):
+        net = totals.to_euro(net)
+        lines = simpleSplit(desc, FONT, 9, DESC_WIDTH) or [""]
+        if y - 4.2 * mm * len(lines) < BODY_BOTTOM + 10 * mm:
+            y = w.new_page()
+        c.setFont(FONT, 9)
+        c.drawString(COLUMNS[0][1], y, str(pos))
+        c.drawRightString(COLUMNS[2][1], y, fmt_num(qty))
+        c.drawRightString(COLUMNS[3][1], y, fmt_eur(price))
+        c.drawRightString(COLUMNS[4][1], y, fmt_eur(net))
+        for line in lines:
+            c.drawString(COLUMNS[1][1], y, line)
+            y -= 4.2 * mm
+        y -= 1.5 * mm
+
+    # Summen
+    sums = [("Nettobetrag", totals.to_euro(result.net))]
+    for rate, _, vat in result.by_rate:
+        sums.append((f"USt. {rate} %", totals.to_euro(vat)))
+    sums.append(("Gesamtbetrag", totals.to_euro(result.gross)))
+    if y - 6 * mm * (len(sums) + 4) < BODY_BOTTOM:
+        y = w.new_page()
+    c.line(PAGE_W - MARGIN_R - 70 * mm, y, PAGE_W - MARGIN_R, y)
+    y -= 5 * mm
+    for i, (label, value) in enumerate(sums):
+        c.setFont(FONT_BOLD if i == len(sums) - 1 else FONT, 10)
+        c.drawString(PAGE_W - MARGIN_R - 70 * mm, y, label)
+        c.drawRightString(PAGE_W - MARGIN_R, y, fmt_eur(value))
+        y -= 5.5 * mm
+
+    # Zahlungshinweis
+    y -= 6 * mm
+    c.setFont(FONT, 9)
+    notes = []
+    if inv.get("payment_terms"):
+        notes.append(f"Zahlbar innerhalb von {inv['payment_terms']} Tagen "
+                     "ohne Abzug.")
+    if inv.get("notes"):
+        notes.append(inv["notes"])
+    for note in notes:
+        for line in simpleSplit(note, FONT, 9,
+                                PAGE_W - MARGIN_L - MARGIN_R):
+            if y < BODY_BOTTOM + 5 * mm:
+                y = w.new_page()
+                c.setFont(FONT, 9)
+            c.drawString(MARGIN_L, y, line)
+            y -= 4.2 * mm
+
+    c.showPage()
+    c.save()
+    return buf.getvalue()
+
+
+def render_many(profile, invs):
+    """Mehrere Rechnungen in einem Aufruf (spart IPC im Prozess-Pool)"""
+    return [render_invoice(profile, inv) for inv in invs]
+
+
+def render_batch(jobs):
+    """Wie render_many, aber mit eigenem Profil je Rechnung:
+    jobs = [(profile, inv), ...] (wiederkehrende Rechnungen vieler Nutzer)"""
+    return [render_invoice(profile, inv) for profile, inv in jobs]
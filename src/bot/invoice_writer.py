@@ -0,0 +1,292 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+
+import db
+import totals
+import numbering
+import resilience
+
+# Write-Behind für Rechnungen: Der Handler legt die Zeile nur in eine
+# Queue und antwortet sofort. Ein Hintergrund-Task sammelt Zeilen für
+# einige Millisekunden und schreibt sie als ein Bulk-Upsert. Jede Zeile
+# trägt einen Idempotenz-Schlüssel (Nutzer + Formular-Nonce + WebApp-Daten),
+# daher sind Wiederholungen ungefährlich. Ist Supabase nicht erreichbar
+# (5xx, Frist, Circuit offen), landen die Zeilen in einer lokalen
+# Spool-Datei und werden später nachgereicht. Lehnt die Datenbank einen
+# Block ab (4xx), wird jede Zeile einzeln versucht; was auch einzeln
+# abgelehnt wird, kommt in die Dead-Letter-Datei statt in den Spool.
+# Zeilen ohne Rechnungsnummer (Supabase war schon beim Erstellen nicht
+# erreichbar) bekommen ihre Nummer hier vor dem Schreiben, notfalls erst
+# beim Nachreichen aus dem Spool.
+
+logger = logging.getLogger(__name__)
+
+
+def idempotency_key(user_id, payload, nonce=None):
+    """Stabiler Schlüssel aus Nutzer-ID und WebApp-Daten der Rechnung.
+
+    `nonce` kommt vom Formular, einmal je geöffnetem Formular: Ein doppelt
+    gesendetes Formular ergibt denselben Schlüssel, zwei getrennt erstellte
+    Rechnungen mit gleichem Inhalt aber verschiedene."""
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"),
+                           default=str)
+    if nonce:
+        canonical = f"{nonce}:{canonical}"
+    return hashlib.sha256(f"{user_id}:{canonical}".encode()).hexdigest()
+
+
+def invoice_row(user_id, inv, result, key, profile=None):
+    """Zeile für die Tabelle invoices; `result` sind die nachgerechneten
+    Summen (totals.Totals). Formulardaten und Profil werden als Snapshot
+    mitgespeichert (sql/005), damit ein späterer Export dieselbe Rechnung
+    erzeugt wie die verschickte."""
+    return {
+        "user_id": user_id,
+        "invoice_number": inv.get("invoice_number"),
+        "client_name": inv.get("client_name"),
+        "client_address": inv.get("client_address"),
+        "client_email": inv.get("client_email"),
+        "description": inv.get("description"),
+        "amount": float(totals.to_euro(result.net)),
+        "vat_rate": inv.get("vat_rate"),
+        "total": float(totals.to_euro(result.gross)),
+        "invoice_date": inv.get("date"),
+        "status": "created",
+        "idempotency_key": key,
+        "invoice_data": inv,
+        "profile_snapshot": profile
+    }
+
+
+async def upsert_rows(rows):
+    """Upsert von Rechnungszeilen; liefert (vorübergehend nicht schreibbar,
+    abgelehnt). Lehnt die Datenbank den Block ab, wird jede Zeile einzeln
+    versucht, damit eine fehlerhafte nicht die anderen mitreißt."""
+    try:
+        await db.upsert_invoices(rows)
+        return [], []
+    except resilience.Unavailable as e:
+        logger.warning(f"{len(rows)} Rechnung(en) nicht gespeichert: {e}")
+        return rows, []
+    except Exception as e:
+        if len(rows) == 1:
+            logger.error(f"Rechnung {rows[0]['idempotency_key']} "
+                         f"abgelehnt: {e}")
+            return [], rows
+        logger.warning(f"Block mit {len(rows)} Rechnungen abgelehnt, "
+                       f"schreibe einzeln: {e}")
+    transient, rejected = [], []
+    for row in rows:
+        try:
+            await db.upsert_invoices([row])
+        except resilience.Unavailable:
+            transient.append(row)
+        except Exception as e:
+            logger.error(f"Rechnung {row['idempotency_key']} "
+                         f"abgelehnt: {e}")
+            rejected.append(row)
+    return transient, rejected
+
+
+class InvoiceWriter:
+
+    def __init__(self, spool_path, flush_ms=20, max_batch=200,
+                 retry_interval=30, dead_letter_path=None):
+        self.spool_path = spool_path
+        self.dead_letter_path = dead_letter_path or (
+            f"{os.path.splitext(spool_path)[0]}_dead.jsonl")
+        self.flush_delay = flush_ms / 1000
+        self.max_batch = max_batch
+        self.retry_interval = retry_interval
+        self._queue = asyncio.Queue()
+        self._spool_lock = asyncio.Lock()
+        self._tasks = []
+
+    def submit(self, row):
+        """Reiht die Zeile ein; das Future wird True (gespeichert) oder
+        False (in der Spool-Datei, wird nachgereicht, oder von der
+        Datenbank abgelehnt und in der Dead-Letter-Datei)"""
+        fut = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((row, fut))
+        return fut
+
+    async def start(self):
+        self._tasks = [
+            asyncio.create_task(self._run()),
+            asyncio.create_task(self._retry_spool())
+        ]
+
+    async def stop(self):
+        """Schreibt alles Eingereihte noch weg und beendet die Tasks"""
+        if not self._tasks:
+            return
+        run, retry = self._tasks
+        self._tasks = []
+        retry.cancel()
+        self._queue.put_nowait(None)
+        await asyncio.gather(run, retry, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    await self._flush(batch)
+                    return
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _assign_numbers(self, rows):
+        """Vergibt fehlende Rechnungsnummern (numbering.py, gleicher
+        Schlüssel = gleiche Nummer); liefert (bereit, noch ohne Nummer)"""
+        missing = [row for row in rows if not row.get("invoice_number")]
+        if not missing:
+            return rows, []
+        allocator = numbering.get_allocator()
+        numbers = await asyncio.gather(
+            *(allocator.number_for(
+                row["user_id"],
+                row.get("invoice_data") or {"date": row.get("invoice_date")},
+                row["idempotency_key"]) for row in missing),
+            return_exceptions=True)
+        pending = []
+        for row, number in zip(missing, numbers):
+            if isinstance(number, Exception):
+                logger.warning(f"Keine Rechnungsnummer für "
+                               f"{row['idempotency_key']}: {number}")
+                pending.append(row)
+                continue
+            row["invoice_number"] = number
+            if row.get("invoice_data") is not None:
+                row["invoice_data"] = {**row["invoice_data"],
+                                       "invoice_number": number}
+        ready = [row for row in rows if row.get("invoice_number")]
+        return ready, pending
+
+    async def _write(self, rows):
+        """Nummern vergeben und schreiben; liefert (vorübergehend nicht
+        schreibbar, abgelehnt) wie upsert_rows"""
+        rows, pending = await self._assign_numbers(rows)
+        transient, rejected = await upsert_rows(rows) if rows else ([], [])
+        return pending + transient, rejected
+
+    async def _flush(self, batch):
+        rows = list({row["idempotency_key"]: row
+                     for row, _ in batch}.values())
+        transient, rejected = await self._write(rows)
+        if transient:
+            logger.warning(f"{len(transient)} Rechnung(en) in den Spool")
+            await self._spool(transient)
+        if rejected:
+            await self._dead_letter(rejected)
+        failed = {row["idempotency_key"] for row in transient + rejected}
+        for row, fut in batch:
+            if not fut.done():
+                fut.set_result(row["idempotency_key"] not in failed)
+
+    # --- SPOOL ---
+
+    def _append(self, path, rows):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _read(self):
+        try:
+            with open(self.spool_path, encoding="utf-8") as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def _rewrite(self, rows):
+        """Ersetzt die Spool-Datei atomar durch rows (leer = löschen)"""
+        if not rows:
+            try:
+                os.remove(self.spool_path)
+            except FileNotFoundError:
+                pass
+            return
+        tmp = f"{self.spool_path}.tmp"
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        self._append(tmp, rows)
+        os.replace(tmp, self.spool_path)
+
+    async def _spool(self, rows):
+        async with self._spool_lock:
+            await asyncio.to_thread(self._append, self.spool_path, rows)
+
+    async def _dead_letter(self, rows):
+        logger.error(f"{len(rows)} Rechnung(en) in "
+                     f"{self.dead_letter_path} (von der Datenbank abgelehnt)")
+        await asyncio.to_thread(self._append, self.dead_letter_path, rows)
+
+    async def replay_spool(self):
+        """Schreibt gespoolte Zeilen blockweise nach. Geschriebene Blöcke
+        verlassen die Datei sofort, abgelehnte Zeilen gehen in die
+        Dead-Letter-Datei; ist Supabase wieder weg, bleibt der Rest liegen
+        (resilience.Unavailable)."""
+        async with self._spool_lock:
+            rows = await asyncio.to_thread(self._read)
+            if not rows:
+                return 0
+            done = 0
+            while rows:
+                chunk, rest = rows[:self.max_batch], rows[self.max_batch:]
+                transient, rejected = await self._write(chunk)
+                if rejected:
+                    await self._dead_letter(rejected)
+                rows = transient + rest
+                await asyncio.to_thread(self._rewrite, rows)
+                done += len(chunk) - len(transient) - len(rejected)
+                if transient:
+                    raise resilience.Unavailable(
+                        f"{done} gespoolte Rechnung(en) nachgereicht, "
+                        f"{len(rows)} noch im Spool")
+        logger.info(f"{done} gespoolte Rechnung(en) nachgereicht")
+        return done
+
+    async def _retry_spool(self):
+        while True:
+            try:
+                await self.replay_spool()
+            except Exception as e:
+                logger.warning(f"Spool noch nicht nachreichbar: {e}")
+            await asyncio.sleep(self.retry_interval)
+
+
+_writer = None
+
+
+def get_invoice_writer():
+    global _writer
+    if _writer is None:
+        _writer = InvoiceWriter(
+            os.path.join(os.getenv("DATA_DIR", "data"),
+                         "invoice_spool.jsonl"),
+            flush_ms=float(os.getenv("INVOICE_FLUSH_MS", "20")),
+            max_batch=int(os.getenv("INVOICE_BATCH_SIZE", "200")),
+            retry_interval=float(os.getenv("INVOICE_SPOOL_RETRY", "30")),
+            dead_letter_path=os.path.join(os.getenv("DATA_DIR", "data"),
+                                          "invoice_dead_letter.jsonl"))
+    return _writer
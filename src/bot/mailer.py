@@ -0,0 +1,256 @@
+import os
+import time
+import asyncio
+import logging
+from email.message import EmailMessage
+from email.utils import formataddr
+
+import metrics
+import resilience
+from ratelimit import TokenBucket
+
+# Versand der Rechnungs-PDFs per E-Mail. Nachrichten kommen in eine Queue;
+# SMTP_POOL_SIZE Worker halten je eine SMTP-Verbindung offen und
+# verwenden sie für viele Nachrichten (Verbindungsaufbau, STARTTLS und
+# Login nur einmal). Je Empfänger-Domain begrenzt ein Token-Bucket die
+# Rate; ist er leer, geht die Nachricht verzögert zurück in die Queue,
+# statt einen Worker zu blockieren. Vorübergehende Fehler (4xx,
+# Verbindungsabbruch) werden mit Backoff wiederholt, 5xx ist endgültig.
+
+logger = logging.getLogger(__name__)
+
+
+class MailJob:
+    __slots__ = ("message", "domain", "fut", "attempt")
+
+    def __init__(self, message, fut):
+        self.message = message
+        self.domain = message["To"].addresses[0].domain.lower()
+        self.fut = fut
+        self.attempt = 0
+
+
+def is_permanent(e):
+    """5xx-Antworten des Servers: Wiederholen ist zwecklos"""
+    import aiosmtplib
+    if isinstance(e, aiosmtplib.SMTPRecipientsRefused):
+        return all(500 <= r.code < 600 for r in e.recipients)
+    return (isinstance(e, aiosmtplib.SMTPResponseException)
+            and 500 <= e.code < 600)
+
+
+def keeps_connection(e):
+    """Antwortfehler lassen die Verbindung benutzbar, alles andere nicht"""
+    import aiosmtplib
+    return (isinstance(e, aiosmtplib.SMTPResponseException) and
+            not isinstance(e, aiosmtplib.SMTPServerDisconnected))
+
+
+class Mailer:
+
+    def __init__(self, hostname, port, username=None, password=None,
+                 pool_size=3, domain_rate=20, domain_burst=5, retries=5,
+                 backoff_base=2.0, backoff_cap=300.0, timeout=30,
+                 idle_timeout=60):
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.pool_size = pool_size
+        # domain_rate in Nachrichten pro Minute
+        self.domain_rate = domain_rate / 60
+        self.domain_burst = domain_burst
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._queue = asyncio.Queue()
+        self._buckets = {}
+        self._delayed = {}
+        self._workers = []
+        self.connections = 0
+
+    def submit(self, message):
+        """Reiht die Nachricht ein; das Future wird True (zugestellt) oder
+        False (endgültig fehlgeschlagen)"""
+        fut = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(MailJob(message, fut))
+        return fut
+
+    async def start(self):
+        self._workers = [
+            asyncio.create_task(self._worker())
+            for _ in range(self.pool_size)
+        ]
+
+    async def stop(self, timeout=10):
+        """Wartet bis `timeout` auf offene Nachrichten, beendet dann die
+        Worker; noch Verzögertes wird abgebrochen (Status bleibt)"""
+        if not self._workers:
+            return
+        deadline = time.monotonic() + timeout
+        while ((self._queue.qsize() or self._delayed)
+               and time.monotonic() < deadline):
+            await asyncio.sleep(0.05)
+        for handle, job in self._delayed.items():
+            handle.cancel()
+            job.fut.cancel()
+        if self._delayed:
+            logger.warning(
+                f"{len(self._delayed)} E-Mail(s) beim Beenden verworfen")
+        self._delayed.clear()
+        for _ in self._workers:
+            self._queue.put_nowait(None)
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def _bucket(self, domain):
+        bucket = self._buckets.get(domain)
+        if bucket is None:
+            bucket = self._buckets[domain] = TokenBucket(
+                self.domain_rate, self.domain_burst)
+        return bucket
+
+    def _later(self, job, delay):
+        loop = asyncio.get_running_loop()
+
+        def requeue():
+            self._delayed.pop(handle, None)
+            self._queue.put_nowait(job)
+
+        handle = loop.call_later(delay, requeue)
+        self._delayed[handle] = job
+
+    async def _connect(self):
+        import aiosmtplib
+        # Ohne Passwort kein Login (z.B. Relay im internen Netz)
+        login = bool(self.password)
+        smtp = aiosmtplib.SMTP(hostname=self.hostname,
+                               port=self.port,
+                               username=self.username if login else None,
+                               password=self.password if login else None,
+                               use_tls=self.port == 465,
+                               timeout=self.timeout)
+        async with metrics.timed("smtp", "connect"):
+            await smtp.connect()
+        self.connections += 1
+        return smtp
+
+    @staticmethod
+    async def _close(smtp):
+        if smtp is None:
+            return
+        try:
+            if smtp.is_connected:
+                await smtp.quit()
+        except Exception:
+            smtp.close()
+
+    async def _worker(self):
+        smtp = None
+        try:
+            while True:
+                try:
+                    job = await asyncio.wait_for(self._queue.get(),
+                                                 self.idle_timeout)
+                except asyncio.TimeoutError:
+                    # Leerlauf: Verbindung nicht unnötig offen halten
+                    await self._close(smtp)
+                    smtp = None
+                    continue
+                if job is None:
+                    return
+                bucket = self._bucket(job.domain)
+                if not bucket.try_acquire():
+                    self._later(job, bucket.wait_time())
+                    continue
+                try:
+                    if smtp is None or not smtp.is_connected:
+                        smtp = await self._connect()
+                    async with metrics.timed("smtp", "send"):
+                        await smtp.send_message(job.message)
+                except Exception as e:
+                    if not keeps_connection(e):
+                        await self._close(smtp)
+                        smtp = None
+                    self._failed(job, e)
+                    continue
+                if not job.fut.done():
+                    job.fut.set_result(True)
+        finally:
+            await self._close(smtp)
+
+    def _failed(self, job, e):
+        job.attempt += 1
+        if is_permanent(e) or job.attempt >= self.retries:
+            logger.warning(f"E-Mail an {job.message['To']} nicht zugestellt "
+                           f"({job.attempt} Versuche): {e}")
+            if not job.fut.done():
+                job.fut.set_result(False)
+            return
+        delay = resilience.backoff(job.attempt - 1, self.backoff_base,
+                                   self.backoff_cap)
+        logger.info(f"E-Mail an {job.message['To']}: Versuch {job.attempt} "
+                    f"fehlgeschlagen ({e}), neuer Versuch in {delay:.1f}s")
+        self._later(job, delay)
+
+
+def sender_address():
+    return os.getenv("SMTP_FROM") or os.getenv("SMTP_EMAIL", "")
+
+
+def enabled():
+    return (os.getenv("MAIL_ENABLED") == "1" and bool(os.getenv("SMTP_SERVER"))
+            and bool(sender_address()))
+
+
+def invoice_message(profile, inv, pdf_bytes, filename, total_text):
+    """E-Mail an den Kunden mit der Rechnung als PDF-Anhang; ValueError,
+    wenn etwas fehlt (Profil, gültige Adresse)"""
+    if not profile:
+        raise ValueError("kein Absenderprofil hinterlegt (⚙️ Einstellungen)")
+    company = profile.get("company_name") or ""
+    number = inv.get("invoice_number") or ""
+    date = str(inv.get("date") or "")
+    if len(date) >= 10:
+        date = f"{date[8:10]}.{date[5:7]}.{date[:4]}"
+    msg = EmailMessage()
+    msg["From"] = formataddr((company, sender_address()))
+    msg["To"] = (inv.get("client_email") or "").strip()
+    if not any(a.domain for a in msg["To"].addresses):
+        raise ValueError(f"ungültige E-Mail-Adresse: {msg['To']}")
+    if profile.get("email"):
+        msg["Reply-To"] = profile["email"]
+    msg["Subject"] = f"Rechnung {number} – {company}".strip(" –")
+    msg.set_content(f"Sehr geehrte Damen und Herren,\n\n"
+                    f"anbei erhalten Sie unsere Rechnung {number} vom "
+                    f"{date} über {total_text}.\n\n"
+                    f"Mit freundlichen Grüßen\n{company}\n")
+    msg.add_attachment(pdf_bytes,
+                       maintype="application",
+                       subtype="pdf",
+                       filename=filename)
+    return msg
+
+
+_mailer = None
+
+
+def get_mailer():
+    global _mailer
+    if _mailer is None:
+        _mailer = Mailer(
+            os.getenv("SMTP_SERVER", ""),
+            int(os.getenv("SMTP_PORT", "587")),
+            username=os.getenv("SMTP_USER") or os.getenv("SMTP_EMAIL"),
+            password=os.getenv("SMTP_PASSWORD"),
+            pool_size=int(os.getenv("SMTP_POOL_SIZE", "3")),
+            domain_rate=float(os.getenv("MAIL_DOMAIN_RATE", "20")),
+            domain_burst=int(os.getenv("MAIL_DOMAIN_BURST", "5")),
+            retries=int(os.getenv("MAIL_RETRIES", "5")),
+            backoff_base=float(os.getenv("MAIL_BACKOFF_BASE", "2")),
+            backoff_cap=float(os.getenv("MAIL_BACKOFF_CAP", "300")),
+            timeout=float(os.getenv("SMTP_TIMEOUT", "30")),
+            idle_timeout=float(os.getenv("SMTP_IDLE_TIMEOUT", "60")))
+    return _mailer
@@ -1,119 +1,199 @@
 import os
+import asyncio
 import logging
 import json
 import base64
-import io
-import urllib.parse
+import shutil
+import datetime
+import tempfile
 import re
+import time
 from dotenv import load_dotenv
-from supabase import create_client, Client
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, WebAppInfo
-from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, ConversationHandler
-import anthropic
+from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, WebAppInfo, InputFile, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, ConversationHandler, CallbackQueryHandler
+import bulk_import
+import db
+import downloads
+import export
+import imageprep
+import mailer
+import metrics
+import numbering
+import ocr
+import prefill
+import recurring
+import resilience
+import router
+import send_limiter
+import server
+import totals
+from persistence import SharedConversationHandler, build_persistence
+from ratelimit import QueueFull
+from update_processor import PerUserUpdateProcessor
+import workers
+from cache import get_profile_cache
+from invoice_pdf import render_invoice, fmt_eur
+from invoice_writer import get_invoice_writer, idempotency_key, invoice_row
 
 # 1. Einstellungen & Initialisierung
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-supabase: Client = create_client(os.getenv("SUPABASE_URL"),
-                                 os.getenv("SUPABASE_KEY"))
-anthropic_client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-
 # Zustände für ConversationHandler
 SETTINGS_MENU, WAITING_FOR_DOC = range(2)
 
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "10"))
+STATUS_LABELS = {
+    "created": "erstellt",
+    "sent": "versendet",
+    "mail_failed": "E-Mail fehlgeschlagen",
+    "paid": "bezahlt"
+}
+DB_DOWN_TEXT = ("⚠️ Die Datenbank ist vorübergehend nicht erreichbar. "
+                "Bitte versuchen Sie es in einer Minute erneut.")
+
 # --- HILFSFUNKTIONEN ---
 
 
-def get_profile_url(user_id):
-    """Holt Daten aus Supabase und erstellt eine URL für settings.html"""
-    base_url = "https://atashkayev-stack.github.io/invoice-bot/settings.html"
-    try:
-        res = supabase.table("profiles").select("*").eq("id",
-                                                        user_id).execute()
-        if res.data:
-            p = res.data[0]
-            data = {
-                "company_name": p.get("company_name"),
-                "street": p.get("street"),
-                "postal_code": p.get("zip"),
-                "city": p.get("city"),
-                "email": p.get("email"),
-                "phone": p.get("phone"),
-                "tax_id": p.get("tax_id"),
-                "iban": p.get("iban")
-            }
-            encoded = base64.urlsafe_b64encode(
-                json.dumps(data).encode()).decode().strip("=")
-            return f"{base_url}?data={urllib.parse.quote(encoded)}"
-    except Exception as e:
-        logger.error(f"Fehler beim Abrufen des Profils: {e}")
-    return base_url
+# Tastentexte der Reply-Keyboards; router.ButtonHandler vergleicht exakt
+BTN_CREATE = "📝 Rechnung erstellen"
+BTN_SETTINGS = "⚙️ Einstellungen"
+BTN_HISTORY = "📋 Meine Rechnungen"
+BTN_DEVELOPER = "📧 Entwickler kontaktieren"
+BTN_FROM_DOC = "📄 Aus Dokument laden"
+BTN_BACK = "🔙 Zurück"
 
+SETTINGS_URL = "https://atashkayev-stack.github.io/invoice-bot/settings.html"
+INVOICE_URL = "https://atashkayev-stack.github.io/invoice-bot/create_invoice.html"
+
+
+async def get_profile_url(user_id):
+    """Holt Daten aus Supabase und erstellt eine URL für settings.html.
+
+    Fehler werden nicht verschluckt: ein leeres Formular würde beim
+    Speichern das bestehende Profil überschreiben."""
+    p = await db.get_profile(user_id)
+    if p:
+        return await prefill.build_url(SETTINGS_URL, user_id, "settings",
+                                       prefill.settings_data(p))
+    return SETTINGS_URL
 
-def get_invoice_url(user_id):
-    """Holt Profildaten und erstellt eine URL für create_invoice.html"""
-    base_url = "https://atashkayev-stack.github.io/invoice-bot/create_invoice.html"
-    try:
-        res = supabase.table("profiles").select("*").eq("id",
-                                                        user_id).execute()
-        if res.data:
-            p = res.data[0]
-            # Данные отправителя для предзаполнения формы счета
-            data = {
-                "sender_name": p.get("company_name"),
-                "sender_address":
-                f"{p.get('street')}, {p.get('zip')} {p.get('city')}",
-                "sender_email": p.get("email"),
-                "sender_iban": p.get("iban"),
-                "sender_tax_id": p.get("tax_id")
-            }
-            encoded = base64.urlsafe_b64encode(
-                json.dumps(data).encode()).decode().strip("=")
-            return f"{base_url}?data={urllib.parse.quote(encoded)}"
-    except Exception as e:
-        logger.error(f"Fehler für Invoice-URL: {e}")
-    return base_url
+
+async def get_invoice_url(p):
+    """Erstellt aus der Profilzeile eine URL für create_invoice.html; die
+    Wiederholung bietet das Formular nur an, wenn der Job dafür läuft"""
+    url = INVOICE_URL
+    if p:
+        url = await prefill.build_url(INVOICE_URL, p["id"], "invoice",
+                                      prefill.invoice_data(p))
+    if recurring.available():
+        url += f"{'&' if '?' in url else '?'}recurring=1"
+    return url
 
 
 def get_main_keyboard():
     return ReplyKeyboardMarkup([[
-        KeyboardButton("📝 Rechnung erstellen"),
-        KeyboardButton("⚙️ Einstellungen")
+        KeyboardButton(BTN_CREATE),
+        KeyboardButton(BTN_SETTINGS)
     ],
                                 [
-                                    KeyboardButton("📋 Meine Rechnungen"),
-                                    KeyboardButton("📧 Entwickler kontaktieren")
+                                    KeyboardButton(BTN_HISTORY),
+                                    KeyboardButton(BTN_DEVELOPER)
                                 ]],
                                resize_keyboard=True)
 
 
+async def send_invoice_pdf(update: Update, profile, inv):
+    """Rendert die Rechnung im Prozess-Pool und schickt sie als Dokument;
+    liefert (pdf_bytes, dateiname)"""
+    pdf_bytes = await workers.run_in_process(render_invoice, profile, inv)
+    filename = f"Rechnung_{inv.get('invoice_number') or inv.get('date')}.pdf"
+    await update.message.reply_document(InputFile(pdf_bytes,
+                                                  filename=filename))
+    return pdf_bytes, filename
+
+
+async def create_recurring(update: Update, inv, key):
+    """Vorlage für die wiederkehrende Rechnung anlegen (recurring.py) und
+    den nächsten Termin melden"""
+    try:
+        first = await recurring.create(update.effective_user.id, inv, key)
+    except ValueError as e:
+        await update.message.reply_text(
+            f"⚠️ Keine wiederkehrende Rechnung angelegt: {e}")
+        return
+    except resilience.Unavailable as e:
+        logger.warning(f"Vorlage nicht gespeichert: {e}")
+        await update.message.reply_text(
+            "⚠️ Die Wiederholung konnte nicht gespeichert werden. Bitte "
+            "senden Sie das Formular später erneut.")
+        return
+    await update.message.reply_text(
+        f"🔁 Die nächste Rechnung wird am {first:%d.%m.%Y} automatisch "
+        "erstellt.")
+
+
+async def edit_progress(context: ContextTypes.DEFAULT_TYPE, msg, text):
+    """Fortschrittsanzeige über den Bulk-Kanal des SendLimiters; noch
+    wartende ältere Stände werden dort zusammengefasst"""
+    await context.bot.edit_message_text(
+        text,
+        chat_id=msg.chat_id,
+        message_id=msg.message_id,
+        rate_limit_args=send_limiter.lane(context.bot, send_limiter.BULK))
+
+
+async def mail_invoice(update: Update, message, key, saved):
+    """Schickt die Rechnung an den Kunden (mailer.py) und trägt das
+    Ergebnis in invoices.status ein; läuft im Hintergrund"""
+    delivered = await mailer.get_mailer().submit(message)
+    # Write-Behind: Status erst setzen, wenn die Zeile in Supabase ist
+    if await saved:
+        try:
+            await db.set_invoice_status(key,
+                                        "sent" if delivered else "mail_failed")
+        except Exception as e:
+            logger.warning(f"Versandstatus nicht gespeichert: {e}")
+    else:
+        logger.warning(f"Versandstatus nicht gespeichert, Rechnung {key} "
+                       "liegt in der Spool- bzw. Dead-Letter-Datei")
+    if delivered:
+        await update.message.reply_text(
+            f"📧 Rechnung an {message['To']} zugestellt.")
+    else:
+        await update.message.reply_text(
+            f"⚠️ Die E-Mail an {message['To']} konnte nicht zugestellt "
+            "werden. Bitte senden Sie die PDF-Datei selbst.")
+
+
 # --- HANDLER ---
 
 
+@metrics.instrument
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Willkommen im Hauptmenü:",
                                     reply_markup=get_main_keyboard())
 
 
+@metrics.instrument
 async def rechnung_erstellen_start(update: Update,
                                    context: ContextTypes.DEFAULT_TYPE):
     """Обработка кнопки создания счета"""
     user_id = update.effective_user.id
-    res = supabase.table("profiles").select("*").eq("id", user_id).execute()
+    profile = await db.get_profile(user_id)
 
-    if not res.data:
+    if not profile:
         await update.message.reply_text(
             "⚠️ Bitte füllen Sie zuerst Ihr Profil in den Einstellungen aus!",
             reply_markup=get_main_keyboard())
         return
 
-    invoice_url = get_invoice_url(user_id)
+    invoice_url = await get_invoice_url(profile)
     keyboard = ReplyKeyboardMarkup([[
         KeyboardButton("📄 Rechnung ausfüllen",
                        web_app=WebAppInfo(url=invoice_url))
-    ], [KeyboardButton("🔙 Zurück")]],
+    ], [KeyboardButton(BTN_BACK)]],
                                    resize_keyboard=True)
 
     await update.message.reply_text(
@@ -121,18 +201,19 @@ async def rechnung_erstellen_start(update: Update,
         reply_markup=keyboard)
 
 
+@metrics.instrument
 async def settings_main(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    web_app_url = get_profile_url(user_id)
+    web_app_url = await get_profile_url(user_id)
 
     keyboard = ReplyKeyboardMarkup(
-        [[KeyboardButton("📄 Aus Dokument laden")],
+        [[KeyboardButton(BTN_FROM_DOC)],
          [
              KeyboardButton("✍️ Manuell eingeben",
                             web_app=WebAppInfo(url=web_app_url))
          ],
          [KeyboardButton("🔍 Überprüfen", web_app=WebAppInfo(url=web_app_url))],
-         [KeyboardButton("🔙 Zurück")]],
+         [KeyboardButton(BTN_BACK)]],
         resize_keyboard=True)
 
     await update.message.reply_text(
@@ -141,6 +222,7 @@ async def settings_main(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return SETTINGS_MENU
 
 
+@metrics.instrument
 async def ask_for_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "📤 Bitte senden Sie ein Foto oder ein PDF Ihrer Rechnung (Absenderdaten)."
@@ -148,37 +230,88 @@ async def ask_for_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return WAITING_FOR_DOC
 
 
+@metrics.instrument
 async def handle_profile_document(update: Update,
                                   context: ContextTypes.DEFAULT_TYPE):
     msg = await update.message.reply_text("⏳ Dokument wird analysiert...")
+
+    async def on_position(position):
+        await edit_progress(
+            context, msg,
+            f"⏳ Sie sind #{position} in der Warteschlange. Bitte warten...")
+
+    try:
+        doc = update.message.photo[-1] if update.message.photo else (
+            update.message.document)
+        # Typ und Größe prüfen, bevor etwas geladen wird
+        kind = downloads.check(doc)
+    except downloads.Rejected as e:
+        await msg.edit_text(f"❌ {e}")
+        return WAITING_FOR_DOC
+
     try:
-        if update.message.photo:
-            file = await context.bot.get_file(update.message.photo[-1].file_id)
-            out = io.BytesIO()
-            await file.download_to_memory(out)
-            img_b64 = base64.urlsafe_b64encode(out.getvalue()).decode('utf-8')
+
+        async def download():
+            return await downloads.fetch(context.bot, doc.file_id)
+
+        async def extract_photo(source, key):
+            img_bytes, media_type = await workers.run_in_process(
+                imageprep.preprocess, source)
             content = [{
                 "type": "image",
                 "source": {
                     "type": "base64",
-                    "media_type": "image/jpeg",
-                    "data": img_b64
+                    "media_type": media_type,
+                    "data": base64.b64encode(img_bytes).decode('utf-8')
                 }
             }, {
-                "type":
-                "text",
-                "text":
-                "Extract SENDER JSON: company_name, street, postal_code, city, email, phone, tax_id, iban."
+                "type": "text",
+                "text": ocr.SENDER_PROMPT
             }]
-        # (Остальная логика OCR как была...)
-        # Для краткости пропустим внутренности OCR, они у тебя рабочие.
-        pass
+            return await ocr.extract_sender(content, key, on_position)
+
+        async def extract_pdf(pdf_bytes, key):
+            return await ocr.extract_from_pdf(pdf_bytes, key, on_position)
+
+        processed_data = await ocr.extract_cached(
+            doc.file_unique_id, download,
+            extract_photo if kind == "image" else extract_pdf)
+
+        if not processed_data:
+            await msg.edit_text("❌ Daten konnten nicht erkannt werden.")
+            return WAITING_FOR_DOC
+
+        review_url = await prefill.build_url(SETTINGS_URL,
+                                             update.effective_user.id,
+                                             "extract", processed_data)
+        await msg.delete()
+        await update.message.reply_text(
+            f"✅ Daten erkannt für: {processed_data.get('company_name') or 'Unbekannt'}",
+            reply_markup=ReplyKeyboardMarkup([[
+                KeyboardButton(
+                    "🔍 Überprüfen",
+                    web_app=WebAppInfo(url=review_url))
+            ], [KeyboardButton(BTN_BACK)]],
+                                             resize_keyboard=True))
+    except downloads.Rejected as e:
+        await msg.edit_text(f"❌ {e}")
+        return WAITING_FOR_DOC
+    except ocr.NoText:
+        await msg.edit_text(
+            "❌ Das PDF enthält keinen Text. Bitte senden Sie ein Foto.")
+        return WAITING_FOR_DOC
+    except QueueFull:
+        await msg.edit_text(
+            "⚠️ Gerade sind zu viele Dokumente in Bearbeitung. "
+            "Bitte versuchen Sie es in einer Minute erneut.")
+        return WAITING_FOR_DOC
     except Exception as e:
         logger.error(f"OCR Error: {e}")
         await msg.edit_text("❌ Fehler bei der Analyse.")
     return SETTINGS_MENU
 
 
+@metrics.instrument
 async def web_app_data_handler(update: Update,
                                context: ContextTypes.DEFAULT_TYPE):
     try:
@@ -204,13 +337,8 @@ async def web_app_data_handler(update: Update,
                 "iban": raw_data.get("iban")
             }
 
-            # Сохранение профиля с защитой от разрыва соединения (наша прошлая правка)
-            try:
-                supabase.table("profiles").upsert(profile_data).execute()
-            except Exception as e:
-                logger.warning(
-                    f"Verbindungsproblem (10054?), versuche erneut: {e}")
-                supabase.table("profiles").upsert(profile_data).execute()
+            # Wiederholungen bei Verbindungsabbrüchen übernimmt db/resilience
+            await db.upsert_profile(profile_data)
 
             await update.message.reply_text(
                 "🎉 Profil erfolgreich gespeichert!",
@@ -220,76 +348,451 @@ async def web_app_data_handler(update: Update,
         elif data_type == "create_invoice" or "invoice_data" in raw_data:
             inv = raw_data.get("invoice_data")
 
-            # Подготовка данных для новой таблицы 'invoices'
-            db_invoice_data = {
-                "user_id": update.effective_user.id,
-                "client_name": inv.get("client_name"),
-                "client_address": inv.get("client_address"),
-                "client_email": inv.get("client_email"),
-                "description": inv.get("description"),
-                "amount": inv.get("amount"),
-                "vat_rate": inv.get("vat_rate"),
-                "total": inv.get("total"),
-                "invoice_date": inv.get("date"),
-                "status": "created"
-            }
-
-            # Сохраняем счет в базу (тоже с защитой от разрыва)
+            # Summen nicht aus dem Browser übernehmen, sondern nachrechnen
+            try:
+                result = totals.verify(inv)
+            except ValueError as e:
+                logger.warning(f"Rechnung abgelehnt: {e}")
+                await update.message.reply_text(
+                    "❌ Die Beträge der Rechnung sind nicht stimmig. "
+                    "Bitte prüfen Sie Betrag und Steuersatz und senden Sie "
+                    "das Formular erneut.",
+                    reply_markup=get_main_keyboard())
+                return
+
+            # Nummer hängt am Idempotenz-Schlüssel: doppelt gesendete
+            # Formulare (gleiche Nonce) bekommen dieselbe Nummer statt einer
+            # Lücke, getrennte Rechnungen gleichen Inhalts zwei Nummern
+            key = idempotency_key(update.effective_user.id, inv,
+                                  raw_data.get("nonce"))
             try:
-                supabase.table("invoices").insert(db_invoice_data).execute()
-            except Exception:
-                logger.warning(
-                    "Verbindung verloren beim Speichern der Rechnung, versuche erneut..."
-                )
-                supabase.table("invoices").insert(db_invoice_data).execute()
+                number = await numbering.get_allocator().number_for(
+                    update.effective_user.id, inv, key)
+            except resilience.Unavailable as e:
+                # Die Rechnung geht trotzdem in den Write-Behind (Spool);
+                # die Nummer vergibt der Writer, sobald Supabase zurück ist
+                logger.warning(f"Rechnungsnummer wird nachgereicht: {e}")
+                number = None
+            if number:
+                inv = {**inv, "invoice_number": number}
+            try:
+                profile = await db.get_profile(update.effective_user.id)
+            except resilience.Unavailable:
+                if number:
+                    raise
+                profile = None
+
+            # Подготовка данных для новой таблицы 'invoices'
+            db_invoice_data = invoice_row(update.effective_user.id, inv,
+                                          result, key, profile)
+
+            # Write-Behind: gespeichert wird gebündelt im Hintergrund,
+            # bei Ausfall über die Spool-Datei (Upsert, daher ohne Duplikate)
+            saved = get_invoice_writer().submit(db_invoice_data)
+
+            if not number:
+                # Ohne Nummer keine gültige PDF; sie entsteht später über
+                # /export aus dem gespeicherten Snapshot
+                text = (f"✅ Rechnung für {inv.get('client_name')} über "
+                        f"{fmt_eur(totals.to_euro(result.gross))} ist "
+                        "vorgemerkt.\n"
+                        "Die Datenbank ist gerade nicht erreichbar. "
+                        "Rechnungsnummer und Speicherung folgen automatisch, "
+                        "sobald sie wieder verfügbar ist; die PDF-Datei "
+                        "erhalten Sie dann über /export.")
+                if inv.get("recurrence") in recurring.SCHEDULES:
+                    text += ("\n⚠️ Die Wiederholung wurde nicht angelegt; "
+                             "bitte erstellen Sie sie später erneut.")
+                await update.message.reply_text(
+                    text, reply_markup=get_main_keyboard())
+                return
 
             await update.message.reply_text(
-                f"✅ Rechnung für {inv.get('client_name')} über {inv.get('total')} € wurde gespeichert!\n"
+                f"✅ Rechnung {number} für {inv.get('client_name')} über {fmt_eur(totals.to_euro(result.gross))} wurde gespeichert!\n"
                 "Ich bereite die PDF-Datei vor...",
                 reply_markup=get_main_keyboard())
-            # Сюда позже добавим: await send_invoice_pdf(update, inv)
 
+            if inv.get("recurrence") in recurring.SCHEDULES:
+                if recurring.available():
+                    await create_recurring(update, inv, key)
+                else:
+                    await update.message.reply_text(
+                        "⚠️ Wiederkehrende Rechnungen sind derzeit nicht "
+                        "verfügbar; die Rechnung wurde einmalig erstellt.")
+
+            try:
+                pdf_bytes, filename = await send_invoice_pdf(
+                    update, profile, inv)
+            except Exception as e:
+                logger.error(f"PDF-Fehler: {e}")
+                await update.message.reply_text(
+                    "⚠️ Die PDF-Datei konnte nicht erstellt werden.")
+                return
+
+            if mailer.enabled() and inv.get("client_email"):
+                try:
+                    message = mailer.invoice_message(
+                        profile, inv, pdf_bytes, filename,
+                        fmt_eur(totals.to_euro(result.gross)))
+                except ValueError as e:
+                    logger.warning(f"E-Mail nicht möglich: {e}")
+                    await update.message.reply_text(
+                        f"⚠️ Keine E-Mail gesendet: {e}")
+                    return
+                context.application.create_task(
+                    mail_invoice(update, message, key, saved))
+
+    except resilience.Unavailable as e:
+        logger.warning(f"Datenbank nicht erreichbar: {e}")
+        await update.message.reply_text(DB_DOWN_TEXT,
+                                        reply_markup=get_main_keyboard())
     except Exception as e:
         logger.error(f"Kritischer Fehler im web_app_data_handler: {e}")
         await update.message.reply_text(f"❌ Fehler: {str(e)}",
                                         reply_markup=get_main_keyboard())
 
 
+@metrics.instrument
+async def import_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(
+        "📥 Rechnungen importieren: Senden Sie eine CSV- oder XLSX-Datei mit "
+        "den Spalten client_name, amount, vat_rate, total, date (optional "
+        "client_address, client_email, description). Deutsche Spaltennamen "
+        "wie Kunde, Netto, MwSt, Brutto, Datum werden ebenfalls erkannt.")
+
+
+def import_progress_text(stats):
+    return (f"⏳ Import läuft: {stats.read} Zeilen gelesen, "
+            f"{stats.saved} gespeichert, {stats.error_count} fehlerhaft")
+
+
+@metrics.instrument
+async def import_invoices(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """CSV/XLSX-Upload: Rechnungen blockweise importieren (bulk_import.py)"""
+    doc = update.message.document
+    try:
+        downloads.check(doc, accepted=None)
+    except downloads.Rejected as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+    msg = await update.message.reply_text("⏳ Import wird vorbereitet...")
+
+    async def on_progress(stats):
+        await edit_progress(context, msg, import_progress_text(stats))
+
+    suffix = os.path.splitext(doc.file_name or "")[1].lower()
+    spool = None
+    try:
+        # Direkt auf die Platte: der Import liest die Datei über den Pfad
+        spool = await downloads.fetch(context.bot,
+                                      doc.file_id,
+                                      max_memory=0,
+                                      suffix=suffix)
+        stats = await bulk_import.import_file(spool.path,
+                                              update.effective_user.id,
+                                              on_progress)
+    except downloads.Rejected as e:
+        await msg.edit_text(f"❌ {e}")
+        return
+    except bulk_import.ImportBusy:
+        await msg.edit_text("⚠️ Ein Import läuft bereits. Bitte warten Sie, "
+                            "bis er abgeschlossen ist.")
+        return
+    except bulk_import.InvalidFile as e:
+        await msg.edit_text(f"❌ Import nicht möglich: {e}")
+        return
+    except resilience.Unavailable as e:
+        logger.warning(f"Import abgebrochen: {e}")
+        await msg.edit_text(
+            f"{DB_DOWN_TEXT}\nBereits importierte Zeilen bleiben erhalten; "
+            "Sie können dieselbe Datei erneut senden.")
+        return
+    finally:
+        if spool is not None:
+            spool.close()
+
+    text = f"✅ Import abgeschlossen: {stats.saved} Rechnungen gespeichert."
+    if stats.error_count:
+        text += (f"\n\n⚠️ {stats.error_count} Zeilen übersprungen:\n" +
+                 "\n".join(stats.errors))
+        if stats.error_count > len(stats.errors):
+            text += "\n…"
+    await msg.edit_text(text)
+
+
+@metrics.instrument
+async def export_invoices(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/export [Jahr]: alle Rechnungen des Jahres als ZIP (PDFs + CSV)"""
+    user_id = update.effective_user.id
+    year = datetime.date.today().year
+    if context.args:
+        if not context.args[0].isdigit():
+            await update.message.reply_text("Verwendung: /export 2025")
+            return
+        year = int(context.args[0])
+    msg = await update.message.reply_text(f"⏳ Export {year} wird erstellt...")
+
+    async def on_progress(count):
+        await edit_progress(
+            context, msg, f"⏳ Export {year}: {count} Rechnungen verarbeitet...")
+
+    workdir = tempfile.mkdtemp(prefix="export-")
+    try:
+        paths, count, without_pdf = await export.export_year(
+            user_id, year, workdir, on_progress)
+        if not count:
+            await msg.edit_text(f"Keine Rechnungen für {year} gefunden.")
+            return
+        await msg.edit_text(
+            f"📤 {count} Rechnungen exportiert, Datei wird gesendet...")
+        for path in paths:
+            with open(path, "rb") as f:
+                await context.bot.send_document(
+                    update.effective_chat.id,
+                    f,
+                    filename=os.path.basename(path),
+                    read_timeout=300,
+                    write_timeout=300,
+                    rate_limit_args=send_limiter.lane(context.bot,
+                                                      send_limiter.BULK))
+        text = f"✅ Export {year}: {count} Rechnungen."
+        if without_pdf:
+            text += (f"\n\nℹ️ {without_pdf} davon nur in der Buchungsliste: "
+                     "Für ältere oder importierte Rechnungen ist das "
+                     "verschickte Dokument nicht gespeichert.")
+        await msg.edit_text(text)
+    except export.ExportBusy:
+        await msg.edit_text("⚠️ Ein Export läuft bereits. Bitte warten Sie, "
+                            "bis er abgeschlossen ist.")
+    except resilience.Unavailable as e:
+        logger.warning(f"Export abgebrochen: {e}")
+        await msg.edit_text(DB_DOWN_TEXT)
+    finally:
+        await asyncio.to_thread(shutil.rmtree, workdir, True)
+
+
+def history_cursor(direction, row):
+    """callback_data inv:n|p:<datum>:<id>; "-" steht für kein Datum"""
+    return f"inv:{direction}:{row.get('invoice_date') or '-'}:{row['id']}"
+
+
+def format_history(rows, has_prev, has_next):
+    """Text und Blätter-Buttons für eine Seite der Rechnungsliste"""
+    lines = []
+    for r in rows:
+        date = r.get("invoice_date") or ""
+        if len(date) >= 10:
+            date = f"{date[8:10]}.{date[5:7]}.{date[:4]}"
+        number = f"{r['invoice_number']} · " if r.get("invoice_number") else ""
+        lines.append(f"{date} · {number}{r.get('client_name') or '—'} · "
+                     f"{fmt_eur(r.get('total') or 0)} · "
+                     f"{STATUS_LABELS.get(r.get('status'), r.get('status') or '')}")
+    buttons = []
+    if has_prev:
+        first = rows[0]
+        buttons.append(
+            InlineKeyboardButton("◀️ Neuere",
+                                 callback_data=history_cursor("p", first)))
+    if has_next:
+        last = rows[-1]
+        buttons.append(
+            InlineKeyboardButton("Ältere ▶️",
+                                 callback_data=history_cursor("n", last)))
+    text = "📋 Ihre Rechnungen:\n\n" + "\n".join(lines)
+    return text, InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+@metrics.instrument
+async def meine_rechnungen(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    rows, has_more = await db.list_invoices(update.effective_user.id,
+                                            HISTORY_PAGE_SIZE)
+    if not rows:
+        await update.message.reply_text("Sie haben noch keine Rechnungen.",
+                                        reply_markup=get_main_keyboard())
+        return
+    text, markup = format_history(rows, False, has_more)
+    await update.message.reply_text(text, reply_markup=markup)
+
+
+@metrics.instrument
+async def history_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Blättern in der Rechnungsliste (callback_data inv:n|p:<datum>:<id>)"""
+    query = update.callback_query
+    await query.answer()
+    _, direction, cursor = query.data.split(":", 2)
+    date, inv_id = cursor.rsplit(":", 1)
+    cursor = (None if date == "-" else date, inv_id)
+    if direction == "n":
+        rows, has_more = await db.list_invoices(update.effective_user.id,
+                                                HISTORY_PAGE_SIZE,
+                                                after=cursor)
+        has_prev, has_next = True, has_more
+    else:
+        rows, has_more = await db.list_invoices(update.effective_user.id,
+                                                HISTORY_PAGE_SIZE,
+                                                before=cursor)
+        has_prev, has_next = has_more, True
+    if not rows:
+        return
+    text, markup = format_history(rows, has_prev, has_next)
+    await query.edit_message_text(text, reply_markup=markup)
+
+
+@metrics.instrument
+async def developer_contact(update: Update,
+                            context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text("Kontakt: @your_handle")
+
+
+@metrics.instrument
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Zurück zum Hauptmenü.",
                                     reply_markup=get_main_keyboard())
     return ConversationHandler.END
 
 
-# --- MAIN ---
+async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE):
+    """Zentrale Fehlerbehandlung: DB-Ausfälle schnell und freundlich melden"""
+    if isinstance(context.error, resilience.Unavailable):
+        logger.warning(f"Datenbank nicht erreichbar: {context.error}")
+        if isinstance(update, Update) and update.effective_message:
+            await update.effective_message.reply_text(DB_DOWN_TEXT)
+        return
+    logger.error("Unbehandelter Fehler", exc_info=context.error)
 
 
-def main():
-    app = Application.builder().token(os.getenv("TELEGRAM_BOT_TOKEN")).build()
+def collect_cache_metrics():
+    for name, stats in (("profile", get_profile_cache().stats()),
+                        ("extraction", ocr.get_extraction_cache().stats())):
+        for stat, value in stats.items():
+            metrics.cache_value.set(value, cache=name, stat=stat)
+
 
-    settings_regex = r"Einstellungen"
-    rechnung_regex = r"Rechnung erstellen"
-    history_regex = r"Meine Rechnungen"
-    dev_regex = r"Entwickler"
+def log_latencies():
+    """p95/p99 pro Handler und Abhängigkeit ins Log (z. B. beim Beenden)"""
+    for hist, label in ((metrics.handler_seconds, "handler"),
+                        (metrics.dependency_seconds, "operation")):
+        for labels in hist.series():
+            logger.info(f"{labels[label]}: "
+                        f"p95 {hist.quantile(0.95, **labels):.3f}s, "
+                        f"p99 {hist.quantile(0.99, **labels):.3f}s")
 
-    settings_conv = ConversationHandler(
-        entry_points=[
-            MessageHandler(filters.Regex(settings_regex), settings_main)
-        ],
+
+# --- MAIN ---
+
+# Erst nach dem Start geladen (warm_up): im Bot-Prozess bzw. in den
+# Worker-Prozessen, die PDFs rendern und Dokumente vorverarbeiten
+WARM_MODULES = ("anthropic", )
+WORKER_MODULES = ("reportlab.pdfgen.canvas", "reportlab.lib.utils",
+                  "reportlab.pdfbase.pdfmetrics", "pypdf", "PIL.Image",
+                  "PIL.ImageOps")
+
+_warm_task = None
+
+
+async def warm_up(app: Application):
+    """Läuft im Hintergrund, während schon Updates verarbeitet werden:
+    HTTP-Server starten, Clients anlegen und Verbindungen öffnen,
+    Worker-Prozesse starten und schwere Module vorladen"""
+    warm = os.getenv("WARM_UP", "1") == "1"
+    if warm:
+        # Zuerst die Updates beantworten, die sich beim Neustart gestaut
+        # haben; sonst konkurrieren Imports und Prozessstart mit ihnen
+        await asyncio.sleep(float(os.getenv("WARM_UP_DELAY", "1")))
+    if app.updater is not None and (prefill.base_url()
+                                    or os.getenv("METRICS_ENABLED") == "1"):
+        # Polling: /prefill/<token> und /metrics trotzdem per HTTP anbieten
+        await server.start_background(app)
+    if not warm:
+        return
+    start = time.perf_counter()
+    # Imports und Client-Konstruktion im Thread, der Event-Loop bleibt frei
+    await asyncio.to_thread(workers.preload, WARM_MODULES)
+    await asyncio.to_thread(ocr._get_client)
+    await db.warm_up()
+    try:
+        count = await workers.warm_up(WORKER_MODULES)
+    except Exception as e:
+        logger.warning(f"Worker-Prozesse nicht vorgewärmt: {e}")
+        count = 0
+    logger.info(f"Vorgewärmt in {time.perf_counter() - start:.2f}s "
+                f"({count} Worker-Prozesse)")
+
+
+async def on_startup(app: Application):
+    global _warm_task
+    await get_invoice_writer().start()
+    if mailer.enabled():
+        await mailer.get_mailer().start()
+    # Alles, was der erste Update nicht braucht, nach dem Start
+    _warm_task = asyncio.create_task(warm_up(app))
+
+
+async def on_shutdown(app: Application):
+    if _warm_task is not None and not _warm_task.done():
+        _warm_task.cancel()
+    await server.stop_background()
+    await recurring.stop()
+    await mailer.get_mailer().stop()
+    await get_invoice_writer().stop()
+    logger.info(f"Profil-Cache: {get_profile_cache().stats()}")
+    logger.info(f"Extraktions-Cache: {ocr.get_extraction_cache().stats()}")
+    log_latencies()
+    await db.close()
+    await downloads.close()
+    ocr.close()
+    workers.shutdown()
+
+
+def build_application(webhook=False):
+    builder = Application.builder().token(os.getenv("TELEGRAM_BOT_TOKEN"))
+    builder = builder.base_url(
+        os.getenv("TELEGRAM_BASE_URL", "https://api.telegram.org/bot"))
+    builder = builder.base_file_url(
+        os.getenv("TELEGRAM_BASE_FILE_URL",
+                  "https://api.telegram.org/file/bot"))
+    # Parallel über Nutzer hinweg, je Nutzer der Reihe nach
+    # (ConversationHandler)
+    builder = builder.concurrent_updates(
+        PerUserUpdateProcessor(int(os.getenv("CONCURRENT_UPDATES", "256"))))
+    limiter = send_limiter.build_limiter()
+    if limiter is not None:
+        builder = builder.rate_limiter(limiter)
+    builder = builder.post_init(on_startup).post_shutdown(on_shutdown)
+    persistence = build_persistence()
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    if webhook:
+        # Updates kommen über den ASGI-Server, kein getUpdates-Loop
+        builder = builder.updater(None)
+    app = builder.build()
+
+    settings_conv = SharedConversationHandler(
+        entry_points=[router.ButtonHandler({BTN_SETTINGS: settings_main})],
         states={
             SETTINGS_MENU: [
-                MessageHandler(filters.Regex(r"Aus Dokument laden"),
-                               ask_for_document),
-                MessageHandler(filters.Regex(r"Zurück"), cancel)
+                router.ButtonHandler({
+                    BTN_FROM_DOC: ask_for_document,
+                    BTN_BACK: cancel
+                })
             ],
             WAITING_FOR_DOC: [
+                # Wartet ggf. in der OCR-Warteschlange: läuft als eigener
+                # Task, damit weitere Updates des Nutzers nicht warten
                 MessageHandler(filters.PHOTO | filters.Document.ALL,
-                               handle_profile_document),
-                MessageHandler(filters.Regex(r"Zurück"), settings_main)
+                               handle_profile_document,
+                               block=False),
+                router.ButtonHandler({BTN_BACK: settings_main})
             ]
         },
         fallbacks=[CommandHandler("start", start)],
-        allow_reentry=True)
+        allow_reentry=True,
+        name="settings",
+        persistent=persistence is not None,
+        store=persistence)
+    # Mit Redis: Zustand je Update abgleichen (mehrere Bot-Instanzen)
+    if settings_conv.store is not None:
+        app.update_processor.conversations.append(settings_conv)
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(settings_conv)
@@ -297,21 +800,44 @@ def main():
         MessageHandler(filters.StatusUpdate.WEB_APP_DATA,
                        web_app_data_handler))
 
-    # Кнопка создания счета теперь ведет на реальную функцию
+    # Hauptmenü: ein Dictionary-Lookup statt einer Regex pro Taste
     app.add_handler(
-        MessageHandler(filters.Regex(rechnung_regex),
-                       rechnung_erstellen_start))
-
+        router.ButtonHandler(
+            {
+                BTN_CREATE: rechnung_erstellen_start,
+                BTN_HISTORY: meine_rechnungen,
+                BTN_DEVELOPER: developer_contact,
+                BTN_BACK: cancel
+            },
+            # Freitext: "Menü", "Hauptmenü", "Start"
+            fallbacks=[(r"(haupt)?men[üu]|start", start)]))
+    app.add_handler(CallbackQueryHandler(history_page, pattern=r"^inv:"))
+    app.add_handler(CommandHandler("import", import_help))
+    # Export und Import können Minuten dauern: als eigener Task, sonst
+    # hielte PerUserUpdateProcessor alle weiteren Updates des Nutzers an
     app.add_handler(
-        MessageHandler(filters.Regex(history_regex),
-                       lambda u, c: u.message.reply_text("In Entwicklung...")))
+        CommandHandler("export", export_invoices, block=False))
     app.add_handler(
-        MessageHandler(
-            filters.Regex(dev_regex),
-            lambda u, c: u.message.reply_text("Kontakt: @your_handle")))
+        MessageHandler(filters.Document.FileExtension("csv")
+                       | filters.Document.FileExtension("xlsx"),
+                       import_invoices,
+                       block=False))
+    app.add_error_handler(on_error)
+    if recurring.enabled():
+        # Ein Job für alle Vorlagen; fällige Arbeit holt recurring.tick
+        # blockweise aus Supabase
+        recurring.register(app.job_queue)
+    metrics.register_collector(collect_cache_metrics)
+
+    return app
 
-    print("Bot läuft...")
-    app.run_polling()
+
+def main():
+    if os.getenv("BOT_MODE", "polling") == "webhook":
+        asyncio.run(server.run_webhook(build_application(webhook=True)))
+    else:
+        print("Bot läuft...")
+        build_application().run_polling()
 
 
 if __name__ == "__main__":
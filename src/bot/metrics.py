@@ -0,0 +1,183 @@
+import time
+import bisect
+import functools
+from contextlib import asynccontextmanager
+
+# Einfache Metriken im Prometheus-Textformat (GET /metrics, siehe
+# server.py): Zähler, Gauges und Histogramme mit Labels. Alle Handler
+# werden mit @instrument erfasst (Latenz, laufende Aufrufe, Fehler), jeder
+# externe Aufruf (Supabase, Claude, Telegram-Downloads) mit timed().
+# p95/p99 rechnet Prometheus aus den Buckets (histogram_quantile);
+# quantile() liefert dieselbe Schätzung lokal, z. B. fürs Log.
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+           30.0, 60.0)
+
+_registry = {}
+_collectors = []
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace(
+        "\n", "\\n")
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    inner = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+    return "{" + inner + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        _registry[name] = self
+
+    def series(self):
+        """Label-Kombinationen, für die es Werte gibt"""
+        return [dict(key) for key in self._values]
+
+    def _lines(self):
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(key)} {value}"
+
+    def render(self):
+        return "\n".join([f"# HELP {self.name} {self.help}",
+                          f"# TYPE {self.name} {self.kind}", *self._lines()])
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        self._values[_label_key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # [Zähler pro Bucket (+Inf am Ende), Summe]
+            state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def quantile(self, q, **labels):
+        """Schätzung wie histogram_quantile (lineare Interpolation im Bucket)"""
+        state = self._values.get(_label_key(labels))
+        if state is None:
+            return None
+        counts = state[0]
+        rank = q * sum(counts)
+        seen = 0
+        for i, count in enumerate(counts):
+            if count and seen + count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return None
+
+    def _lines(self):
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"), ), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield (f"{self.name}_bucket"
+                       f"{_format_labels(key, [('le', le)])} {cumulative}")
+            yield f"{self.name}_sum{_format_labels(key)} {total}"
+            yield f"{self.name}_count{_format_labels(key)} {cumulative}"
+
+
+def register_collector(fn):
+    """fn() wird vor jeder Ausgabe aufgerufen und setzt z. B. Cache-Gauges"""
+    if fn not in _collectors:
+        _collectors.append(fn)
+
+
+def render():
+    for fn in _collectors:
+        fn()
+    return "\n".join(m.render() for m in _registry.values()) + "\n"
+
+
+# --- METRIKEN DES BOTS ---
+
+handler_seconds = Histogram("bot_handler_seconds", "Laufzeit der Handler")
+handler_in_flight = Gauge("bot_handler_in_flight", "Laufende Handler-Aufrufe")
+handler_errors = Counter("bot_handler_errors_total",
+                         "Handler mit unbehandelter Ausnahme")
+dependency_seconds = Histogram("bot_dependency_seconds",
+                               "Dauer externer Aufrufe")
+dependency_errors = Counter("bot_dependency_errors_total",
+                            "Fehlgeschlagene externe Aufrufe")
+cache_value = Gauge("bot_cache", "Kennzahlen der Caches")
+
+
+def instrument(fn):
+    """Dekorator für async Handler: Latenz, laufende Aufrufe, Fehler"""
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        handler_in_flight.inc(handler=name)
+        start = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        except Exception:
+            handler_errors.inc(handler=name)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - start, handler=name)
+            handler_in_flight.dec(handler=name)
+
+    return wrapper
+
+
+@asynccontextmanager
+async def timed(dependency, operation):
+    """async with timed("supabase", "GET profiles"): ..."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        dependency_errors.inc(dependency=dependency, operation=operation)
+        raise
+    finally:
+        dependency_seconds.observe(time.perf_counter() - start,
+                                   dependency=dependency,
+                                   operation=operation)
@@ -0,0 +1,108 @@
+import os
+import asyncio
+import logging
+import datetime
+
+import db
+
+# Rechnungsnummern: fortlaufend je Nutzer und Jahr, vergeben in Supabase
+# (sql/003, assign_invoice_numbers). Die Nummer hängt am
+# Idempotenz-Schlüssel der Rechnung; dieselbe Rechnung bekommt also auch
+# nach einem Verbindungsabbruch oder doppeltem Absenden dieselbe Nummer,
+# und verworfene Duplikate hinterlassen keine Lücke. Vergeben wird vor dem
+# gebündelten Schreiben: Wird eine Rechnung nie geschrieben (von der
+# Datenbank abgelehnt, Dead-Letter-Datei), bleibt ihre Nummer ohne Zeile in
+# invoices zurück (Abfrage dafür in sql/003). Ist Supabase beim Erstellen
+# nicht erreichbar, reiht main.py die Rechnung ohne Nummer in den
+# Write-Behind ein; InvoiceWriter vergibt sie dann vor dem Schreiben bzw.
+# beim Nachreichen aus dem Spool.
+#
+# Parallele Anfragen desselben Nutzers warten nicht einzeln auf die
+# Zählerzeile: solange ein Aufruf für (Nutzer, Jahr) läuft, sammeln sich
+# neue Schlüssel und gehen danach gemeinsam als ein Block an die Datenbank.
+
+logger = logging.getLogger(__name__)
+
+
+def number_format():
+    return os.getenv("INVOICE_NUMBER_FORMAT", "RE-{year}-{seq:05d}")
+
+
+def format_number(year, seq, fmt=None):
+    return (fmt or number_format()).format(year=year, seq=seq)
+
+
+def invoice_year(inv):
+    """Jahr des Rechnungsdatums (ISO), sonst das aktuelle Jahr"""
+    date = str(inv.get("date") or "")
+    if len(date) >= 4 and date[:4].isdigit():
+        return int(date[:4])
+    return datetime.date.today().year
+
+
+class NumberAllocator:
+
+    def __init__(self, assign=None):
+        # assign(user_id, year, keys) -> {schlüssel: nummer}
+        self._assign = assign or db.assign_invoice_numbers
+        self._pending = {}
+        self._tasks = {}
+        self.calls = 0
+
+    async def assign(self, user_id, year, key):
+        """Laufende Nummer für den Schlüssel; wirft die Fehler der
+        Datenbank (z.B. resilience.Unavailable) weiter"""
+        slot = (user_id, year)
+        waiting = self._pending.setdefault(slot, {})
+        fut = waiting.get(key)
+        if fut is None:
+            fut = waiting[key] = asyncio.get_running_loop().create_future()
+        if slot not in self._tasks:
+            self._tasks[slot] = asyncio.create_task(self._drain(slot))
+        # Ein abgebrochener Handler darf den gemeinsamen Block nicht abbrechen
+        return await asyncio.shield(fut)
+
+    async def _drain(self, slot):
+        user_id, year = slot
+        batch = {}
+        try:
+            while self._pending.get(slot):
+                batch = self._pending.pop(slot)
+                self.calls += 1
+                try:
+                    numbers = await self._assign(user_id, year, list(batch))
+                except Exception as e:
+                    for fut in batch.values():
+                        if not fut.done():
+                            fut.set_exception(e)
+                    continue
+                for key, fut in batch.items():
+                    if fut.done():
+                        continue
+                    if key in numbers:
+                        fut.set_result(numbers[key])
+                    else:
+                        fut.set_exception(
+                            RuntimeError(f"keine Rechnungsnummer für {key}"))
+        finally:
+            self._tasks.pop(slot, None)
+            # Nur bei Abbruch (Shutdown) bleiben hier Futures offen
+            for fut in (*batch.values(),
+                        *self._pending.pop(slot, {}).values()):
+                if not fut.done():
+                    fut.cancel()
+
+    async def number_for(self, user_id, inv, key):
+        """Formatierte Rechnungsnummer (INVOICE_NUMBER_FORMAT)"""
+        year = invoice_year(inv)
+        return format_number(year, await self.assign(user_id, year, key))
+
+
+_allocator = None
+
+
+def get_allocator():
+    global _allocator
+    if _allocator is None:
+        _allocator = NumberAllocator()
+    return _allocator
@@ -0,0 +1,188 @@
+import os
+import re
+import json
+import asyncio
+import logging
+
+import metrics
+import pdf_text
+import workers
+from extract_cache import ExtractionCache, prompt_version
+from ratelimit import FairLimiter, TokenBucket
+
+# Extraktion der Absenderdaten über Claude. Der asynchrone Client blockiert
+# den Event-Loop nicht; ein globaler Limiter begrenzt parallele Aufrufe und
+# Rate, und identische Anfragen, die gleichzeitig laufen, teilen sich
+# einen einzigen API-Aufruf.
+
+logger = logging.getLogger(__name__)
+
+SENDER_PROMPT = (
+    "Extract SENDER (Seller/Absender) data to JSON: company_name, street, "
+    "postal_code, city, email, phone, tax_id, iban. Use null if not found.")
+
+PDF_PROMPT = ("Extract SENDER (Seller/Absender) data to JSON with only these "
+              "keys: {fields}. Use null if not found. Text:\n\n{text}")
+
+_client = None
+_limiter = None
+_bucket = None
+_cache = None
+_inflight = {}
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        # anthropic erst hier laden: der Import kostet beim Start ~150 ms
+        import anthropic
+        _client = anthropic.AsyncAnthropic(
+            api_key=os.getenv("ANTHROPIC_API_KEY"),
+            timeout=float(os.getenv("OCR_TIMEOUT", "60")),
+            max_retries=2)
+    return _client
+
+
+def _get_limits():
+    global _limiter, _bucket
+    if _limiter is None:
+        _limiter = FairLimiter(int(os.getenv("OCR_CONCURRENCY", "4")),
+                               int(os.getenv("OCR_QUEUE_SIZE", "20")))
+        per_minute = float(os.getenv("OCR_RATE_PER_MINUTE", "50"))
+        _bucket = TokenBucket(per_minute / 60,
+                              capacity=int(os.getenv("OCR_CONCURRENCY", "4")))
+    return _limiter, _bucket
+
+
+def get_extraction_cache():
+    global _cache
+    if _cache is None:
+        version = prompt_version(
+            SENDER_PROMPT, PDF_PROMPT,
+            os.getenv("OCR_MODEL", "claude-3-haiku-20240307"))
+        _cache = ExtractionCache(
+            os.path.join(os.getenv("DATA_DIR", "data"), "extractions.sqlite3"),
+            version,
+            max_entries=int(os.getenv("EXTRACT_CACHE_SIZE", "5000")))
+    return _cache
+
+
+def close():
+    global _cache
+    if _cache is not None:
+        _cache.close()
+        _cache = None
+
+
+def parse_sender(ai_response):
+    """Sucht das JSON in der Antwort und bildet die Felder auf unser Profil ab"""
+    match = re.search(r'\{.*\}', ai_response, re.DOTALL)
+    if not match:
+        return None
+    raw_json = json.loads(match.group(0))
+    # Умный маппинг (сопоставление полей)
+    return {
+        "company_name":
+        raw_json.get("company_name") or raw_json.get("sender_name")
+        or raw_json.get("company"),
+        "street":
+        raw_json.get("street") or raw_json.get("address"),
+        "postal_code":
+        raw_json.get("postal_code") or raw_json.get("zip")
+        or raw_json.get("plz"),
+        "city":
+        raw_json.get("city"),
+        "email":
+        raw_json.get("email") or raw_json.get("e-mail"),
+        "phone":
+        raw_json.get("phone") or raw_json.get("tel")
+        or raw_json.get("telefon"),
+        "tax_id":
+        raw_json.get("tax_id") or raw_json.get("ust_id")
+        or raw_json.get("steuernummer"),
+        "iban":
+        raw_json.get("iban")
+    }
+
+
+async def _call_claude(content, on_position):
+    limiter, bucket = _get_limits()
+    await limiter.acquire(on_position)
+    try:
+        await bucket.acquire()
+        async with metrics.timed("claude", "messages.create"):
+            response = await _get_client().messages.create(
+                model=os.getenv("OCR_MODEL", "claude-3-haiku-20240307"),
+                max_tokens=1024,
+                messages=[{
+                    "role": "user",
+                    "content": content
+                }])
+    finally:
+        limiter.release()
+    ai_response = response.content[0].text
+    logger.debug(f"Claude-Antwort: {ai_response}")
+    return parse_sender(ai_response)
+
+
+async def extract_sender(content, key, on_position=None):
+    """Schickt die Inhaltsblöcke an Claude und liefert die Absenderdaten.
+
+    `key` identifiziert den Inhalt (z. B. SHA-256 der Datei); läuft bereits
+    eine Anfrage mit gleichem Schlüssel, wird auf deren Ergebnis gewartet.
+    Wirft QueueFull, wenn die Warteschlange voll ist."""
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_call_claude(content, on_position))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    return await asyncio.shield(task)
+
+
+class NoText(Exception):
+    """PDF ohne Textebene (z. B. eingescannt)"""
+
+
+async def extract_from_pdf(source, key, on_position=None):
+    """Absenderdaten aus einem PDF (Bytes oder Pfad): zuerst lokal per
+    Regeln, Claude nur für fehlende Felder und nur mit dem relevanten
+    Textausschnitt"""
+    found, window = await workers.run_in_process(pdf_text.analyze, source)
+    if found is None:
+        raise NoText()
+    missing = [k for k in pdf_text.FIELDS if not found.get(k)]
+    if not missing:
+        return found
+    logger.info(f"PDF: lokal nicht gefunden: {', '.join(missing)}")
+    content = [{
+        "type": "text",
+        "text": PDF_PROMPT.format(fields=", ".join(missing), text=window)
+    }]
+    llm = await extract_sender(content, key, on_position)
+    for k in missing:
+        found[k] = (llm or {}).get(k)
+    return found
+
+
+async def extract_cached(file_unique_id, download, extract):
+    """Extraktion mit vorgeschaltetem Extraktions-Cache.
+
+    download() lädt die Datei (nur wenn die file_unique_id unbekannt ist)
+    und liefert einen downloads.Spool; extract(source, sha256) bekommt bei
+    einem Cache-Miss dessen Bytes bzw. Pfad und liefert das Ergebnis."""
+    cache = get_extraction_cache()
+    result = await cache.get_by_file_id(file_unique_id)
+    if result is not None:
+        return result
+
+    with await download() as spool:
+        sha256 = spool.sha256
+        result = await cache.get(sha256)
+        if result is None:
+            result = await extract(spool.source(), sha256)
+    # Nur Treffer speichern: ein Ergebnis, in dem jedes Feld None ist
+    # (z.B. nach einem vorübergehenden Fehler), soll beim nächsten Versuch
+    # neu extrahiert werden
+    if result and any(v for v in result.values()):
+        await cache.put(sha256, result, file_unique_id)
+    return result
@@ -0,0 +1,144 @@
+import io
+import os
+import re
+import mmap
+
+# Schneller, lokaler Weg für PDFs: Text nur aus den ersten Seiten lesen
+# und Absenderfelder mit festen Regeln suchen. Nur was hier nicht gefunden
+# wird, geht (mit einem kleinen Textausschnitt) an Claude.
+# Läuft in den Worker-Prozessen (workers.py).
+
+FIELDS = ("company_name", "street", "postal_code", "city", "email", "phone",
+          "tax_id", "iban")
+
+MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "2"))
+WINDOW_HEAD = 1500
+WINDOW_TAIL = 1000
+
+EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+IBAN_RE = re.compile(r"\b[A-Z]{2}\d{2}(?: ?[A-Z0-9]){11,30}\b")
+UST_ID_RE = re.compile(r"\bDE ?\d{3} ?\d{3} ?\d{3}\b")
+STEUERNR_RE = re.compile(r"\b\d{2,3}/\d{3,4}/\d{4,5}\b")
+PHONE_RE = re.compile(
+    r"(?:Tel(?:efon)?|Phone|Fon|Mobil)\.?\s*:?\s*(\+?\d[\d /()\-]{5,}\d)",
+    re.IGNORECASE)
+PLZ_CITY_RE = re.compile(
+    r"\b(\d{5})\s*[|,]?\s+([A-ZÄÖÜ][A-Za-zÄÖÜäöüß.\-]+(?: [A-ZÄÖÜ(][\w.()\-]*)*)"
+)
+STREET_RE = re.compile(
+    r"([A-ZÄÖÜ][\w.\- ]*?(?:stra(?:ß|ss)e|str\.|weg|allee|platz|gasse|ring|"
+    r"damm|ufer|chaussee|markt|steig|pfad)\s*\d+\s?[a-zA-Z]?)\b",
+    re.IGNORECASE)
+LEGAL_FORM_RE = re.compile(
+    r"^(.{2,60}?\b(?:GmbH(?: & Co\. KG)?|UG|AG|KG|OHG|GbR|e\. ?K\.|e\. ?V\.|"
+    r"mbH|Ltd\.?|Inc\.?|SE))\b", re.MULTILINE)
+RETURN_LINE_RE = re.compile(r"^(?:Abs(?:ender)?\.?:?\s*)?(.+?(?: [|·•–-] .+){2,})$",
+                            re.MULTILINE)
+
+
+def first_pages_text(data, max_pages=MAX_PAGES):
+    """Liest Text seitenweise und nur aus den ersten max_pages Seiten;
+    `data` sind Bytes oder ein lesbarer Stream (z.B. mmap)"""
+    import pypdf
+    stream = data if hasattr(data, "seek") else io.BytesIO(data)
+    reader = pypdf.PdfReader(stream)
+    pages = []
+    for i in range(min(max_pages, len(reader.pages))):
+        pages.append(reader.pages[i].extract_text() or "")
+        if i == 0 and pages[0].strip():
+            # Absenderdaten stehen auf Seite 1
+            break
+    return "\n".join(pages)
+
+
+# IBAN-Längen der häufigsten SEPA-Länder, um angehängten Text abzuschneiden
+IBAN_LENGTHS = {
+    "DE": 22, "AT": 20, "CH": 21, "LI": 21, "NL": 18, "BE": 16, "LU": 20,
+    "FR": 27, "IT": 27, "ES": 24, "PL": 28, "DK": 18, "CZ": 24, "GB": 22
+}
+
+
+def _iban_valid(iban):
+    digits = "".join(str(int(ch, 36)) for ch in iban[4:] + iban[:4])
+    return int(digits) % 97 == 1
+
+
+def _find_iban(text):
+    for match in IBAN_RE.finditer(text):
+        iban = match.group(0).replace(" ", "")
+        iban = iban[:IBAN_LENGTHS.get(iban[:2], len(iban))]
+        if 15 <= len(iban) <= 34 and _iban_valid(iban):
+            return iban
+    return None
+
+
+def _address(text):
+    """Straße, PLZ und Ort aus einem Textstück"""
+    result = {}
+    plz = PLZ_CITY_RE.search(text)
+    if plz:
+        result["postal_code"] = plz.group(1)
+        result["city"] = plz.group(2).strip()
+    street = STREET_RE.search(text)
+    if street:
+        result["street"] = street.group(1).strip()
+    return result
+
+
+def parse_sender_text(text):
+    """Sucht Absenderfelder per Regeln; nicht Gefundenes bleibt None.
+
+    Reihenfolge der Quellen: Absenderzeile über der Empfängeranschrift,
+    dann Fußzeile, dann der gesamte Text – so wird die Empfängeranschrift
+    nicht für den Absender gehalten."""
+    lines = [l.strip() for l in text.splitlines() if l.strip()]
+    footer = "\n".join(lines[int(len(lines) * 0.7):])
+    found = dict.fromkeys(FIELDS)
+
+    ret = RETURN_LINE_RE.search(text)
+    if ret:
+        parts = [p.strip() for p in re.split(r" [|·•–-] ", ret.group(1))]
+        found["company_name"] = parts[0]
+        found.update(_address("\n".join(parts[1:])))
+
+    for source in (footer, text):
+        for key, value in _address(source).items():
+            found[key] = found[key] or value
+        if not found["company_name"]:
+            legal = LEGAL_FORM_RE.search(source)
+            if legal:
+                found["company_name"] = legal.group(1).strip()
+        if not found["email"]:
+            email = EMAIL_RE.search(source)
+            found["email"] = email.group(0) if email else None
+        if not found["phone"]:
+            phone = PHONE_RE.search(source)
+            found["phone"] = phone.group(1).strip() if phone else None
+        if not found["tax_id"]:
+            tax = UST_ID_RE.search(source) or STEUERNR_RE.search(source)
+            found["tax_id"] = tax.group(0).replace(" ", "") if tax else None
+        if not found["iban"]:
+            found["iban"] = _find_iban(source)
+    return found
+
+
+def text_window(text):
+    """Briefkopf und Fußzeile der ersten Seite – dort steht der Absender"""
+    if len(text) <= WINDOW_HEAD + WINDOW_TAIL:
+        return text
+    return text[:WINDOW_HEAD] + "\n...\n" + text[-WINDOW_TAIL:]
+
+
+def analyze(source):
+    """PDF -> (gefundene Felder, Textausschnitt für Claude). `source` sind
+    die Bytes oder der Pfad einer großen Datei (downloads.Spool); diese wird
+    gemappt statt gelesen, pypdf holt nur die benötigten Teile"""
+    if isinstance(source, str):
+        with open(source, "rb") as f, mmap.mmap(f.fileno(), 0,
+                                                access=mmap.ACCESS_READ) as m:
+            text = first_pages_text(m)
+    else:
+        text = first_pages_text(source)
+    if not text.strip():
+        return None, ""
+    return parse_sender_text(text), text_window(text)
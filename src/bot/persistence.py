@@ -0,0 +1,318 @@
+import os
+import abc
+import json
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import BasePersistence, ConversationHandler, PersistenceInput
+from telegram.ext._conversationhandler import PendingState
+
+# Persistenz der ConversationHandler-Zustände (z. B. SETTINGS_MENU /
+# WAITING_FOR_DOC), damit ein Neustart niemanden mitten im Ablauf verliert.
+#
+# FilePersistence (eine Instanz): Die Application meldet geänderte Zustände
+# gesammelt alle PERSISTENCE_INTERVAL Sekunden; alle Änderungen eines
+# Durchlaufs gehen in einem Schreibvorgang in die Datei. Gelesen wird nur
+# beim Start.
+#
+# RedisPersistence (mehrere Bot-Instanzen hinter dem Webhook): Ein Nutzer
+# kann mit jedem Update bei einer anderen Instanz landen. Der
+# SharedConversationHandler liest deshalb vor jedem Update den Zustand
+# dieses einen Nutzers aus Redis und schreibt ihn danach sofort zurück,
+# aber nur, wenn er sich geändert hat (im Einstellungsdialog wenige Male
+# pro Ablauf). Beides läuft im PerUserUpdateProcessor unter der Sperre des
+# Nutzers; die gesammelten Meldungen der Application braucht es dann
+# nicht. Schlägt ein Schreibvorgang fehl, bleiben die Schlüssel vorgemerkt
+# und werden nach PERSISTENCE_INTERVAL Sekunden erneut geschrieben.
+logger = logging.getLogger(__name__)
+
+
+def _encode_key(key):
+    return json.dumps(list(key))
+
+
+def _decode_key(raw):
+    return tuple(json.loads(raw))
+
+
+class ConversationPersistence(BasePersistence):
+    """Speichert nur Gesprächszustände; Schreibvorgänge werden gebündelt"""
+
+    def __init__(self, update_interval=5):
+        super().__init__(store_data=PersistenceInput(bot_data=False,
+                                                     chat_data=False,
+                                                     user_data=False,
+                                                     callback_data=False),
+                         update_interval=update_interval)
+        self._pending = {}
+        self._flush_task = None
+
+    @abc.abstractmethod
+    async def _load(self, name):
+        """Alle gespeicherten Zustände eines ConversationHandlers"""
+
+    @abc.abstractmethod
+    async def _store(self, batch):
+        """batch: {name: {key: state oder None (= löschen)}}"""
+
+    async def get_conversations(self, name):
+        return await self._load(name)
+
+    async def update_conversation(self, name, key, new_state):
+        self._pending.setdefault(name, {})[key] = new_state
+        if self._flush_task is None or self._flush_task.done():
+            # Alle Aufrufe dieses Durchlaufs abwarten, dann einmal schreiben
+            self._flush_task = asyncio.create_task(self._write_pending())
+
+    def _requeue(self, batch):
+        # Neuere Werte aus der Zwischenzeit gewinnen
+        for name, states in batch.items():
+            pending = self._pending.setdefault(name, {})
+            for key, state in states.items():
+                pending.setdefault(key, state)
+
+    async def _write_pending(self, retry=True):
+        await asyncio.sleep(0)
+        # Auch Änderungen, die während des Schreibens kommen, mitnehmen
+        while self._pending:
+            batch, self._pending = self._pending, {}
+            try:
+                await self._store(batch)
+            except asyncio.CancelledError:
+                self._requeue(batch)
+                raise
+            except Exception as e:
+                self._requeue(batch)
+                if not retry:
+                    logger.error(f"Gesprächszustände nicht gespeichert: {e}")
+                    return
+                logger.error(f"Gesprächszustände nicht gespeichert, neuer "
+                             f"Versuch in {self.update_interval:.0f}s: {e}")
+                await asyncio.sleep(self.update_interval)
+
+    async def flush(self):
+        task = self._flush_task
+        if task is not None and not task.done():
+            # Laufende Wiederholungen nicht abwarten, nur ein letzter Versuch
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await self._write_pending(retry=False)
+
+    # Nicht genutzte Datenarten
+    async def get_bot_data(self):
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_user_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_user_data(self, user_id, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def drop_user_data(self, user_id):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+
+class RedisPersistence(ConversationPersistence):
+    """Ein Redis-Hash pro ConversationHandler: conv:<name> -> {key: state};
+    gelesen und geschrieben wird je Nutzer (SharedConversationHandler)"""
+
+    shared = True
+
+    def __init__(self, redis_url, update_interval=5):
+        super().__init__(update_interval)
+        import redis.asyncio as redis
+        self._redis = redis.from_url(redis_url)
+
+    async def _load(self, name):
+        # Zustände kommen je Update aus Redis, nicht alle beim Start
+        return {}
+
+    async def _store(self, batch):
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for name, states in batch.items():
+                for key, state in states.items():
+                    if state is None:
+                        pipe.hdel(f"conv:{name}", _encode_key(key))
+                    else:
+                        pipe.hset(f"conv:{name}", _encode_key(key),
+                                  json.dumps(state))
+            await pipe.execute()
+
+    async def read_state(self, name, key):
+        raw = await self._redis.hget(f"conv:{name}", _encode_key(key))
+        return None if raw is None else json.loads(raw)
+
+    async def write_state(self, name, key, state):
+        """Schreibt sofort; bei einem Fehler übernimmt die gesammelte
+        Wiederholung"""
+        try:
+            await self._store({name: {key: state}})
+        except Exception as e:
+            logger.warning(f"Gesprächszustand nicht gespeichert: {e}")
+            await super().update_conversation(name, key, state)
+
+    async def update_conversation(self, name, key, new_state):
+        # Geschrieben wird gleich nach dem Update (write_state); ein
+        # späterer Sammelaufruf könnte den neueren Stand einer anderen
+        # Instanz überschreiben
+        pass
+
+    async def flush(self):
+        await super().flush()
+        await self._redis.aclose()
+
+
+class SharedConversationHandler(ConversationHandler):
+    """ConversationHandler, dessen Zustände sich mehrere Bot-Instanzen
+    teilen (mit RedisPersistence als `store`, sonst wie gewohnt).
+    PerUserUpdateProcessor ruft pull vor und push nach jedem Update."""
+
+    def __init__(self, *args, store=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.store = store if getattr(store, "shared", False) else None
+        self._writes = set()
+
+    def _key_for(self, update):
+        if (self.store is None or not isinstance(update, Update)
+                or update.effective_chat is None
+                or update.effective_user is None):
+            return None
+        try:
+            return self._get_key(update)
+        except RuntimeError:
+            return None
+
+    async def pull(self, update):
+        """Holt den Zustand aus Redis; liefert (key, zustand) für push"""
+        key = self._key_for(update)
+        # Ein hier noch laufender Handler (block=False) hat Vorrang
+        if key is None or isinstance(self._conversations.get(key),
+                                     PendingState):
+            return None
+        try:
+            state = await self.store.read_state(self.name, key)
+        except Exception as e:
+            logger.warning(f"Gesprächszustand nicht gelesen: {e}")
+            return None
+        if state is None:
+            self._conversations.pop(key, None)
+        else:
+            self._conversations[key] = state
+        return key, state
+
+    async def push(self, pulled):
+        """Schreibt den Zustand nach dem Update zurück, falls geändert"""
+        if pulled is None:
+            return
+        key, before = pulled
+        state = self._conversations.get(key)
+        if isinstance(state, PendingState):
+            # Bis der Handler fertig ist, gilt der alte Zustand
+            state.task.add_done_callback(
+                lambda _, pending=state: self._write_later(key, pending))
+            state = state.old_state
+        if state != before:
+            await self.store.write_state(self.name, key, state)
+
+    def _write_later(self, key, pending):
+        state = (pending.old_state
+                 if pending.task.cancelled() else pending.resolve())
+        if state == self.END:
+            state = None
+        task = asyncio.get_running_loop().create_task(
+            self.store.write_state(self.name, key, state))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+
+class FilePersistence(ConversationPersistence):
+    """Fallback ohne Redis: alle Zustände als JSON-Datei (atomar ersetzt)"""
+
+    def __init__(self, path, update_interval=5):
+        super().__init__(update_interval)
+        self.path = path
+        self._data = None
+
+    def _read(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                raw = json.load(f)
+        except FileNotFoundError:
+            return {}
+        return {
+            name: {_decode_key(k): v
+                   for k, v in states.items()}
+            for name, states in raw.items()
+        }
+
+    def _write(self, data):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    name: {_encode_key(k): v
+                           for k, v in states.items()}
+                    for name, states in data.items()
+                }, f)
+        os.replace(tmp, self.path)
+
+    async def _load(self, name):
+        if self._data is None:
+            self._data = await asyncio.to_thread(self._read)
+        return dict(self._data.get(name, {}))
+
+    async def _store(self, batch):
+        if self._data is None:
+            self._data = await asyncio.to_thread(self._read)
+        for name, states in batch.items():
+            conv = self._data.setdefault(name, {})
+            for key, state in states.items():
+                if state is None:
+                    conv.pop(key, None)
+                else:
+                    conv[key] = state
+        snapshot = {name: dict(states) for name, states in self._data.items()}
+        await asyncio.to_thread(self._write, snapshot)
+
+
+def build_persistence():
+    """PERSISTENCE=redis|file|none; ohne Angabe Redis, falls REDIS_URL gesetzt"""
+    kind = os.getenv("PERSISTENCE") or ("redis"
+                                        if os.getenv("REDIS_URL") else "file")
+    interval = float(os.getenv("PERSISTENCE_INTERVAL", "5"))
+    if kind == "redis":
+        return RedisPersistence(os.getenv("REDIS_URL"), interval)
+    if kind == "file":
+        return FilePersistence(
+            os.path.join(os.getenv("DATA_DIR", "data"), "conversations.json"),
+            interval)
+    return None
@@ -0,0 +1,198 @@
+import os
+import hmac
+import json
+import time
+import base64
+import struct
+import hashlib
+import logging
+import urllib.parse
+from functools import lru_cache
+
+from cache import ProfileCache, TTLCache
+
+# Vorbelegung der WebApps (settings.html, create_invoice.html) über ein
+# kurzes, signiertes Token statt der kompletten Profildaten als Base64-JSON
+# in der URL. Das Token enthält nur (Nutzer, Art, Version) + HMAC; die
+# Daten holt die Seite per GET /prefill/<token> vom Bot (server.py) und
+# weist sich dabei mit Telegram-initData aus. IBAN und Steuernummer
+# landen so weder in URLs noch in Logs. Die URL wird pro Datenversion
+# einmal gebaut und wiederverwendet.
+#
+# Ohne PREFILL_BASE_URL (kein öffentlich erreichbarer HTTP-Server) bleibt
+# es beim bisherigen ?data=-Parameter; dann stehen IBAN und Steuernummer
+# wieder in der URL, worauf einmalig eine Warnung im Log hinweist.
+
+logger = logging.getLogger(__name__)
+
+KINDS = {"settings": 1, "invoice": 2, "extract": 3}
+_KIND_NAMES = {v: k for k, v in KINDS.items()}
+
+_PAYLOAD = struct.Struct(">qB8s")
+_SIG_LEN = 12
+
+_snapshots = None
+_issued = TTLCache(maxsize=10000, ttl=600)
+_legacy_warned = False
+
+
+def base_url():
+    return os.getenv("PREFILL_BASE_URL", "").rstrip("/")
+
+
+@lru_cache(maxsize=1)
+def _secret():
+    secret = os.getenv("PREFILL_SECRET")
+    if secret:
+        return secret.encode()
+    return hmac.new(b"prefill", os.getenv("TELEGRAM_BOT_TOKEN", "").encode(),
+                    hashlib.sha256).digest()
+
+
+def _b64(raw):
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def version(data):
+    """8 Byte Hash über die Daten; ändert sich mit jeder Profiländerung"""
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"),
+                           default=str)
+    return hashlib.sha256(canonical.encode()).digest()[:8]
+
+
+def make_token(user_id, kind, ver):
+    payload = _PAYLOAD.pack(user_id, KINDS[kind], ver)
+    sig = hmac.new(_secret(), payload, hashlib.sha256).digest()[:_SIG_LEN]
+    return _b64(payload + sig)
+
+
+def parse_token(token):
+    """(user_id, kind, version) oder None bei ungültiger Signatur"""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    except ValueError:
+        return None
+    if len(raw) != _PAYLOAD.size + _SIG_LEN:
+        return None
+    payload, sig = raw[:_PAYLOAD.size], raw[_PAYLOAD.size:]
+    expected = hmac.new(_secret(), payload, hashlib.sha256).digest()[:_SIG_LEN]
+    if not hmac.compare_digest(sig, expected):
+        return None
+    user_id, kind, ver = _PAYLOAD.unpack(payload)
+    if kind not in _KIND_NAMES:
+        return None
+    return user_id, _KIND_NAMES[kind], ver
+
+
+def verify_init_data(init_data, max_age=None):
+    """Prüft Telegram-WebApp-initData; liefert die Nutzer-ID oder None"""
+    if not init_data:
+        return None
+    fields = dict(urllib.parse.parse_qsl(init_data))
+    received = fields.pop("hash", "")
+    check = "\n".join(f"{k}={v}" for k, v in sorted(fields.items()))
+    key = hmac.new(b"WebAppData", os.getenv("TELEGRAM_BOT_TOKEN", "").encode(),
+                   hashlib.sha256).digest()
+    expected = hmac.new(key, check.encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(received, expected):
+        return None
+    max_age = max_age or float(os.getenv("PREFILL_MAX_AGE", "86400"))
+    if time.time() - int(fields.get("auth_date", 0)) > max_age:
+        return None
+    try:
+        return json.loads(fields["user"])["id"]
+    except (KeyError, ValueError, TypeError):
+        return None
+
+
+# --- DATEN FÜR DIE SEITEN ---
+
+
+def settings_data(p):
+    """Felder von settings.html aus der Profilzeile"""
+    return {
+        "company_name": p.get("company_name"),
+        "street": p.get("street"),
+        "postal_code": p.get("zip"),
+        "city": p.get("city"),
+        "email": p.get("email"),
+        "phone": p.get("phone"),
+        "tax_id": p.get("tax_id"),
+        "iban": p.get("iban")
+    }
+
+
+def invoice_data(p):
+    """Absenderdaten für create_invoice.html aus der Profilzeile"""
+    return {
+        "sender_name": p.get("company_name"),
+        "sender_address": f"{p.get('street')}, {p.get('zip')} {p.get('city')}",
+        "sender_email": p.get("email"),
+        "sender_iban": p.get("iban"),
+        "sender_tax_id": p.get("tax_id")
+    }
+
+
+PROFILE_VIEWS = {"settings": settings_data, "invoice": invoice_data}
+
+
+def get_snapshots():
+    """Kurzlebige Schnappschüsse für Daten ohne Profilzeile (OCR-Ergebnis)"""
+    global _snapshots
+    if _snapshots is None:
+        _snapshots = ProfileCache(
+            maxsize=int(os.getenv("PREFILL_SNAPSHOTS", "10000")),
+            ttl=float(os.getenv("PREFILL_TTL", "3600")),
+            redis_url=os.getenv("REDIS_URL") or None,
+            prefix="prefill")
+    return _snapshots
+
+
+# --- URLS ---
+
+
+@lru_cache(maxsize=4096)
+def _legacy_url(page_url, canonical):
+    encoded = base64.urlsafe_b64encode(canonical.encode()).decode().strip("=")
+    return f"{page_url}?data={urllib.parse.quote(encoded)}"
+
+
+@lru_cache(maxsize=4096)
+def _token_url(page_url, api, user_id, kind, ver):
+    return (f"{page_url}?t={make_token(user_id, kind, ver)}"
+            f"&api={urllib.parse.quote(api, safe='')}")
+
+
+async def build_url(page_url, user_id, kind, data):
+    """URL der WebApp mit Vorbelegung `data` (einmal pro Datenversion)"""
+    global _legacy_warned
+    api = base_url()
+    if not api:
+        if not _legacy_warned:
+            _legacy_warned = True
+            logger.warning("PREFILL_BASE_URL fehlt: WebApp-Daten (inkl. "
+                           "IBAN und Steuernummer) gehen als ?data= in der "
+                           "URL mit")
+        return _legacy_url(page_url, json.dumps(data, default=str))
+    ver = version(data)
+    if kind == "extract" and _issued.get((user_id, ver)) is None:
+        await get_snapshots().set(f"{user_id}:{ver.hex()}", data)
+        _issued.set((user_id, ver), True)
+    return _token_url(page_url, api, user_id, kind, ver)
+
+
+async def resolve(token, init_data, get_profile):
+    """Daten zu einem Token, falls es gültig ist und zum WebApp-Nutzer gehört.
+
+    Profil-Arten werden frisch aus der (gecachten) Profilzeile erzeugt,
+    damit eine alte Tastatur nie ein leeres Formular liefert."""
+    parsed = parse_token(token)
+    if parsed is None:
+        return None
+    user_id, kind, ver = parsed
+    if verify_init_data(init_data) != user_id:
+        return None
+    if kind in PROFILE_VIEWS:
+        profile = await get_profile(user_id)
+        return PROFILE_VIEWS[kind](profile) if profile else {}
+    return await get_snapshots().get(f"{user_id}:{ver.hex()}")
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+# Bausteine zur Begrenzung von Last: Token-Bucket für Raten und ein
+# fairer Limiter mit Warteschlange, der Wartenden ihre Position meldet.
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Die Warteschlange ist voll – Anfrage sofort ablehnen"""
+
+
+class TokenBucket:
+    """Token-Bucket: im Mittel `rate` Tokens pro Sekunde, Spitzen bis `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    def wait_time(self, tokens=1):
+        """Sekunden, bis `tokens` verfügbar sind (0 = sofort)"""
+        self._refill()
+        return max(0.0, (tokens - self._tokens) / self.rate)
+
+    async def acquire(self, tokens=1):
+        # Lock sorgt für FIFO-Reihenfolge unter den Wartenden
+        async with self._lock:
+            while not self.try_acquire(tokens):
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+class _Waiter:
+    __slots__ = ("fut", "on_position", "position", "reported", "task")
+
+    def __init__(self, fut, on_position):
+        self.fut = fut
+        self.on_position = on_position
+        self.position = self.reported = 0
+        self.task = None
+
+
+class FairLimiter:
+    """Begrenzt parallele Ausführungen; Wartende stehen in einer FIFO-Schlange
+    mit Maximalgröße und bekommen Positionsänderungen über on_position(n) mit"""
+
+    def __init__(self, concurrency, max_queue):
+        self.max_queue = max_queue
+        self._free = concurrency
+        self._waiters = deque()
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    def _notify(self, waiter, position):
+        waiter.position = position
+        if waiter.on_position is not None and (waiter.task is None
+                                               or waiter.task.done()):
+            waiter.task = asyncio.create_task(self._report(waiter))
+
+    @staticmethod
+    async def _report(waiter):
+        # Pro Wartendem höchstens eine Meldung gleichzeitig, immer die neueste
+        while waiter.reported != waiter.position and not waiter.fut.done():
+            position = waiter.position
+            try:
+                await waiter.on_position(position)
+            except Exception as e:
+                logger.debug(f"Positionsmeldung fehlgeschlagen: {e}")
+            waiter.reported = position
+
+    async def acquire(self, on_position=None):
+        if self._free > 0 and not self._waiters:
+            self._free -= 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise QueueFull(len(self._waiters))
+        waiter = _Waiter(asyncio.get_running_loop().create_future(),
+                         on_position)
+        self._waiters.append(waiter)
+        self._notify(waiter, len(self._waiters))
+        try:
+            await waiter.fut
+        except asyncio.CancelledError:
+            if waiter.fut.done() and not waiter.fut.cancelled():
+                # Platz wurde uns schon übergeben – weiterreichen
+                self.release()
+            else:
+                self._waiters.remove(waiter)
+                self._renumber()
+            raise
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.fut.done():
+                waiter.fut.set_result(None)
+                self._renumber()
+                return
+        self._free += 1
+
+    def _renumber(self):
+        for position, waiter in enumerate(self._waiters, 1):
+            if waiter.position != position:
+                self._notify(waiter, position)
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, *exc):
+        self.release()
@@ -0,0 +1,428 @@
+import os
+import time
+import asyncio
+import logging
+import calendar
+import datetime
+
+from telegram import InputFile
+
+import db
+import mailer
+import metrics
+import numbering
+import resilience
+import send_limiter
+import totals
+import workers
+from invoice_pdf import fmt_eur, render_batch
+from invoice_writer import idempotency_key, invoice_row, upsert_rows
+
+# Wiederkehrende Rechnungen (sql/004): Vorlagen mit Zeitplan monthly,
+# quarterly oder cron. Statt eines Timers je Vorlage läuft ein Job der
+# JobQueue (main.build_application) alle RECURRING_INTERVAL Sekunden und
+# holt die fälligen Vorlagen blockweise mit einer Abfrage über den
+# Teilindex auf next_run_at. Je Block: Nummern (numbering.py, gebündelt je
+# Nutzer) und ein Bulk-Insert der Rechnungen; gerendert wird blockweise im
+# Prozess-Pool und über den Bulk-Kanal des SendLimiters zugestellt,
+# während schon der nächste Block erzeugt wird. Danach setzt ein Aufruf
+# die neuen Termine des Blocks. Der Idempotenz-Schlüssel hängt an Vorlage
+# und Termin: bricht ein Durchlauf ab, bekommt die Wiederholung nach
+# RECURRING_LEASE Sekunden dieselben Nummern und keine doppelten
+# Rechnungen. Lehnt die Datenbank einzelne Rechnungen ab, werden nur deren
+# Vorlagen stillgelegt; der Rest des Blocks läuft weiter.
+#
+# Cron-Zeitpläne müssen mindestens MIN_CRON_INTERVAL zwischen zwei
+# Terminen lassen, sonst ginge z.B. mit "* * * * *" jede Minute eine
+# Rechnung an den Kunden. Geprüft wird einmal beim Anlegen über alle
+# Termine eines Jahres (CRON_CHECK_SPAN), nicht nur die nächsten zwei:
+# "0 0,12 * * 1" lässt von Montag 06:00 aus 6,5 Tage zwischen den nächsten
+# beiden Terminen, ist danach aber jeden Montag zweimal fällig. Der Job
+# prüft den Abstand nicht erneut. Vorlagen legt der Bot nur an, wenn der Job
+# tatsächlich eingeplant ist (available()); sonst bietet das Formular die
+# Wiederholung gar nicht an.
+
+logger = logging.getLogger(__name__)
+
+SCHEDULES = ("monthly", "quarterly", "cron")
+MONTHS = {"monthly": 1, "quarterly": 3}
+# Felder des Formulars, die zur Vorlage gehören und nicht zur Rechnung
+SCHEDULE_FIELDS = ("recurrence", "cron", "invoice_number")
+
+INTERVAL = float(os.getenv("RECURRING_INTERVAL", "60"))
+BATCH_SIZE = int(os.getenv("RECURRING_BATCH_SIZE", "500"))
+LEASE_SECONDS = int(os.getenv("RECURRING_LEASE", "900"))
+RUN_HOUR = int(os.getenv("RECURRING_RUN_HOUR", "6"))
+RENDER_BATCH = int(os.getenv("RECURRING_RENDER_BATCH", "50"))
+SEND_CONCURRENCY = int(os.getenv("RECURRING_SEND_CONCURRENCY", "32"))
+# Mehr gleichzeitige Anfragen als Verbindungen im Pool stehen nur in der
+# Warteschlange von httpx, deren Zuteilung mit ihrer Länge teurer wird
+DB_CONCURRENCY = int(os.getenv("DB_POOL_SIZE", "20"))
+MIN_CRON_INTERVAL = datetime.timedelta(days=1)
+# Ein voller Zyklus jedes Cron-Ausdrucks (Schaltjahre bleiben außen vor)
+CRON_CHECK_SPAN = datetime.timedelta(days=366)
+
+created_total = metrics.Counter("bot_recurring_invoices_total",
+                                "Aus Vorlagen erzeugte Rechnungen")
+
+_task = None
+_scheduled = False
+
+
+def enabled():
+    return os.getenv("RECURRING_ENABLED", "1") == "1"
+
+
+def available():
+    """True, wenn der Job eingeplant ist und Vorlagen also abgearbeitet
+    werden"""
+    return _scheduled
+
+
+def register(job_queue):
+    """Plant den Job ein (main.build_application); liefert False ohne
+    JobQueue"""
+    global _scheduled
+    if job_queue is None:
+        logger.warning("JobQueue fehlt (python-telegram-bot[job-queue]), "
+                       "keine wiederkehrenden Rechnungen")
+        return False
+    job_queue.run_repeating(tick,
+                            interval=INTERVAL,
+                            first=INTERVAL,
+                            name="recurring")
+    _scheduled = True
+    return True
+
+
+def _croniter():
+    try:
+        from croniter import croniter
+    except ImportError:
+        raise ValueError("Cron-Zeitpläne sind nicht installiert (croniter)")
+    return croniter
+
+
+def add_months(day, months, anchor_day):
+    """Datum `months` Monate nach `day` am Tag `anchor_day`, gekürzt auf
+    das Monatsende (31. -> 28./29.02. -> 31.03.)"""
+    month = day.month - 1 + months
+    year, month = day.year + month // 12, month % 12 + 1
+    return datetime.date(year, month,
+                         min(anchor_day, calendar.monthrange(year, month)[1]))
+
+
+def _at_run_hour(day):
+    return datetime.datetime.combine(day, datetime.time(RUN_HOUR),
+                                     tzinfo=datetime.timezone.utc)
+
+
+def next_run(schedule, after, cron=None, anchor_day=None):
+    """Nächster Termin nach `after` (datetime in UTC); wirft ValueError bei
+    unbekanntem Zeitplan oder ungültigem Cron-Ausdruck"""
+    if schedule in MONTHS:
+        return _at_run_hour(
+            add_months(after.date(), MONTHS[schedule], anchor_day
+                       or after.day))
+    if schedule == "cron":
+        croniter = _croniter()
+        if not cron or not croniter.is_valid(cron):
+            raise ValueError(f"ungültiger Cron-Ausdruck: {cron!r}")
+        return croniter(cron, after).get_next(datetime.datetime)
+    raise ValueError(f"unbekannter Zeitplan: {schedule!r}")
+
+
+def check_cron(cron, start):
+    """Wirft ValueError, wenn zwei Termine innerhalb von CRON_CHECK_SPAN
+    nach `start` weniger als MIN_CRON_INTERVAL auseinanderliegen"""
+    previous = next_run("cron", start, cron)
+    runs = _croniter()(cron, previous)
+    while previous - start < CRON_CHECK_SPAN:
+        upcoming = runs.get_next(datetime.datetime)
+        if upcoming - previous < MIN_CRON_INTERVAL:
+            raise ValueError(f"Cron-Ausdruck {cron!r} zu häufig: zwischen "
+                             f"zwei Rechnungen muss mindestens ein Tag "
+                             f"liegen")
+        previous = upcoming
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+async def create(user_id, inv, key, now=None):
+    """Legt zur gerade erstellten Rechnung `inv` die Vorlage an (Felder
+    recurrence und cron aus dem Formular) und liefert den ersten Termin;
+    wirft ValueError bei ungültigem Zeitplan"""
+    schedule = inv.get("recurrence")
+    cron = (inv.get("cron") or "").strip() or None
+    now = now or _now()
+    try:
+        start = datetime.date.fromisoformat(str(inv.get("date")))
+    except ValueError:
+        start = now.date()
+    if schedule in MONTHS:
+        anchor_day = start.day
+        first = next_run(schedule, _at_run_hour(start), anchor_day=anchor_day)
+    else:
+        anchor_day = None
+        first = next_run(schedule, now, cron)
+        if schedule == "cron":
+            check_cron(cron, now)
+    # Rückdatierte Rechnung: Termine vor heute nicht nachholen
+    while first <= now:
+        first = next_run(schedule, first, cron, anchor_day)
+    await db.insert_recurring({
+        "user_id": user_id,
+        "invoice_data": {
+            k: v
+            for k, v in inv.items() if k not in SCHEDULE_FIELDS
+        },
+        "schedule": schedule,
+        "cron": cron if schedule == "cron" else None,
+        "anchor_day": anchor_day,
+        "next_run_at": first.isoformat(),
+        "idempotency_key": key
+    })
+    return first
+
+
+# --- DURCHLAUF ---
+
+def _deactivate(template, reason):
+    logger.warning(f"Vorlage {template['id']} deaktiviert: {reason}")
+    return {
+        "id": template["id"],
+        "next_run_at": template["next_run_at"],
+        "last_run_at": template.get("last_run_at"),
+        "active": False
+    }
+
+
+async def _generate(templates):
+    """Nummern und Bulk-Insert für einen Block fälliger Vorlagen; liefert
+    die erzeugten Rechnungen [(user_id, inv, summen, schlüssel, profil)]
+    und die neuen Termine für db.advance_recurring"""
+    jobs, runs = [], []
+    for t in templates:
+        run_at = datetime.datetime.fromisoformat(t["next_run_at"])
+        inv = {**t["invoice_data"], "date": run_at.date().isoformat()}
+        try:
+            result = totals.compute_invoice(inv)
+            upcoming = next_run(t["schedule"], run_at, t.get("cron"),
+                                t.get("anchor_day"))
+        except ValueError as e:
+            # Kaputte Vorlage stilllegen statt sie bei jedem Durchlauf
+            # erneut zu holen
+            runs.append(_deactivate(t, e))
+            continue
+        key = idempotency_key(t["user_id"], {
+            "recurring_id": t["id"],
+            "run_at": run_at.isoformat()
+        })
+        jobs.append((t, run_at, upcoming, inv, result, key))
+
+    allocator = numbering.get_allocator()
+    semaphore = asyncio.Semaphore(DB_CONCURRENCY)
+
+    async def number_for(user_id, inv, key):
+        async with semaphore:
+            return await allocator.number_for(user_id, inv, key)
+
+    numbers = await asyncio.gather(*(number_for(t["user_id"], inv, key)
+                                     for t, _, _, inv, _, key in jobs),
+                                   return_exceptions=True)
+    # Profil gehört als Snapshot in die Rechnung (sql/005); ohne Profile
+    # bleibt der Block gesperrt und kommt nach Ablauf der Sperre erneut
+    profiles = await db.get_profiles(
+        list(dict.fromkeys(t["user_id"] for t, *_ in jobs)))
+    made = []
+    for (t, run_at, upcoming, inv, result, key), number in zip(jobs, numbers):
+        if isinstance(number, BaseException):
+            # Bleibt bis locked_until gesperrt und kommt dann erneut
+            logger.warning(f"Keine Rechnungsnummer für Vorlage {t['id']}: "
+                           f"{number}")
+            continue
+        inv = {**inv, "invoice_number": number}
+        profile = profiles.get(t["user_id"])
+        row = {
+            **invoice_row(t["user_id"], inv, result, key, profile),
+            "recurring_id": t["id"]
+        }
+        made.append((t, run_at, upcoming, row, (t["user_id"], inv, result,
+                                                key, profile)))
+
+    transient, rejected = set(), set()
+    if made:
+        # Einzelne abgelehnte Zeilen reißen den Block nicht mit
+        failed = await upsert_rows([row for _, _, _, row, _ in made])
+        transient, rejected = ({row["idempotency_key"]
+                                for row in rows} for rows in failed)
+    invoices = []
+    for t, run_at, upcoming, row, invoice in made:
+        key = row["idempotency_key"]
+        if key in transient:
+            # Bleibt bis locked_until gesperrt und kommt dann erneut
+            continue
+        if key in rejected:
+            # Würde bei jedem Durchlauf erneut abgelehnt
+            runs.append(_deactivate(t, "Rechnung von der Datenbank "
+                                    "abgelehnt"))
+            continue
+        runs.append({
+            "id": t["id"],
+            "next_run_at": upcoming.isoformat(),
+            "last_run_at": run_at.isoformat(),
+            "active": True
+        })
+        invoices.append(invoice)
+    created_total.inc(len(invoices))
+    return invoices, runs
+
+
+async def _mail(profile, inv, pdf_bytes, filename, total_text, key):
+    try:
+        message = mailer.invoice_message(profile, inv, pdf_bytes, filename,
+                                         total_text)
+    except ValueError as e:
+        logger.warning(f"E-Mail nicht möglich ({inv['invoice_number']}): {e}")
+        return
+    delivered = await mailer.get_mailer().submit(message)
+    try:
+        await db.set_invoice_status(key,
+                                    "sent" if delivered else "mail_failed")
+    except Exception as e:
+        logger.warning(f"Versandstatus nicht gespeichert: {e}")
+
+
+async def _deliver(bot, invoices, runs):
+    """Rendert die Rechnungen blockweise im Prozess-Pool, schickt sie den
+    Nutzern (Bulk-Kanal) und ggf. per E-Mail an die Kunden; danach werden
+    die Vorlagen weitergeschaltet"""
+    if invoices:
+        await _send_all(bot, invoices)
+    # Erst nach der Zustellung: bricht der Durchlauf vorher ab, kommen
+    # die Vorlagen nach RECURRING_LEASE erneut (gleiche Schlüssel, also
+    # keine doppelten Rechnungen, höchstens eine doppelte Nachricht)
+    try:
+        await db.advance_recurring(runs)
+    except Exception as e:
+        logger.warning(f"{len(runs)} Vorlage(n) nicht weitergeschaltet, "
+                       f"Wiederholung nach Ablauf der Sperre: {e}")
+
+
+async def _send_all(bot, invoices):
+    for user_id in dict.fromkeys(i[0] for i in invoices if i[4] is None):
+        logger.warning(f"Kein Profil für Nutzer {user_id}, "
+                       "wiederkehrende Rechnung nicht zugestellt")
+    invoices = [i for i in invoices if i[4] is not None]
+    jobs = [(profile, inv) for _, inv, _, _, profile in invoices]
+    batches = [
+        jobs[i:i + RENDER_BATCH] for i in range(0, len(jobs), RENDER_BATCH)
+    ]
+    results = await asyncio.gather(*(workers.run_in_process(
+        render_batch, batch) for batch in batches),
+                                   return_exceptions=True)
+    pdfs = []
+    for batch, result in zip(batches, results):
+        if isinstance(result, BaseException):
+            logger.error(f"PDF-Fehler bei wiederkehrenden Rechnungen: "
+                         f"{result}")
+            result = [None] * len(batch)
+        pdfs.extend(result)
+
+    semaphore = asyncio.Semaphore(SEND_CONCURRENCY)
+    mail = mailer.enabled()
+
+    async def send(user_id, inv, result, key, profile, pdf_bytes):
+        filename = f"Rechnung_{inv['invoice_number']}.pdf"
+        total_text = fmt_eur(totals.to_euro(result.gross))
+        async with semaphore:
+            try:
+                await bot.send_document(
+                    chat_id=user_id,
+                    document=InputFile(pdf_bytes, filename=filename),
+                    caption=(f"🔁 Wiederkehrende Rechnung "
+                             f"{inv['invoice_number']} für "
+                             f"{inv.get('client_name')} über {total_text}"),
+                    rate_limit_args=send_limiter.lane(bot,
+                                                      send_limiter.BULK))
+            except Exception as e:
+                logger.warning(f"Rechnung {inv['invoice_number']} nicht an "
+                               f"{user_id} zugestellt: {e}")
+        if mail and inv.get("client_email"):
+            await _mail(profile, inv, pdf_bytes, filename, total_text, key)
+
+    await asyncio.gather(*(send(*invoice, pdf)
+                           for invoice, pdf in zip(invoices, pdfs)
+                           if pdf is not None))
+
+
+async def run_due(bot):
+    """Arbeitet alle fälligen Vorlagen blockweise ab; liefert die Anzahl
+    erzeugter Rechnungen"""
+    count = 0
+    delivery = None
+    try:
+        while True:
+            templates = await db.claim_recurring(_now(), BATCH_SIZE,
+                                                 LEASE_SECONDS)
+            invoices, runs = await _generate(templates)
+            count += len(invoices)
+            # Der vorige Block wurde zugestellt, während dieser entstand
+            if delivery is not None:
+                await delivery
+                delivery = None
+            if runs:
+                delivery = asyncio.create_task(_deliver(bot, invoices, runs))
+            if len(templates) < BATCH_SIZE:
+                break
+        if delivery is not None:
+            await delivery
+    except asyncio.CancelledError:
+        if delivery is not None:
+            delivery.cancel()
+        raise
+    except Exception:
+        # Bereits gespeicherte Rechnungen noch zustellen
+        if delivery is not None and not delivery.done():
+            await delivery
+        raise
+    return count
+
+
+async def _run(bot):
+    start = time.perf_counter()
+    try:
+        count = await run_due(bot)
+    except resilience.Unavailable as e:
+        logger.warning(f"Wiederkehrende Rechnungen: Datenbank nicht "
+                       f"erreichbar: {e}")
+        return
+    except Exception as e:
+        logger.error(f"Fehler bei wiederkehrenden Rechnungen: {e}")
+        return
+    if count:
+        logger.info(f"{count} wiederkehrende Rechnung(en) erstellt in "
+                    f"{time.perf_counter() - start:.1f}s")
+
+
+async def tick(context):
+    """Job der JobQueue. Ein Durchlauf am Monatsersten kann länger dauern
+    als das Intervall; er läuft daher als eigener Task weiter, und
+    folgende Aufrufe kehren sofort zurück, bis er fertig ist."""
+    global _task
+    if _task is not None and not _task.done():
+        return
+    _task = asyncio.create_task(_run(context.bot))
+
+
+async def stop():
+    """Bricht einen laufenden Durchlauf ab; die geholten Vorlagen kommen
+    nach RECURRING_LEASE Sekunden erneut"""
+    if _task is not None and not _task.done():
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
@@ -0,0 +1,182 @@
+import os
+import time
+import random
+import asyncio
+import logging
+
+import httpx
+
+# Gemeinsame Schutzschicht für Aufrufe externer Dienste (v. a. Supabase):
+# Wiederholungen mit exponentiellem Backoff und Jitter, ein Circuit
+# Breaker pro Endpunkt, ein globales Retry-Budget und eine Frist pro
+# Aufruf. Bei einem Ausfall schlagen Aufrufe so schnell fehl, statt dass
+# alle Handler gleichzeitig hängen und den Dienst mit Wiederholungen fluten.
+
+logger = logging.getLogger(__name__)
+
+
+class Unavailable(Exception):
+    """Dienst gerade nicht nutzbar (Circuit offen, Frist abgelaufen oder
+    Wiederholungen erschöpft)"""
+
+
+def backoff(attempt, base=0.2, cap=3.0):
+    """Wartezeit vor Wiederholung Nr. attempt (0-basiert), 'full jitter'"""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def is_retryable(exc):
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in (408, 429) or (
+            exc.response.status_code >= 500)
+    return isinstance(exc, (httpx.TransportError, ConnectionError))
+
+
+class CircuitBreaker:
+    """closed -> (failure_threshold Fehler in Folge) -> open -> nach
+    reset_timeout ein Probeaufruf (half-open) -> closed oder wieder open"""
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        """Wirft Unavailable bei offenem Circuit; True, wenn dieser Aufruf
+        der Probeaufruf ist"""
+        state = self.state
+        if state == "open" or (state == "half-open" and self._probing):
+            raise Unavailable(f"{self.name}: Circuit offen")
+        if state == "half-open":
+            self._probing = True
+            return True
+        return False
+
+    def release_probe(self):
+        """Probeaufruf abgebrochen: der nächste Aufruf darf proben"""
+        self._probing = False
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info(f"{self.name}: Circuit wieder geschlossen")
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if (self.opened_at is not None
+                or self.failures >= self.failure_threshold):
+            if self.opened_at is None:
+                logger.warning(f"{self.name}: Circuit geöffnet")
+            self.opened_at = time.monotonic()
+
+
+class RetryBudget:
+    """Wiederholungen höchstens als Anteil `ratio` aller Aufrufe
+    (plus `min_per_sec` als Grundrate), damit ein Ausfall nicht die Last
+    vervielfacht"""
+
+    def __init__(self, ratio=0.2, min_per_sec=1.0, capacity=20.0):
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens +
+                           (now - self._updated) * self.min_per_sec)
+        self._updated = now
+
+    def record_call(self):
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens + self.ratio)
+
+    def try_retry(self):
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+
+_breakers = {}
+_budget = None
+
+
+def get_breaker(endpoint):
+    breaker = _breakers.get(endpoint)
+    if breaker is None:
+        breaker = _breakers[endpoint] = CircuitBreaker(
+            endpoint,
+            failure_threshold=int(os.getenv("BREAKER_FAILURES", "5")),
+            reset_timeout=float(os.getenv("BREAKER_RESET", "30")))
+    return breaker
+
+
+def get_budget():
+    global _budget
+    if _budget is None:
+        _budget = RetryBudget(
+            ratio=float(os.getenv("RETRY_BUDGET_RATIO", "0.2")))
+    return _budget
+
+
+async def call(endpoint, fn, deadline=None, attempts=None):
+    """Führt await fn() mit Breaker, Retry-Budget, Backoff und Frist aus"""
+    deadline = deadline or float(os.getenv("DB_DEADLINE", "15"))
+    attempts = attempts or int(os.getenv("DB_RETRIES", "3"))
+    breaker = get_breaker(endpoint)
+    budget = get_budget()
+    budget.record_call()
+    try:
+        async with asyncio.timeout(deadline):
+            attempt = 0
+            while True:
+                probe = breaker.before_call()
+                try:
+                    result = await fn()
+                except Exception as e:
+                    if not is_retryable(e):
+                        # Fehler der Anfrage, nicht des Dienstes: schließt
+                        # den Circuit nicht, gibt aber die Probe frei
+                        if probe:
+                            breaker.release_probe()
+                        raise
+                    breaker.record_failure()
+                    attempt += 1
+                    if attempt >= attempts or not budget.try_retry():
+                        raise Unavailable(f"{endpoint}: {e}") from e
+                    logger.warning(f"{endpoint}: Versuch {attempt} "
+                                   f"fehlgeschlagen ({e}), wiederhole...")
+                    await asyncio.sleep(
+                        backoff(attempt - 1,
+                                float(os.getenv("DB_BACKOFF_BASE", "0.2")),
+                                float(os.getenv("DB_BACKOFF_CAP", "3"))))
+                    continue
+                except BaseException:
+                    # Abbruch (CancelledError) sagt nichts über den Dienst;
+                    # ohne Freigabe bliebe der Circuit halb offen gesperrt.
+                    # Nur der Probeaufruf selbst gibt die Probe frei.
+                    if probe:
+                        breaker.release_probe()
+                    raise
+                breaker.record_success()
+                return result
+    except TimeoutError:
+        breaker.record_failure()
+        raise Unavailable(f"{endpoint}: Frist von {deadline}s überschritten")
@@ -0,0 +1,72 @@
+import re
+
+from telegram import Update
+from telegram.ext import BaseHandler
+
+# Routing der Reply-Keyboard-Tasten: Statt einer Kette von
+# filters.Regex-Handlern (jede Textnachricht gegen jedes Muster, und
+# Teilstrings wie "Rechnung erstellen" in einem Kundennamen treffen)
+# bildet ein ButtonHandler die exakten Tastentexte über ein Dictionary auf
+# Handler ab – ein Lookup pro Nachricht, egal wie viele Menüpunkte es gibt.
+# Verglichen wird ohne führendes Emoji und ohne Groß-/Kleinschreibung, so
+# dass auch ein getipptes "einstellungen" trifft. Reguläre Ausdrücke gibt
+# es nur noch als Rückfall für freien Text, und sie müssen den ganzen Text
+# treffen.
+
+_PREFIX = re.compile(r"^[\W_]+")
+
+
+def normalize(text):
+    """Tastentext ohne führendes Emoji/Leerzeichen, kleingeschrieben"""
+    return _PREFIX.sub("", text.strip()).casefold()
+
+
+class ButtonHandler(BaseHandler):
+    """Leitet Textnachrichten (update.message.text) anhand des Tastentexts
+    an den passenden Callback; der Rückgabewert zählt wie bei jedem Handler
+    (auch als neuer Zustand im ConversationHandler)"""
+
+    def __init__(self, routes, fallbacks=(), block=True):
+        super().__init__(self._unrouted, block=block)
+        self.routes = {}
+        self.fallbacks = []
+        for label, callback in routes.items():
+            self.add(label, callback)
+        for pattern, callback in fallbacks:
+            self.fallback(pattern, callback)
+
+    def add(self, label, callback):
+        self.routes[normalize(label)] = callback
+
+    def fallback(self, pattern, callback):
+        if isinstance(pattern, str):
+            pattern = re.compile(pattern, re.IGNORECASE)
+        self.fallbacks.append((pattern, callback))
+
+    def match(self, text):
+        """Callback für `text` oder None"""
+        key = normalize(text)
+        callback = self.routes.get(key)
+        if callback is None:
+            for pattern, fallback in self.fallbacks:
+                if pattern.fullmatch(key):
+                    return fallback
+        return callback
+
+    def check_update(self, update):
+        if not isinstance(update, Update) or update.message is None:
+            return None
+        text = update.message.text
+        if not text or text.startswith("/"):
+            return None
+        return self.match(text)
+
+    async def handle_update(self, update, application, check_result,
+                            context):
+        self.collect_additional_context(context, update, application,
+                                        check_result)
+        return await check_result(update, context)
+
+    @staticmethod
+    async def _unrouted(update, context):
+        return None
@@ -0,0 +1,284 @@
+import os
+import heapq
+import asyncio
+import logging
+import itertools
+from collections import OrderedDict
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import metrics
+from ratelimit import TokenBucket
+
+# Ausgehende Bot-API-Aufrufe (builder.rate_limiter): Telegram erlaubt
+# etwa 30 Nachrichten/s insgesamt, ~1/s je Privatchat (kurze Spitzen ok)
+# und 20/min je Gruppe. Ein Bucket lässt in einer Sekunde bis zu Rate +
+# Kapazität durch, daher die Standardwerte 25 + 5 bzw. 1 + 2. Jeder Aufruf
+# mit chat_id wartet zuerst auf den Token-Bucket seines Chats (FIFO,
+# Reihenfolge im Chat bleibt erhalten), dann auf einen globalen Token.
+# Globale Tokens gehen nach Priorität: Antworten auf Nutzereingaben
+# (INTERACTIVE) vor Fortschritt, Export und Benachrichtigungen (BULK, per
+# rate_limit_args=BULK). Chat-Buckets liegen in LRU-Reihenfolge; ab
+# max_chats fallen die am längsten ruhenden weg.
+#
+# Mehrere editMessageText auf dieselbe Nachricht, die noch warten, werden
+# zusammengefasst: gesendet wird nur der neueste Stand, ältere Aufrufe
+# bekommen dessen Ergebnis. Antwortet Telegram trotzdem mit 429, pausiert
+# der Chat (ohne chat_id: alles) für retry_after und der Aufruf wird bis
+# zu TELEGRAM_MAX_RETRIES-mal wiederholt.
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BULK = 1
+
+retry_after_total = metrics.Counter("bot_telegram_retry_after_total",
+                                    "429-Antworten der Bot API")
+coalesced_total = metrics.Counter("bot_telegram_coalesced_total",
+                                  "Zusammengefasste editMessageText-Aufrufe")
+
+
+class _EditState:
+    """Bearbeitungen einer Nachricht: `pending` ist das gemeinsame Future
+    aller noch nicht gesendeten Stände, `seq` die Nummer des neuesten"""
+    __slots__ = ("seq", "pending", "active", "last_result")
+
+    def __init__(self):
+        self.seq = 0
+        self.pending = None
+        self.active = 0
+        self.last_result = True
+
+
+def _copy_result(source, target):
+    if target.done():
+        return
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+class SendLimiter(BaseRateLimiter):
+
+    def __init__(self, global_rate=25, global_burst=5, chat_rate=1,
+                 chat_burst=2, group_rate=20 / 60, group_burst=2,
+                 max_retries=3, max_chats=10000):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._global = TokenBucket(global_rate, global_burst)
+        # Zuletzt benutzte Chats hinten (LRU)
+        self._chats = OrderedDict()
+        self._paused = {}
+        self._waiting = []
+        self._seq = itertools.count()
+        self._dispatcher = None
+        self._edits = {}
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        for _, _, fut in self._waiting:
+            fut.cancel()
+        self._waiting.clear()
+
+    # --- BUCKETS ---
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is not None:
+            self._chats.move_to_end(chat_id)
+            return bucket
+        # Am längsten unbenutzte Chats zuerst; ein voller Bucket gehört zu
+        # einem ruhenden Chat und kann weg, ein nicht voller bleibt
+        while len(self._chats) >= self.max_chats:
+            oldest = next(iter(self._chats.values()))
+            if oldest.wait_time(oldest.capacity) != 0:
+                break
+            self._chats.popitem(last=False)
+        # Gruppen/Kanäle: negative ID oder @name
+        group = isinstance(chat_id, str) or chat_id < 0
+        bucket = self._chats[chat_id] = (TokenBucket(
+            self.group_rate, self.group_burst) if group else TokenBucket(
+                self.chat_rate, self.chat_burst))
+        return bucket
+
+    async def _wait_paused(self, chat_id):
+        loop = asyncio.get_running_loop()
+        while True:
+            until = max(self._paused.get(None, 0),
+                        self._paused.get(chat_id, 0))
+            if until <= loop.time():
+                return
+            await asyncio.sleep(until - loop.time())
+
+    def _pause(self, chat_id, seconds):
+        until = asyncio.get_running_loop().time() + seconds
+        self._paused[chat_id] = max(self._paused.get(chat_id, 0), until)
+
+    async def _global_slot(self, priority):
+        if not self._waiting and self._global.try_acquire():
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._seq), fut))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await fut
+
+    async def _dispatch(self):
+        """Vergibt globale Tokens an die Wartenden, höchste Priorität vorn"""
+        while self._waiting:
+            await self._wait_paused(None)
+            if not self._global.try_acquire():
+                await asyncio.sleep(self._global.wait_time())
+                continue
+            while self._waiting:
+                _, _, fut = heapq.heappop(self._waiting)
+                if not fut.done():
+                    fut.set_result(None)
+                    break
+
+    # --- ANFRAGEN ---
+
+    async def process_request(self, callback, args, kwargs, endpoint, data,
+                              rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            # getFile, answerCallbackQuery, ...: keine Chat-Nachricht
+            return await self._call(callback, args, kwargs, endpoint)
+        priority = rate_limit_args if isinstance(rate_limit_args,
+                                                 int) else INTERACTIVE
+        bucket = self._chat_bucket(chat_id)
+        if endpoint == "editMessageText" and data.get("message_id"):
+            return await self._edit(callback, args, kwargs, endpoint,
+                                    chat_id, data["message_id"], bucket,
+                                    priority)
+        attempt = 0
+        while True:
+            await bucket.acquire()
+            await self._wait_paused(chat_id)
+            await self._global_slot(priority)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                attempt += 1
+                self._retry_after(e, endpoint, chat_id, attempt)
+                if attempt > self.max_retries:
+                    raise
+
+    async def _edit(self, callback, args, kwargs, endpoint, chat_id,
+                    message_id, bucket, priority):
+        key = (chat_id, message_id)
+        state = self._edits.get(key)
+        if state is None:
+            state = self._edits[key] = _EditState()
+        state.seq += 1
+        mine = state.seq
+        if state.pending is None:
+            state.pending = asyncio.get_running_loop().create_future()
+        fut = state.pending
+        state.active += 1
+        try:
+            attempt = 0
+            while True:
+                # Auf den Chat-Token warten, ohne ihn für einen veralteten
+                # Stand zu verbrauchen
+                while state.seq == mine and not bucket.try_acquire():
+                    await asyncio.sleep(bucket.wait_time())
+                if state.seq == mine:
+                    await self._wait_paused(chat_id)
+                    await self._global_slot(priority)
+                if state.seq != mine:
+                    coalesced_total.inc()
+                    if state.pending is not None and state.pending is not fut:
+                        # Unser Stand bekam 429, inzwischen wartet ein
+                        # neuerer: dessen Ergebnis gilt auch hier
+                        state.pending.add_done_callback(
+                            lambda f: _copy_result(f, fut))
+                    elif state.pending is None and not fut.done():
+                        # Der neuere Stand ist bereits gesendet
+                        fut.set_result(state.last_result)
+                    return await asyncio.shield(fut)
+                # Ab hier sammeln neuere Stände ein neues Future
+                if state.pending is fut:
+                    state.pending = None
+                try:
+                    result = await callback(*args, **kwargs)
+                except RetryAfter as e:
+                    attempt += 1
+                    self._retry_after(e, endpoint, chat_id, attempt)
+                    if attempt > self.max_retries:
+                        fut.set_exception(e)
+                        raise
+                    if state.seq == mine:
+                        state.pending = fut
+                    continue
+                except Exception as e:
+                    fut.set_exception(e)
+                    raise
+                state.last_result = result
+                fut.set_result(result)
+                return result
+        finally:
+            state.active -= 1
+            if not state.active:
+                self._edits.pop(key, None)
+            if not fut.done() and state.seq == mine:
+                # Abgebrochen (Shutdown): sonst wartet hier niemand mehr
+                if state.pending is fut:
+                    state.pending = None
+                fut.cancel()
+            elif fut.done() and not fut.cancelled():
+                # Wird nur abgerufen, wenn ältere Bearbeitungen warten
+                fut.exception()
+
+    def _retry_after(self, e, endpoint, chat_id, attempt):
+        retry_after_total.inc()
+        seconds = e.retry_after
+        if hasattr(seconds, "total_seconds"):
+            seconds = seconds.total_seconds()
+        self._pause(chat_id, float(seconds))
+        logger.warning(f"{endpoint} an {chat_id}: 429, Pause {seconds}s "
+                       f"(Versuch {attempt})")
+
+    async def _call(self, callback, args, kwargs, endpoint):
+        attempt = 0
+        while True:
+            await self._wait_paused(None)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                attempt += 1
+                self._retry_after(e, endpoint, None, attempt)
+                if attempt > self.max_retries:
+                    raise
+
+
+def build_limiter():
+    """SendLimiter aus der Umgebung; TELEGRAM_RATE_LIMIT=0 schaltet ab"""
+    if os.getenv("TELEGRAM_RATE_LIMIT", "1") == "0":
+        return None
+    return SendLimiter(
+        global_rate=float(os.getenv("TELEGRAM_GLOBAL_RATE", "25")),
+        global_burst=int(os.getenv("TELEGRAM_GLOBAL_BURST", "5")),
+        chat_rate=float(os.getenv("TELEGRAM_CHAT_RATE", "1")),
+        chat_burst=int(os.getenv("TELEGRAM_CHAT_BURST", "2")),
+        group_rate=float(os.getenv("TELEGRAM_GROUP_RATE", "20")) / 60,
+        group_burst=int(os.getenv("TELEGRAM_GROUP_BURST", "2")),
+        max_retries=int(os.getenv("TELEGRAM_MAX_RETRIES", "3")))
+
+
+def lane(bot, priority):
+    """rate_limit_args für Bot-Methoden; ohne Limiter None (PTB lehnt
+    rate_limit_args sonst ab)"""
+    return priority if getattr(bot, "rate_limiter", None) else None
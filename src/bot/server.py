@@ -0,0 +1,167 @@
+import os
+import hmac
+import asyncio
+import logging
+import ipaddress
+
+from telegram import Update
+from telegram.ext import Application
+
+import db
+import metrics
+import prefill
+
+# Webhook-Betrieb: Telegram schickt Updates per HTTPS an uns, ein
+# ASGI-Server (uvicorn + Starlette) nimmt sie an und legt sie in die
+# update_queue der Application. Mehrere Repliken hinter einem Load
+# Balancer können sich so den Verkehr teilen.
+#
+# Derselbe Server liefert auch die Vorbelegung der WebApps
+# (GET /prefill/<token>, siehe prefill.py). Im Polling-Betrieb läuft er
+# dafür ohne Webhook-Route im Hintergrund, sobald PREFILL_BASE_URL gesetzt
+# ist oder METRICS_ENABLED=1. GET /metrics liefert die Metriken aus
+# metrics.py: mit METRICS_TOKEN gegen "Authorization: Bearer <token>",
+# ohne Token nur an Clients auf localhost.
+#
+# uvicorn und Starlette werden erst beim Start des Servers geladen, im
+# Polling-Betrieb also nach dem ersten getUpdates (main.warm_up).
+
+logger = logging.getLogger(__name__)
+
+
+def webhook_secret_missing():
+    return ("WEBHOOK_SECRET fehlt: ohne Secret nimmt der öffentliche "
+            "Webhook-Endpunkt Updates von jedem an")
+
+
+def is_loopback(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def build_asgi_app(application: Application, webhook=True):
+    from starlette.applications import Starlette
+    from starlette.middleware import Middleware
+    from starlette.middleware.cors import CORSMiddleware
+    from starlette.requests import Request
+    from starlette.responses import JSONResponse, PlainTextResponse, Response
+    from starlette.routing import Route
+
+    secret = os.getenv("WEBHOOK_SECRET", "")
+    path = os.getenv("WEBHOOK_PATH", "/telegram")
+    if webhook and not secret:
+        raise RuntimeError(webhook_secret_missing())
+
+    async def telegram_update(request: Request):
+        if not hmac.compare_digest(
+                request.headers.get("X-Telegram-Bot-Api-Secret-Token",
+                                    "").encode(), secret.encode()):
+            return Response(status_code=403)
+        try:
+            update = Update.de_json(await request.json(), application.bot)
+        except Exception as e:
+            logger.warning(f"Ungültiges Update verworfen: {e}")
+            return Response(status_code=400)
+        await application.update_queue.put(update)
+        return Response()
+
+    async def healthz(request: Request):
+        return PlainTextResponse("ok")
+
+    async def prefill_data(request: Request):
+        data = await prefill.resolve(
+            request.path_params["token"],
+            request.headers.get("X-Telegram-Init-Data"), db.get_profile)
+        if data is None:
+            return Response(status_code=404)
+        return JSONResponse(data, headers={"Cache-Control": "no-store"})
+
+    async def metrics_text(request: Request):
+        token = os.getenv("METRICS_TOKEN")
+        if token:
+            if not hmac.compare_digest(
+                    request.headers.get("Authorization", "").encode(),
+                    f"Bearer {token}".encode()):
+                return Response(status_code=403)
+        elif request.client is None or not is_loopback(request.client.host):
+            return Response(status_code=403)
+        return PlainTextResponse(metrics.render(),
+                                 media_type="text/plain; version=0.0.4")
+
+    routes = [
+        Route("/healthz", healthz, methods=["GET"]),
+        Route("/metrics", metrics_text, methods=["GET"]),
+        Route("/prefill/{token}", prefill_data, methods=["GET"])
+    ]
+    if webhook:
+        routes.append(Route(path, telegram_update, methods=["POST"]))
+    origins = os.getenv("PREFILL_ALLOW_ORIGINS",
+                        "https://atashkayev-stack.github.io").split(",")
+    return Starlette(routes=routes,
+                     middleware=[
+                         Middleware(CORSMiddleware,
+                                    allow_origins=origins,
+                                    allow_methods=["GET"],
+                                    allow_headers=["X-Telegram-Init-Data"])
+                     ])
+
+
+def _uvicorn_server(app):
+    import uvicorn
+    return uvicorn.Server(
+        uvicorn.Config(app=app,
+                       host=os.getenv("HOST", "0.0.0.0"),
+                       port=int(os.getenv("PORT", "8080")),
+                       log_level=os.getenv("UVICORN_LOG_LEVEL", "warning"),
+                       use_colors=False))
+
+
+_background = None
+
+
+async def start_background(application: Application):
+    """Polling-Betrieb: HTTP-Server (ohne Webhook) im laufenden Event-Loop"""
+    global _background
+    webserver = _uvicorn_server(build_asgi_app(application, webhook=False))
+    # Signale behandelt run_polling
+    webserver.install_signal_handlers = lambda: None
+    _background = (webserver, asyncio.create_task(webserver.serve()))
+    logger.info("HTTP-Server (Vorbelegung/Metriken) läuft...")
+
+
+async def stop_background():
+    global _background
+    if _background is not None:
+        webserver, task = _background
+        _background = None
+        webserver.should_exit = True
+        await task
+
+
+async def run_webhook(application: Application):
+    """Startet Application und ASGI-Server und läuft bis zum Beenden"""
+    if not os.getenv("WEBHOOK_SECRET"):
+        raise RuntimeError(webhook_secret_missing())
+    webserver = _uvicorn_server(build_asgi_app(application))
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        # Nur eine Replik muss den Webhook bei Telegram eintragen
+        if os.getenv("WEBHOOK_URL") and os.getenv("WEBHOOK_SET_ON_START",
+                                                  "0") == "1":
+            await application.bot.set_webhook(
+                url=os.getenv("WEBHOOK_URL").rstrip("/") +
+                os.getenv("WEBHOOK_PATH", "/telegram"),
+                secret_token=os.getenv("WEBHOOK_SECRET"),
+                allowed_updates=Update.ALL_TYPES)
+        await application.start()
+        logger.info("Webhook-Server läuft...")
+        try:
+            await webserver.serve()
+        finally:
+            await application.stop()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
@@ -0,0 +1,170 @@
+import os
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from typing import NamedTuple
+
+# Rechnungssummen auf dem Server: exakt in ganzen Cent (int), kaufmännisch
+# gerundet (ROUND_HALF_UP), für die deutschen Steuersätze 0/7/19 %.
+#
+#   rounding="invoice"  USt. je Steuersatz aus der Nettosumme (Standard)
+#   rounding="line"     USt. je Position gerundet und summiert
+#
+# Mengen und Preise werden einmal in skalierte Ganzzahlen umgerechnet
+# (Menge in 1/1000, Preis in 1/10000 €); das Netto je (Menge, Preis) ist
+# gecacht, jede Position kostet danach einen Cache-Zugriff und etwas
+# Integer-Arithmetik. Ganze Berechnungen werden über ihre Positionen als
+# Schlüssel zusätzlich im LRU-Cache gehalten.
+
+VAT_RATES = (0, 7, 19)
+QTY_SCALE = 1000
+PRICE_SCALE = 10000
+# Netto einer Position in 1/(1000*10000) € -> Cent
+_LINE_UNIT = QTY_SCALE * PRICE_SCALE // 100
+# Vorberechnet je Steuersatz: (Zähler, Nenner) für USt. in Cent
+RATE_TABLE = {rate: (rate, 100) for rate in VAT_RATES}
+# Abweichung der Client-Summen (JavaScript-Floats), die noch toleriert wird
+TOLERANCE = Decimal("0.01")
+
+
+class TotalsMismatch(ValueError):
+    """Übermittelte Summen weichen von der Serverberechnung ab"""
+
+
+class Totals(NamedTuple):
+    net: int
+    vat: int
+    gross: int
+    # ((steuersatz, netto, ust), ...) aufsteigend nach Steuersatz
+    by_rate: tuple
+    line_nets: tuple
+
+
+def _div_half_up(value, unit):
+    """Ganzzahlige Division mit kaufmännischer Rundung (auch negativ)"""
+    q, r = divmod(abs(value), unit)
+    if 2 * r >= unit:
+        q += 1
+    return q if value >= 0 else -q
+
+
+@lru_cache(maxsize=65536)
+def _scaled(raw, scale):
+    try:
+        value = Decimal(str(raw))
+    except InvalidOperation:
+        raise ValueError(f"keine Zahl: {raw!r}")
+    if not value.is_finite():
+        raise ValueError(f"keine Zahl: {raw!r}")
+    return _div_half_up(int(value * scale * 10), 10)
+
+
+@lru_cache(maxsize=256)
+def _rate(raw):
+    try:
+        rate = Decimal(str(raw))
+    except InvalidOperation:
+        raise ValueError(f"unbekannter Steuersatz: {raw}")
+    if rate not in RATE_TABLE:
+        raise ValueError(f"unbekannter Steuersatz: {raw}")
+    return int(rate)
+
+
+# Häufige Rohwerte des Steuersatzes ohne Umweg über Decimal (19 == 19.0)
+_RATE_FAST = {**{r: r for r in VAT_RATES}, **{str(r): r for r in VAT_RATES}}
+
+
+@lru_cache(maxsize=65536)
+def _line_net(qty, price):
+    """Netto einer Position in Cent"""
+    return _div_half_up(
+        _scaled(qty, QTY_SCALE) * _scaled(price, PRICE_SCALE), _LINE_UNIT)
+
+
+def to_euro(value):
+    """Cent -> Decimal in Euro"""
+    return Decimal(value).scaleb(-2)
+
+
+@lru_cache(maxsize=4096)
+def compute(items, rounding="invoice"):
+    """items: Tupel aus (menge, einzelpreis, steuersatz), Zahl oder Text"""
+    line_nets = []
+    net_by_rate = {}
+    vat_by_rate = {}
+    for qty, price, raw_rate in items:
+        rate = _RATE_FAST.get(raw_rate)
+        if rate is None:
+            rate = _rate(raw_rate)
+        net = _line_net(qty, price)
+        line_nets.append(net)
+        net_by_rate[rate] = net_by_rate.get(rate, 0) + net
+        if rounding == "line":
+            num, den = RATE_TABLE[rate]
+            vat_by_rate[rate] = vat_by_rate.get(rate, 0) + _div_half_up(
+                net * num, den)
+    if rounding != "line":
+        for rate, net in net_by_rate.items():
+            num, den = RATE_TABLE[rate]
+            vat_by_rate[rate] = _div_half_up(net * num, den)
+    by_rate = tuple((rate, net_by_rate[rate], vat_by_rate[rate])
+                    for rate in sorted(net_by_rate))
+    net = sum(net_by_rate.values())
+    vat = sum(vat_by_rate.values())
+    return Totals(net, vat, net + vat, by_rate, tuple(line_nets))
+
+
+def line_items(inv):
+    """Positionen der WebApp-Daten als (beschreibung, menge, preis, satz);
+    Formulare ohne 'items' ergeben eine Position aus amount/vat_rate"""
+    items = inv.get("items")
+    if not items:
+        return [(inv.get("description") or "", "1", str(inv.get("amount")
+                                                         or 0),
+                 str(inv.get("vat_rate") or 0))]
+    default_rate = inv.get("vat_rate") or 0
+    return [(it.get("description") or "", str(it.get("quantity", 1)),
+             str(it.get("unit_price", 0)), str(it.get("vat_rate",
+                                                      default_rate)))
+            for it in items]
+
+
+def rounding_mode(inv):
+    return inv.get("rounding") or os.getenv("TOTALS_ROUNDING", "invoice")
+
+
+def compute_invoice(inv):
+    """Summen der WebApp-Daten; ValueError bei ungültigen Daten"""
+    # Schlüssel direkt aus den Rohwerten: bei einem Cache-Treffer wird
+    # nichts umgewandelt. Listen oder Objekte statt Zahlen (nicht hashbar)
+    # und Positionen, die keine Objekte sind, fallen schon hier auf.
+    try:
+        items = inv.get("items")
+        if not items:
+            key = ((1, inv.get("amount") or 0, inv.get("vat_rate") or 0), )
+        else:
+            rate = inv.get("vat_rate") or 0
+            key = tuple((it.get("quantity", 1), it.get("unit_price", 0),
+                         it.get("vat_rate", rate)) for it in items)
+        hash(key)
+    except (AttributeError, TypeError):
+        raise ValueError("ungültige Rechnungsdaten") from None
+    return compute(key, rounding_mode(inv))
+
+
+def verify(inv):
+    """Berechnet die Summen neu und prüft amount/total des Clients.
+
+    Wirft TotalsMismatch (bzw. ValueError bei ungültigen Zahlen oder
+    Steuersätzen); liefert sonst die Totals."""
+    totals = compute_invoice(inv)
+    for field, expected in (("amount", totals.net), ("total", totals.gross)):
+        if inv.get(field) is None:
+            continue
+        try:
+            sent = Decimal(str(inv[field]))
+        except InvalidOperation:
+            raise ValueError(f"keine Zahl: {inv[field]!r}")
+        if abs(sent - to_euro(expected)) >= TOLERANCE:
+            raise TotalsMismatch(
+                f"{field}: übermittelt {sent}, berechnet {to_euro(expected)}")
+    return totals
@@ -0,0 +1,66 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Parallele Verarbeitung von Updates, aber der Reihe nach je Nutzer:
+# Der ConversationHandler (Einstellungen) erwartet die Updates eines
+# Gesprächs nacheinander; zwei schnelle Tastendrücke desselben Nutzers
+# dürfen sich den Gesprächszustand nicht gegenseitig überschreiben.
+# Updates verschiedener Nutzer laufen weiterhin gleichzeitig (bis
+# CONCURRENT_UPDATES). Wartende Updates eines Nutzers belegen dabei schon
+# einen dieser Plätze. Gesperrt wird nur, bis die Handler eines Updates
+# zurückkehren: Lange Handler (Export, Import, Dokumentanalyse) sind mit
+# block=False registriert und laufen als eigene Tasks weiter, damit z.B.
+# "Zurück" oder /start nicht auf sie warten. Unter derselben Sperre
+# gleichen SharedConversationHandler ihren Zustand mit Redis ab, damit
+# mehrere Bot-Instanzen denselben Gesprächsstand sehen.
+
+
+def _key(update):
+    if isinstance(update, Update):
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+
+    def __init__(self, max_concurrent_updates, conversations=()):
+        super().__init__(max_concurrent_updates)
+        # Nutzer-ID -> [Lock, Anzahl laufender/wartender Updates]
+        self._locks = {}
+        # SharedConversationHandler, deren Zustände um jedes Update herum
+        # mit Redis abgeglichen werden (persistence.py)
+        self.conversations = list(conversations)
+
+    async def do_process_update(self, update, coroutine):
+        key = _key(update)
+        if key is None:
+            await coroutine
+            return
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                pulled = [(conv, await conv.pull(update))
+                          for conv in self.conversations]
+                try:
+                    await coroutine
+                finally:
+                    for conv, state in pulled:
+                        await conv.push(state)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
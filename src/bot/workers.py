@@ -0,0 +1,56 @@
+import os
+import asyncio
+import importlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Gemeinsamer Prozess-Pool für CPU-lastige Arbeit (PDF-Rendering usw.),
+# damit der Event-Loop des Bots nie darauf warten muss.
+
+_pool = None
+
+
+def get_process_pool():
+    global _pool
+    if _pool is None:
+        workers = int(os.getenv("WORKER_PROCESSES", "0")) or None
+        _pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def pool_size():
+    return get_process_pool()._max_workers
+
+
+def preload(modules):
+    """Importiert `modules`; gibt die PID des Prozesses zurück"""
+    for name in modules:
+        importlib.import_module(name)
+    return os.getpid()
+
+
+async def warm_up(modules=()):
+    """Startet alle Worker-Prozesse und lädt dort schon `modules`, damit
+    der erste Auftrag nicht auf Prozessstart und Imports wartet"""
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    # Jeder Auftrag startet einen neuen Prozess, solange keiner frei ist
+    pids = await asyncio.gather(*(loop.run_in_executor(pool, preload,
+                                                       modules)
+                                  for _ in range(pool_size())))
+    return len(set(pids))
+
+
+async def run_in_process(fn, *args):
+    """Führt fn(*args) im Prozess-Pool aus und wartet asynchron auf das Ergebnis"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(), fn, *args)
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None